@@ -0,0 +1,269 @@
+# Benchmark of cars.Car and cars.Position (with __slots__, cached edge references and coordinates computed only when read)
+# against the original classes, which used a __dict__ per object, looked the edge up by tuple key at every use and
+# computed the coordinates at every move: time per step, and memory per car
+
+# Usage: python -m benchmarks.cars [--memory-cars 100000]
+
+import argparse
+import contextlib
+import gc
+import io
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import simulator.cars as cars
+import simulator.networks as networks
+import simulator.streams as streams
+
+
+class LegacyPosition:
+    """
+    The original Position: changeNodes calls __init__ again, and every move computes the coordinates.
+    Kept here only as the baseline for the benchmark.
+    """
+    def __init__(self, graph, nodeFrom, nodeTo, dist = 0, carSize = 5):
+        s = self
+        s.graph = graph
+        s.eqTol = carSize
+        s.carSize = carSize
+        s.lanes = graph.lanes
+        s.nodeFrom = nodeFrom
+        s.nodeTo = nodeTo
+        s.direction = (s.nodeTo > s.nodeFrom)
+        s.atNode = False
+        if s.nodeFrom == s.nodeTo:
+            s.atNode = True
+            s.coords = s.graph.nodes[s.nodeTo]["coords"]
+            s.xPos, s.yPos = s.coords
+            if self.lanes:
+                self.graph.nodes[self.nodeTo]["population"].append(self)
+            return
+        s.length = graph.edges[(s.nodeFrom, s.nodeTo)]["length"]
+        if s.direction:
+            s.dist = dist
+            s.toNext = s.length - dist
+        else:
+            s.dist = s.length - dist
+            s.toNext = s.dist
+        if dist > s.length+1:
+            raise ValueError("The distance along an edge must be less than the edge's length.")
+        s.fromCoords = s.graph.nodes[s.nodeFrom]["coords"]
+        s.toCoords = s.graph.nodes[s.nodeTo]["coords"]
+        s.calcCoords()
+
+    def calcCoords(self):
+        prog = (self.toNext if self.direction else self.dist) / float(self.length)
+        self.xPos = int(prog * self.fromCoords[0] + (1-prog) * self.toCoords[0])
+        self.yPos = int(prog * self.fromCoords[1] + (1-prog) * self.toCoords[1])
+        if self.lanes:
+            xDiff = float(self.toCoords[0] - self.fromCoords[0])
+            yDiff = float(self.toCoords[1] - self.fromCoords[1])
+            self.xPos += int((self.carSize * 1.5) * (-yDiff/self.length))
+            self.yPos += int((self.carSize * 1.5 ) * (xDiff/self.length))
+        self.coords = (self.xPos, self.yPos)
+
+    def update(self, displace):
+        if self.atNode:
+            raise ValueError("A car at a node cannot move, it needs a new destination node")
+        if self.lanes:
+            if self.toNext <= displace:
+                if self.graph.nodes[self.nodeTo]["capacity"] > len(self.graph.nodes[self.nodeTo]["population"]):
+                    self.graph.nodes[self.nodeTo]["population"].append(self)
+                    self.atNode = True
+                    self.toNext = 0
+                    self.dist += displace if self.direction else -displace
+                    self.coords = self.toCoords
+                    self.xPos, self.yPos = self.coords
+                    return
+                else:
+                    return
+        self.dist += displace if self.direction else -displace
+        self.toNext = self.length - self.dist if self.direction else self.dist
+        self.calcCoords()
+        if not self.lanes and self.toNext <= 0:
+            self.atNode = True
+            self.graph.nodes[self.nodeTo]["population"].append(self)
+            self.coords = self.toCoords
+            self.xPos, self.yPos = self.coords
+
+    def changeNodes(self, newNode):
+        if not self.atNode:
+            raise ValueError("A car not at its destination node cannot change destination nodes")
+        if self.toNext > self.carSize:
+            print("A car skipped an edge, somehow.")
+        if not (self.nodeTo, newNode) in self.graph.edges:
+            raise ValueError("A car tried to move to a nonexistent edge.")
+        self.graph.nodes[self.nodeTo]["population"].remove(self)
+        self.__init__(self.graph, self.nodeTo, newNode, carSize=self.eqTol)
+
+
+class LegacyCar:
+    """
+    The original Car, which looks up its edge, lane and speed limit by tuple key. Kept here only as the baseline for the benchmark.
+    """
+    def __init__(self, graph, carBehavior = {}):
+        self.graph = graph
+        self.lanes = self.graph.lanes
+        self.weighted = self.graph.weighted
+        self.randomBehavior = carBehavior.get("randomBehavior", True)
+        self.pos = carBehavior.get("pos", 0)
+        self.accel = carBehavior.get("accel", 5)
+        self.nodeWait = carBehavior.get("nodeWait", 1)
+        self.carSize = carBehavior.get("carSize", 5)
+        self.mistakes = carBehavior.get("mistakes", False)
+        self.currentWait = 0
+        self.lifetime = 0
+        self.carId = graph.carCount
+        graph.carCount += 1
+        self.spawnStep = graph.stepCount
+        self.random = graph.streams.stream(self.carId) if graph.streams is not None else streams.GLOBAL
+        startNode = carBehavior.get("startNode")
+        if startNode is None:
+            startNode = self.random.choice(self.graph.endNodes)
+        startNodes = (startNode, self.graph.nodes[startNode]["connect"][0])
+        self.pos = LegacyPosition(self.graph, startNodes[0], startNodes[1], 0)
+        if not self.randomBehavior:
+            self.nodeGoal = carBehavior.get("nodeGoal")
+            if self.nodeGoal is None:
+                self.nodeGoal = self.random.choice(graph.endNodes)
+            self.routeId = self.graph.internRoute(self.pos.nodeTo, self.nodeGoal)
+            self.cursor = 1
+        self.history = []
+        self.history += startNodes
+        self.speedLimit = self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["speed"]
+        self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].append(self)
+        self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
+        self.velocity = 0
+
+    updatePosition = cars.Car.updatePosition
+    accelWithFollowing = cars.Car.accelWithFollowing
+    getNextCarEdge = cars.Car.getNextCarEdge
+
+    def accelWithoutFollowing(self):
+        decelDist = self.accel * sum(range(int(self.velocity/self.accel)+1))
+        if self.graph.weighted:
+            self.speedLimit = self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["weighted speed"][self.pos.direction]
+        if self.pos.toNext > self.velocity + self.accel +  decelDist:
+            if self.velocity < self.speedLimit:
+                speedUnder = self.speedLimit-self.velocity
+                return self.accel if speedUnder >= self.accel else speedUnder
+        if self.pos.toNext <= self.carSize and self.velocity < self.accel:
+            return self.accel - self.velocity
+        elif self.pos.toNext <= decelDist:
+            return -self.accel
+        return 0
+
+    def nodeBehavior(self):
+        if self.currentWait < self.nodeWait:
+            self.currentWait += 1
+            return
+        if self.randomBehavior:
+            newNode = self.random.choice(self.graph.nodes[self.pos.nodeTo]["connect"])
+        else:
+            route = self.graph.routes[self.routeId]
+            if self.pos.nodeTo == self.nodeGoal or self.cursor >= len(route):
+                self.graph.nodes[self.pos.nodeTo]["population"].remove(self.pos)
+                self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].remove(self)
+                self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
+                travelDist = sum( [ self.graph.edges[(self.history[i], self.history[i+1])]["length"] for i in range(len(self.history)-1) ] )
+                self.graph.recordTrip(self.carId, self.spawnStep, self.lifetime, self.history, travelDist)
+                return True
+            else:
+                if not self.mistakes:
+                    newNode = route[self.cursor]
+                else:
+                    diceRoll = self.random.randint(10)
+                    if diceRoll < 9:
+                        newNode = route[self.cursor]
+                    else:
+                        opts = self.graph.nodes[self.pos.nodeTo]["connect"]
+                        ind = opts.index(route[self.cursor])
+                        newNode = opts[ind-1]
+                        self.routeId = self.graph.internRoute(newNode, self.nodeGoal)
+                        self.cursor = 0
+        if self.lanes:
+            population = self.graph.edges[(self.pos.nodeTo, newNode)]["population"][0 if self.pos.nodeTo > newNode else 1]
+            if len(population) > 0:
+                nextCar = population[-1]
+                if nextCar.pos.toNext >= nextCar.pos.length - self.carSize:
+                    return
+        self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].remove(self)
+        self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
+        self.pos.changeNodes(newNode)
+        self.history.append(newNode)
+        if not self.randomBehavior:
+            self.cursor += 1
+        self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].append(self)
+        self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
+        self.currentWait = 0
+        self.speedLimit = self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["speed"]
+        return
+
+
+def simulate(carClass, table, mode, carsNum, steps, carSettings, seed = 1):
+    """
+    Runs steps steps with carsNum cars of carClass, spawning new ones as run.stepCars does. Returns the time per step and the graph.
+    """
+    np.random.seed(seed)
+    graph = networks.makeGraph(table, lanes = mode == "lanes", weighted = mode == "weighted")
+    carList = [carClass(graph, carSettings) for i in range(carsNum)]
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(steps):
+            graph.stepCount += 1
+            if graph.weighted:
+                graph.updateWeights()
+            for car in list(carList):
+                if car.updatePosition():
+                    carList.remove(car)
+            while len(carList) < carsNum:
+                carList.append(carClass(graph, carSettings))
+    return (time.time() - start) / steps, graph
+
+
+def memoryPerCar(carClass, table, carsNum, carSettings):
+    """
+    Bytes allocated per car by creating carsNum cars of carClass (with their Position, history and lane links).
+    """
+    np.random.seed(1)
+    graph = networks.makeGraph(table)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    carList = [carClass(graph, carSettings) for i in range(carsNum)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del carList
+    return used / float(carsNum)
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Compare cars.Car and cars.Position with the original classes.")
+    parser.add_argument("--nodes", type = int, default = 2500)
+    parser.add_argument("--cars", type = int, default = 2000)
+    parser.add_argument("--steps", type = int, default = 300)
+    parser.add_argument("--memory-cars", type = int, default = 100000)
+    opts = parser.parse_args(args)
+    # the original classes index the lanes with NumPy booleans, which NumPy warns about when run as __main__
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    table = networks.generate("grid", opts.nodes, oneWayRatio = 0.2)
+    for mode in ("lanes", "weighted"):
+        for carSettings in (dict(randomBehavior = False), dict(randomBehavior = True)):
+            legacyTime, legacyGraph = simulate(LegacyCar, table, mode, opts.cars, opts.steps, carSettings)
+            newTime, newGraph = simulate(cars.Car, table, mode, opts.cars, opts.steps, carSettings)
+            print("{0:<8} {1:<15} cars: {2:>6} \t original: {3:7.2f} ms/step \t current: {4:7.2f} ms/step \t speedup: {5:5.2f}x \t "
+                  "same history: {6}".format(mode, "random" if carSettings["randomBehavior"] else "planned", opts.cars,
+                  legacyTime * 1000, newTime * 1000, legacyTime / newTime, legacyGraph.history == newGraph.history))
+
+    # random behavior: no routes, so only the cars themselves are counted
+    carSettings = dict(randomBehavior = True)
+    legacyBytes = memoryPerCar(LegacyCar, table, opts.memory_cars, carSettings)
+    newBytes = memoryPerCar(cars.Car, table, opts.memory_cars, carSettings)
+    print("memory at {0} cars \t original: {1:6.0f} bytes/car \t current: {2:6.0f} bytes/car \t saved: {3:6.0f} bytes/car ({4:.1f} MB in all)".format(
+          opts.memory_cars, legacyBytes, newBytes, legacyBytes - newBytes, (legacyBytes - newBytes) * opts.memory_cars / 1e6))
+
+
+if __name__ == "__main__":
+    main()
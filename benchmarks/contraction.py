@@ -0,0 +1,71 @@
+# Microbenchmark for the contraction hierarchy: preprocessing time, and query time against cars.routePlan (heap A*)
+
+# Usage: python -m benchmarks.contraction [--nodes 100 900 2500 10000]
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import simulator.graphGen as graphGen
+import simulator.cars as cars
+import simulator.contraction as contraction
+import simulator.networks as networks
+from benchmarks.routing import timeQueries
+from simulator.scenarios import routeTime
+
+
+def benchmark(name, graph, queries = 200, seed = 1):
+    """
+    Prints the preprocessing time and size of the hierarchy of graph, the time to save and load it, and the time per query
+    of the hierarchy and of A* on random node pairs. Checks that both find routes of the same travel time.
+    """
+    rng = np.random.RandomState(seed)
+    pairs = [tuple(int(n) for n in rng.randint(0, graph.size, 2)) for i in range(queries)]
+    # the first call builds the A* planner; leave it out of the timing
+    cars.routePlan(graph, pairs[0][0], pairs[0][1])
+    aStarTime, aStarRoutes = timeQueries(cars.routePlan, graph, pairs)
+
+    start = time.time()
+    hierarchy = contraction.build(graph)
+    buildTime = time.time() - start
+    # save and load it again, as Graph.buildHierarchy does with the file next to the map
+    filename = os.path.join(tempfile.mkdtemp(), "benchmark.ch.npz")
+    start = time.time()
+    hierarchy.save(filename)
+    saveTime = time.time() - start
+    start = time.time()
+    hierarchy = contraction.load(filename)
+    loadTime = time.time() - start
+    fileSize = os.path.getsize(filename)
+    os.remove(filename)
+    os.rmdir(os.path.dirname(filename))
+
+    chTime, chRoutes = timeQueries(lambda graph, a, b: hierarchy.route(a, b), graph, pairs)
+    mismatches = sum(1 for a, c in zip(aStarRoutes, chRoutes) if bool(a) != bool(c) or
+                     abs(routeTime(graph, a) - routeTime(graph, c)) > 1e-9 * max(1.0, routeTime(graph, a)))
+    print("{0:<16} nodes: {1:>7} \t build: {2:8.2f} s \t shortcuts: {3:>7} \t file: {4:7.0f} kB (save {5:.0f} ms, load {6:.0f} ms) \t "
+          "A*: {7:8.1f} us/query \t hierarchy: {8:7.1f} us/query \t speedup: {9:5.1f}x \t different route times: {10}".format(
+          name, graph.size, buildTime, hierarchy.shortcutCount, fileSize / 1024.0, saveTime * 1000, loadTime * 1000,
+          aStarTime * 1e6, chTime * 1e6, aStarTime / chTime, mismatches))
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Compare contraction hierarchy queries with A*.")
+    parser.add_argument("--nodes", type = int, nargs = "+", default = [100, 900, 2500, 10000],
+                        help = "sizes of the synthetic networks (preprocessing takes about 4 s per 1000 nodes)")
+    parser.add_argument("--queries", type = int, default = 300)
+    opts = parser.parse_args(args)
+
+    for xml in ("storage_a.xml", "storage_b.xml", "storage_c.xml"):
+        graph = graphGen.Graph(xml = xml)
+        graph.xmlGetStreetProperties()
+        benchmark(xml, graph, queries = opts.queries)
+    for kind in ("grid", "radial", "planar"):
+        for nodeNum in opts.nodes:
+            graph = networks.makeGraph(networks.generate(kind, nodeNum, oneWayRatio = 0.2))
+            benchmark("{0} {1}".format(kind, nodeNum), graph, queries = opts.queries)
+
+
+if __name__ == "__main__":
+    main()
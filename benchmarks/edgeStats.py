@@ -0,0 +1,83 @@
+# Benchmark of the per-edge statistics (edgeStats.EdgeStats): time per step with and without them
+
+# Usage: python -m benchmarks.edgeStats [--steps 500]
+
+# The same simulation runs twice in lockstep, with and without statistics (each car has its own random stream, so
+# both draw the same numbers), and each step is timed on both: the overhead is the median of the per-step ratios,
+# which a slower spell of a shared machine affects much less than two separate runs. The total time of the two runs,
+# which includes the steps ending a time bin but also any such spell, is shown too.
+
+import argparse
+import contextlib
+import io
+import time
+import numpy as np
+import simulator.cars as cars
+import simulator.edgeStats as edgeStats
+import simulator.networks as networks
+import simulator.run as run
+import simulator.streams as streams
+
+
+def makeRun(table, mode, carsNum, steps, carSettings, stats, seed = 1):
+    """
+    Returns a graph with carsNum cars on it (the list of cars), with or without statistics.
+    """
+    graph = networks.makeGraph(table, lanes = mode == "lanes", weighted = mode == "weighted")
+    graph.streams = streams.RandomStreams(seed)
+    if stats:
+        graph.edgeStats = edgeStats.EdgeStats(graph, binSize = 100, steps = steps)
+    return graph, [cars.Car(graph, carSettings) for i in range(carsNum)]
+
+
+def timeStep(graph, carList, carsNum, carSettings):
+    start = time.perf_counter()
+    run.stepCars(carList, graph, carsNum, carSettings)
+    return time.perf_counter() - start
+
+
+def compare(table, mode, carsNum, steps, carSettings):
+    """
+    Steps the two runs alternately, and returns the time per step without and with statistics, the median
+    per-step overhead, the overhead in total time, and the graph with statistics.
+    """
+    plain = makeRun(table, mode, carsNum, steps, carSettings, False)
+    withStats = makeRun(table, mode, carsNum, steps, carSettings, True)
+    plainTimes = []
+    statsTimes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(steps):
+            # alternate which one goes first
+            if step % 2:
+                plainTimes.append(timeStep(plain[0], plain[1], carsNum, carSettings))
+                statsTimes.append(timeStep(withStats[0], withStats[1], carsNum, carSettings))
+            else:
+                statsTimes.append(timeStep(withStats[0], withStats[1], carsNum, carSettings))
+                plainTimes.append(timeStep(plain[0], plain[1], carsNum, carSettings))
+    if plain[0].trips != withStats[0].trips:
+        raise RuntimeError("The runs with and without statistics differ.")
+    overhead = np.median(np.array(statsTimes) / np.array(plainTimes)) - 1
+    return np.median(plainTimes), np.median(statsTimes), overhead, sum(statsTimes) / sum(plainTimes) - 1, withStats[0]
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Time the simulation with and without edge statistics.")
+    parser.add_argument("--nodes", type = int, default = 2500)
+    parser.add_argument("--steps", type = int, default = 500)
+    opts = parser.parse_args(args)
+
+    table = networks.generate("grid", opts.nodes, oneWayRatio = 0.2)
+    for mode in ("lanes", "weighted"):
+        for carsNum in (500, 5000):
+            carSettings = dict(randomBehavior = False)
+            without, withStats, overhead, totalOverhead, graph = compare(table, mode, carsNum, opts.steps, carSettings)
+            start = time.time()
+            means = graph.edgeStats.means()
+            queryTime = time.time() - start
+            print("{0:<8} cars: {1:>5} \t without: {2:7.2f} ms/step \t with statistics: {3:7.2f} ms/step \t overhead: {4:5.1f}% (total time {5:+.1f}%) \t "
+                  "query: {6:6.1f} ms \t mean cars per lane: {7:.3f}".format(mode, carsNum, without * 1000, withStats * 1000,
+                  100 * overhead, 100 * totalOverhead, queryTime * 1000, means["occupancy"].mean()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Benchmark of the discrete-event stepping (events.EventScheduler) against run.stepCars: wall time, number of car updates
+# actually done, and a check that both give the same history
+
+# Usage: python -m benchmarks.events [--steps 1000]
+
+import argparse
+import simulator.networks as networks
+from simulator.scenarios import simulate, storageGraph
+
+
+def benchmark(name, makeGraph, carsNum, steps, carSettings):
+    stepTime, stepGraph, _, _ = simulate(makeGraph, carsNum, steps, carSettings, "cars")
+    eventTime, eventGraph, _, scheduler = simulate(makeGraph, carsNum, steps, carSettings, "events")
+    print("{0:<28} cars: {1:>5} \t stepCars: {2:7.2f} s \t events: {3:7.2f} s \t speedup: {4:5.2f}x \t "
+          "updates done: {5:>8} of {6:>8} ({7:5.1f}%) \t same history: {8}".format(
+          name, carsNum, stepTime, eventTime, stepTime / eventTime, scheduler.updates, scheduler.carSteps,
+          100.0 * scheduler.updates / max(1, scheduler.carSteps), stepGraph.history == eventGraph.history))
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Compare the event scheduler with run.stepCars.")
+    parser.add_argument("--steps", type = int, default = 1000)
+    opts = parser.parse_args(args)
+
+    carSettings = dict(randomBehavior = False, nodeWait = 1)
+    for spacing in (50, 1000):
+        table = networks.grid(30, spacing = spacing, oneWayRatio = 0.2)
+        for carsNum in (50, 500):
+            benchmark("grid 900, {0} m, lanes".format(spacing), lambda: networks.makeGraph(table, lanes = True),
+                      carsNum, opts.steps, carSettings)
+        benchmark("grid 900, {0} m, no lanes".format(spacing), lambda: networks.makeGraph(table),
+                  500, opts.steps, carSettings)
+    # long waits at the nodes, and the queues they make on a small map
+    queueSettings = dict(randomBehavior = False, nodeWait = 5)
+    for carsNum in (50, 300):
+        benchmark("storage_a.xml, waits, lanes", storageGraph,
+                  carsNum, opts.steps, queueSettings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# Benchmark of fleet.Fleet against a list of Car objects stepped with run.stepCars: wall time, and a check that both
+# give the same trips and leave every car in the same state
+
+# Usage: python -m benchmarks.fleet [--steps 300]
+
+import argparse
+import simulator.networks as networks
+from simulator.scenarios import carState, simulate, storageGraph
+
+
+def benchmark(name, makeGraph, carsNum, steps, carSettings):
+    carTime, carGraph, carList, _ = simulate(makeGraph, carsNum, steps, carSettings, "cars")
+    fleetTime, fleetGraph, carFleet, _ = simulate(makeGraph, carsNum, steps, carSettings, "fleet")
+    same = carGraph.history == fleetGraph.history and [carState(car) for car in carList] == [carState(car) for car in carFleet]
+    print("{0:<24} cars: {1:>5} \t Car objects: {2:7.2f} s \t Fleet: {3:7.2f} s \t speedup: {4:5.2f}x \t "
+          "trips: {5:>5} \t same results: {6}".format(name, carsNum, carTime, fleetTime, carTime / fleetTime,
+          carGraph.trips, same))
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Compare fleet.Fleet with a list of Car objects.")
+    parser.add_argument("--steps", type = int, default = 300)
+    opts = parser.parse_args(args)
+
+    carSettings = dict(randomBehavior = False)
+    table = networks.generate("grid", 2500, oneWayRatio = 0.2)
+    for mode in ("weighted", "lanes"):
+        for carsNum in (20, 300, 2000, 5000):
+            benchmark("storage_a.xml, " + mode, lambda: storageGraph(mode), carsNum, opts.steps, carSettings)
+        for carsNum in (2000, 20000):
+            benchmark("grid 2500, " + mode, lambda: networks.makeGraph(table, lanes = mode == "lanes", weighted = mode == "weighted"),
+                      carsNum, opts.steps, carSettings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Scaling benchmark for partition.PartitionedSimulation: the same run on 1 to N worker processes
+
+# Usage: python -m benchmarks.partition --nodes 40000 --cars 20000 --steps 200 --max-parts 8
+
+import argparse
+import contextlib
+import io
+import os
+import time
+import numpy as np
+import simulator.networks as networks
+import simulator.partition as partition
+import simulator.run as run
+import simulator.cars as cars
+
+
+def singleProcess(table, mode, carsNum, steps, carSettings, seed):
+    """
+    The same simulation with a plain list of cars in this process, as a reference.
+    """
+    graph = networks.makeGraph(table, lanes = mode == "lanes", weighted = mode == "weighted")
+    np.random.seed(seed)
+    start = time.time()
+    carList = [cars.Car(graph, carSettings) for i in range(carsNum)]
+    for i in range(steps):
+        run.stepCars(carList, graph, carsNum, carSettings)
+    return time.time() - start, graph.trips
+
+
+def partitioned(table, mode, carsNum, steps, carSettings, seed, parts):
+    graph = networks.makeGraph(table, lanes = mode == "lanes", weighted = mode == "weighted")
+    start = time.time()
+    with partition.PartitionedSimulation(graph, parts, carsNum, carSettings, seed) as sim:
+        sim.run(steps)
+    return time.time() - start, graph.trips
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Time a partitioned simulation on a synthetic map, from 1 to N processes.")
+    parser.add_argument("--kind", choices = ("grid", "radial", "planar"), default = "grid")
+    parser.add_argument("--nodes", type = int, default = 40000)
+    parser.add_argument("--dead-ends", type = int, default = 64, help = "number of start and goal nodes")
+    parser.add_argument("--cars", type = int, default = 20000)
+    parser.add_argument("--steps", type = int, default = 200)
+    parser.add_argument("--mode", choices = ("lanes", "weighted"), default = "lanes")
+    parser.add_argument("--max-parts", type = int, default = os.cpu_count() or 1)
+    parser.add_argument("--seed", type = int, default = 1234)
+    opts = parser.parse_args(args)
+
+    carSettings = dict(randomBehavior = False, mistakes = True)
+    table = networks.generate(opts.kind, opts.nodes, oneWayRatio = 0.2, deadEnds = opts.dead_ends, seed = opts.seed)
+    print("{0} map: {1} nodes, {2} streets; {3} cars, {4} steps, {5} mode; {6} cores".format(
+        opts.kind, len(table["nodeIds"]), len(table["streetIds"]), opts.cars, opts.steps, opts.mode, os.cpu_count()))
+
+    # the cars print a warning when they would go over the speed limit; keep the output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        wallTime, trips = singleProcess(table, opts.mode, opts.cars, opts.steps, carSettings, opts.seed)
+    print("single process \t wall time: {0:8.2f} s \t trips: {1}".format(wallTime, trips))
+
+    base = None
+    parts = 1
+    while parts <= opts.max_parts:
+        wallTime, trips = partitioned(table, opts.mode, opts.cars, opts.steps, carSettings, opts.seed, parts)
+        base = base or wallTime
+        print("{0:>3} partitions \t wall time: {1:8.2f} s \t speedup: {2:5.2f}x \t trips: {3}".format(parts, wallTime, base / wallTime, trips))
+        parts *= 2
+
+
+if __name__ == "__main__":
+    main()
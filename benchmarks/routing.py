@@ -0,0 +1,106 @@
+# Microbenchmark for route planning: compares cars.routePlan with the original list-based A*
+
+# Usage: python -m benchmarks.routing
+
+import time
+import numpy as np
+import simulator.graphGen as graphGen
+import simulator.cars as cars
+import simulator.networks as networks
+from simulator.scenarios import routeTime
+
+
+def legacyRoutePlan(graph, startNode, endNode):
+    """
+    The original routePlan: FIFO open list, list membership tests, four size-N lists per call.
+    Kept here only as the baseline for the benchmark.
+    """
+    def h(node):
+        xDiff = graph.nodes[endNode]["coords"][0] - graph.nodes[node]["coords"][0]
+        yDiff = graph.nodes[endNode]["coords"][1] - graph.nodes[node]["coords"][1]
+        return np.sqrt(xDiff*xDiff + yDiff*yDiff)
+
+    def update(next, current):
+        node_g[next] = node_g[current] + graph.heuristicWeight(current, next)
+        node_h[next] = h(next)
+        node_parent[next] = current
+        node_f[next] = node_g[next] + node_h[next]
+
+    if startNode == endNode:
+        return [startNode]
+
+    size = graph.size
+    node_g = [0 for i in range(size)]
+    node_f = [0 for i in range(size)]
+    node_h = [0 for i in range(size)]
+    node_parent = ["" for i in range(size)]
+
+    closed = []
+    open = [startNode]
+
+    while len(open):
+        current = open.pop(0)
+        closed.append(current)
+        if current == endNode:
+            node = endNode
+            path = [node]
+            while node_parent[node] != startNode:
+                node = node_parent[node]
+                path.append(node)
+            path.append(startNode)
+            path.reverse()
+            return path
+        for next in graph.nodes[current]["connect"]:
+            if next not in closed:
+                if next in open:
+                    if node_g[next] > node_g[current] + graph.heuristicWeight(current, next):
+                        update(next, current)
+                else:
+                    update(next, current)
+                    open.append(next)
+    return []
+
+
+def timeQueries(planner, graph, pairs):
+    """
+    Runs planner(graph, start, end) on every pair. Returns seconds per query and the routes found.
+    """
+    start = time.time()
+    routes = [planner(graph, a, b) for a, b in pairs]
+    return (time.time() - start) / len(pairs), routes
+
+
+def benchmark(name, graph, queries = 200, legacyLimit = 2500, seed = 1):
+    """
+    Prints the time per query of both planners on random node pairs of graph, and how much slower the
+    legacy routes are on average. The legacy planner is skipped on graphs with more than legacyLimit nodes.
+    """
+    rng = np.random.RandomState(seed)
+    pairs = [tuple(int(n) for n in rng.randint(0, graph.size, 2)) for i in range(queries)]
+    # the first call builds the planner; time it separately
+    start = time.time()
+    cars.routePlan(graph, pairs[0][0], pairs[0][1])
+    setup = time.time() - start
+
+    newTime, newRoutes = timeQueries(cars.routePlan, graph, pairs)
+    line = "{0:<16} nodes: {1:>8} \t setup: {2:8.2f} ms \t heap A*: {3:9.3f} ms/query".format(name, graph.size, setup * 1000, newTime * 1000)
+    if graph.size <= legacyLimit:
+        oldTime, oldRoutes = timeQueries(legacyRoutePlan, graph, pairs)
+        ratios = [routeTime(graph, o) / routeTime(graph, n) for o, n in zip(oldRoutes, newRoutes) if len(n) > 1 and o]
+        line += " \t legacy: {0:9.3f} ms/query \t speedup: {1:7.1f}x \t legacy route time: {2:.3f}x".format(oldTime * 1000, oldTime / newTime, np.mean(ratios) if ratios else 1.0)
+    print(line)
+
+
+def main():
+    for xml in ("storage_a.xml", "storage_b.xml", "storage_c.xml"):
+        graph = graphGen.Graph(xml = xml)
+        graph.xmlGetStreetProperties()
+        benchmark(xml, graph, queries = 500)
+    for kind in ("grid", "radial", "planar"):
+        for nodeNum in (100, 900, 2500, 10000, 90000):
+            graph = networks.makeGraph(networks.generate(kind, nodeNum, oneWayRatio = 0.2))
+            benchmark("{0} {1}".format(kind, nodeNum), graph, queries = 200 if nodeNum <= 2500 else 50)
+
+
+if __name__ == "__main__":
+    main()
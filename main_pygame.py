@@ -4,6 +4,12 @@ import pygame
 import pygame.freetype
 import simulator.graphGen as graphGen
 import simulator.cars as cars
+import simulator.fleet as fleet
+import simulator.run as run
+import simulator.tripLog as tripLog
+import simulator.profiling as profiling
+import simulator.background as background
+import sys
 import numpy as np
 
 # window size to be used by pygame. (X, Y)
@@ -24,9 +30,20 @@ weights = False
 carsNum = 5
 stepsNum = 1
 fps = 20
+# if True, cars are stepped all at once by fleet.Fleet instead of one Car object at a time (faster only without lanes)
+vectorized = False
+# if True, times each phase of the simulation and the drawing (see simulator/profiling.py): rates are shown on screen,
+# and the full report is printed every profileReportEvery frames
+profile = False
+profileReportEvery = 200
+# if True, the simulation runs in a background thread (see simulator/background.py) at stepsNum * fps steps per second,
+# and the window draws its latest snapshot; if False, stepsNum steps are run before drawing each frame
+threaded = True
 
 # should be in same directory as this file
 xmlFilename = "storage_a.xml"
+# if a filename, finished trips are written to it while running (see simulator/tripLog.py) instead of to results.txt on exit
+tripLogFilename = None
 
 #pseudorandom: set a constant seed so that it runs the same each time
 np.random.seed(1234)
@@ -41,8 +58,17 @@ def main():
     start_pygame()
     font = pygame.freetype.SysFont("Times New Roman", 14)
 
+    if profile:
+        module = sys.modules[__name__]
+        profiling.instrument(module, "draw_map", "drawing: map")
+        profiling.instrument(module, "update_screen", "drawing: screen")
+        profiling.enable()
+    frame = 0
+
     graph = graphGen.Graph(nodeNum = 8, xml = xmlFilename, weighted=weights, lanes = lanes)
     graph_init(graph, size)
+    if tripLogFilename:
+        graph.tripLog = tripLog.TripLog(tripLogFilename)
 
     # draw the map  
     map = pygame.Surface(size)
@@ -57,7 +83,15 @@ def main():
     pygame.display.flip()
 
     # create the cars
-    carList = [cars.Car(graph, carSettings) for i in range(carsNum)]
+    if vectorized:
+        carList = fleet.Fleet(graph, carSettings, carsNum)
+    else:
+        carList = [cars.Car(graph, carSettings) for i in range(carsNum)]
+
+    # start the simulation thread: from here on, only it touches the cars and the graph
+    if threaded:
+        simulation = background.SimulationThread(graph, carList, carsNum, carSettings, stepsNum * fps, publishInterval = 1.0 / fps)
+        simulation.start()
 
     # variable for controlling the main() loop
     running = True
@@ -76,21 +110,44 @@ def main():
                 # exit loop
                 running = False
 
+                # let the simulation finish its step before saving what it produced
+                if threaded:
+                    simulation.stop()
+
+                if profile:
+                    print(profiling.report())
+
                 # print final results
-                np.savetxt("results.txt", graph.history, fmt="%s", header = "Next run begins here.")
+                if graph.tripLog is not None:
+                    graph.tripLog.close()
+                else:
+                    np.savetxt("results.txt", graph.history, fmt="%s", header = "Next run begins here.")
 
             elif event.type == pygame.KEYDOWN:
                 sliders(event, screen)
         
         # update system state
-        update_system(stepsNum, carList, graph)           
+        if threaded:
+            # the sliders set the target rate of the simulation thread, which runs on its own
+            simulation.carsNum = carsNum
+            simulation.stepsPerSecond = stepsNum * fps
+            if simulation.error is not None:
+                raise simulation.error
+            snapshot = simulation.snapshot
+        else:
+            update_system(stepsNum, carList, graph)
+            snapshot = background.takeSnapshot(carList, graph, carSettings)
 
         # draw system to screen
-        update_screen(screen, map, carList)
+        update_screen(screen, map, snapshot)
 
         # tick the system clock
         clock.tick(fps) #framerate of 20 fps
 
+        frame += 1
+        if profile and frame % profileReportEvery == 0:
+            print(profiling.report())
+
 
 
 # -------------------------------------------------------------------------
@@ -155,53 +212,85 @@ def draw_map(graph, map):
 
 
 def update_system(stepsNum, carList, graph):
+    # same stepping as the headless runner in simulator/run.py
     for step in range(stepsNum):
-        if graph.weighted:
-            graph.updateWeights()
-        for car in carList:
-            #Update position for each car; if returns True, has reached goal
-            if car.updatePosition():
-                # remove car from list if at goal
-                carList.remove(car)
-                del car
-                # make a new car
-        while len(carList) < carsNum:
-            carList.append(cars.Car(graph, carSettings))
-
-def update_screen(screenObj, mapObj, carList):
+        run.stepCars(carList, graph, carsNum, carSettings)
 
-    
-    # draw the map again, to overwrite old car positions
-    screenObj.blit(mapObj, (0, 0))
+# sprites of the cars, one per color and size: drawn once, then copied to the screen
+carSprites = {}
+# areas of the screen drawn over in the previous frame (cars and text), which get the map back before the next frame
+dirtyRects = []
 
-    # Draw cars to the screen
-    # Keeps a list of areas of the screen which have been updated
-    for i, car in enumerate(carList):
-        #keep exactly one of the following uncommented
+def carColor(carId, direction, velocity):
+    """
+    Color of a car, from what a snapshot keeps of it (see background.Snapshot).
+    Rounded to 8 levels per channel, so that the cars share a few dozen sprites.
+    """
+    #keep exactly one of the following uncommented
 
-        #various colors, oldest cars are red and newest are green
-        # colorOffset = int(255.0/len(carList))
-        # pygame.draw.circle(screenObj, pygame.Color(255 - colorOffset * i, colorOffset*i, 0, 255), car.pos.coords, car.carSize / 2)
+    #various colors, random based on car id
+    n = int(carId)
+    return ((n // 4 + 128) % 255 // 32 * 32, n // 5 % 255 // 32 * 32, 100)
 
-        #various colors, random based on car id
-        pygame.draw.circle(screenObj, pygame.Color((int(id(car))/4 +128) % 255, int(id(car))/5 % 255, 100, 255), car.pos.coords, car.carSize / 2)
+    #red one way, blue the other
+    # return (255, 0, 0) if direction else (0, 0, 255)
 
-        #red one way, blue the other
-        # pygame.draw.circle(screenObj, pygame.Color("red" if car.pos.direction else "blue"), car.pos.coords, car.carSize / 2)
+    #red at stopped, more green at speed
+    # return (max(0, 255 - 5*int(velocity)) // 32 * 32, min(255, 5*int(velocity)) // 32 * 32, 0)
 
-        #red at stopped, more green at speed
-        # pygame.draw.circle(screenObj, pygame.Color(*(255 - 5*car.velocity, 5*car.velocity, 0, 255)), car.pos.coords, car.carSize / 2)
+def carSprite(color, carSize):
+    """
+    Returns a transparent surface with a circle of the given color and diameter carSize, drawing it the first time.
+    """
+    key = (color, carSize)
+    sprite = carSprites.get(key)
+    if sprite is None:
+        side = int(carSize) + 1
+        sprite = pygame.Surface((side, side), pygame.SRCALPHA)
+        pygame.draw.circle(sprite, pygame.Color(color[0], color[1], color[2], 255), (side // 2, side // 2), carSize / 2)
+        carSprites[key] = sprite
+    return sprite
+
+def update_screen(screenObj, mapObj, snapshot):
+    """
+    Draws the cars of a background.Snapshot and the status text over the map, and updates only the parts of the window which changed:
+    where the cars and text were in the previous frame, and where they are now.
+    """
+    global dirtyRects
+
+    # draw the map again where the old car positions and text are
+    for rect in dirtyRects:
+        screenObj.blit(mapObj, rect, rect)
+
+    # Draw cars to the screen, all in one call
+    # Keeps a list of areas of the screen which have been updated
+    batch = []
+    append = batch.append
+    carSize = snapshot.carSize
+    for x, y, carId, direction, velocity in snapshot.cars:
+        key = (carColor(carId, direction, velocity), carSize)
+        sprite = carSprites.get(key) or carSprite(*key)
+        half = sprite.get_width() >> 1
+        append((sprite, (x - half, y - half)))
+    newRects = screenObj.blits(batch)
 
     # Write slider state to screen
-    font.render_to(screenObj, (10,size[1]-20), "Total cars: {0}    Steps per frame: {1}".format(len(carList), stepsNum) , fgcolor = pygame.color.Color("black"))
+    if threaded:
+        status = "Total cars: {0}    Target steps/s: {1}    Steps/s: {2:.0f}".format(len(snapshot), stepsNum * fps, snapshot.stepsPerSecond)
+    else:
+        status = "Total cars: {0}    Steps per frame: {1}".format(len(snapshot), stepsNum)
+    newRects.append(font.render_to(screenObj, (10,size[1]-20), status, fgcolor = pygame.color.Color("black")))
+    if profiling.enabled:
+        newRects.append(font.render_to(screenObj, (10,size[1]-40), profiling.statusLine(), fgcolor = pygame.color.Color("black")))
 
-    # Update the display
-    pygame.display.update()
+    # Update the display, only where something changed
+    pygame.display.update(dirtyRects + newRects)
+    dirtyRects = newRects
 
 def sliders(event, screenObj):
     global carsNum
     global stepsNum
-    # slider functionality: left slows down, right speeds up
+    # slider functionality: left slows down, right speeds up (by fps steps per second when threaded)
     if event.key == pygame.K_LEFT:
         stepsNum -= 1 if stepsNum > 0 else 0
     elif event.key == pygame.K_RIGHT:
@@ -0,0 +1,106 @@
+# Runs the simulation in a background thread, so that drawing never waits for it (and it never waits for drawing)
+
+# The thread steps the cars at a target rate and publishes a Snapshot of their positions every so often;
+# the window draws whichever snapshot is the latest, at its own frame rate.
+
+import threading
+import time
+import simulator.run as run
+
+
+class Snapshot:
+    """
+    What is needed to draw the cars at one moment, copied out of the simulation:  \n
+    cars: list of (x, y, carId, direction, velocity) tuples, carId being id() of the car (stable for its whole life).  \n
+    carSize: size of the cars; step: graph.stepCount when it was taken; stepsPerSecond: measured simulation rate.
+    """
+    def __init__(self, cars, carSize, step, stepsPerSecond = 0.0):
+        self.cars = cars
+        self.carSize = carSize
+        self.step = step
+        self.stepsPerSecond = stepsPerSecond
+
+    def __len__(self):
+        return len(self.cars)
+
+
+def takeSnapshot(carList, graph, carSettings, stepsPerSecond = 0.0):
+    """
+    Copies the positions of the cars in carList (a list of Car objects or a fleet.Fleet) into a Snapshot.
+    """
+    # coordinates are computed when read (see Position.coords): only for the steps which get drawn, once per car
+    cars = []
+    for car in carList:
+        x, y = car.pos.coords
+        cars.append((x, y, id(car), car.pos.direction, car.velocity))
+    return Snapshot(cars, carSettings.get("carSize", 5), graph.stepCount, stepsPerSecond)
+
+
+class SimulationThread(threading.Thread):
+    """
+    Steps carList with run.stepCars in a background thread.  \n
+    stepsPerSecond: target simulation rate; 0 pauses the simulation, None runs it as fast as possible.
+    Can be changed while running, as can carsNum.  \n
+    publishInterval: minimum time in seconds between two snapshots (normally one frame); the latest one is self.snapshot.  \n
+    If a step raises an exception, the thread stops and keeps it in self.error.
+    """
+
+    def __init__(self, graph, carList, carsNum, carSettings, stepsPerSecond = None, publishInterval = 0.05):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.graph = graph
+        self.carList = carList
+        self.carsNum = carsNum
+        self.carSettings = carSettings
+        self.stepsPerSecond = stepsPerSecond
+        self.publishInterval = publishInterval
+        self.measuredRate = 0.0
+        self.error = None
+        self.stopped = threading.Event()
+        # publishing replaces the reference in one assignment: readers always get a whole snapshot
+        self.snapshot = takeSnapshot(carList, graph, carSettings)
+
+    def run(self):
+        try:
+            self.loop()
+        except Exception as e:
+            self.error = e
+
+    def loop(self):
+        clock = time.perf_counter
+        nextStep = lastPublish = rateStart = clock()
+        rateSteps = 0
+        while not self.stopped.is_set():
+            rate = self.stepsPerSecond
+            now = clock()
+            if rate is not None and rate <= 0:
+                # paused: keep publishing, so that changes of carsNum still show up once it restarts
+                time.sleep(self.publishInterval)
+                nextStep = now
+            else:
+                run.stepCars(self.carList, self.graph, self.carsNum, self.carSettings)
+                rateSteps += 1
+                if rate is not None:
+                    nextStep += 1.0 / rate
+                    now = clock()
+                    if nextStep > now:
+                        time.sleep(nextStep - now)
+                    elif now - nextStep > 0.25:
+                        # far behind the target: do not try to catch up with a burst of steps
+                        nextStep = now
+
+            now = clock()
+            if now - rateStart >= 1.0:
+                self.measuredRate = rateSteps / (now - rateStart)
+                rateStart, rateSteps = now, 0
+            if now - lastPublish >= self.publishInterval:
+                self.snapshot = takeSnapshot(self.carList, self.graph, self.carSettings, self.measuredRate)
+                lastPublish = now
+
+    def stop(self):
+        """
+        Stops the thread after its current step, and waits for it.
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
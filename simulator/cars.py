@@ -2,7 +2,10 @@
 
 # Depends heavily on the rasterized graph data structure created by graphGen.py
 
+import heapq
+import math
 import numpy as np
+import simulator.streams as streams
 
 # Position class: for readability
 # Implements attributes and methods related to a car's position
@@ -18,6 +21,11 @@ class Position:
     # Note: equivalence operator will allow for approximate equals, so that it can be used to check if cars are overlapping
     
 
+    # no __dict__: a car's position is one of the most numerous objects of a run (lead, follow and queue are the links
+    # of the node's LaneQueue, see laneQueue.py)
+    __slots__ = ("graph", "eqTol", "carSize", "lanes", "nodeFrom", "nodeTo", "direction", "atNode",
+                 "length", "dist", "toNext", "fromCoords", "toCoords", "edge", "lane", "laneId", "toNode", "lead", "follow", "queue")
+
     def __init__(self, graph, nodeFrom, nodeTo, dist = 0, carSize = 5):
         """
         Takes graph, two integers indicating node indices and a distance along edge
@@ -43,16 +51,16 @@ class Position:
         # for case where is at node already, compute some coordinates and return early
         if s.nodeFrom == s.nodeTo:
             s.atNode = True
-            s.coords = s.graph.nodes[s.nodeTo]["coords"]
-            s.xPos, s.yPos = s.coords
+            s.toCoords = s.graph.nodes[s.nodeTo]["coords"]
             if self.lanes:
                 self.graph.nodes[self.nodeTo]["population"].append(self)
             return
 
-        # store then check length of the edge
+        # look up the edge once, and keep what the car needs of it
+        s.setEdge(nodeFrom, nodeTo, graph.edges[(nodeFrom, nodeTo)])
+
         # take given distance, and match it to system coordinates (from lower-index to higher-index node)
         # compute distance to destination, store it (toNext)
-        s.length = graph.edges[(s.nodeFrom, s.nodeTo)]["length"]
         if s.direction:
             s.dist = dist
             s.toNext = s.length - dist
@@ -64,39 +72,81 @@ class Position:
         
         if dist > s.length+1:
             raise ValueError("The distance along an edge must be less than the edge's length.")
-            
-        
-        # calculate coordinates of position if along an edge
-        if not s.atNode:
-            # get and store coordinates of nodeFrom, nodeTo
-            s.fromCoords = s.graph.nodes[s.nodeFrom]["coords"]
-            s.toCoords = s.graph.nodes[s.nodeTo]["coords"]
-            s.calcCoords()
 
 
-        # vars to update always: atNode, dist, xPos, yPos, coords
-        # vars to update at node change: fromCoords, toCoords, length, direction
+        # vars to update always: atNode, dist, toNext (coords, xPos and yPos are computed from them when read)
+        # vars to update at node change (setEdge): fromCoords, toCoords, length, direction, edge, lane, laneId, toNode
+
+    def setEdge(self, nodeFrom, nodeTo, edge):
+        """
+        Points the position at the edge from nodeFrom to nodeTo, without moving it along the edge.
+        edge: the attribute dict of the edge (graph.edges[(nodeFrom, nodeTo)]).  \n
+        Keeps direct references to it, to the population lane of the direction of travel and to the attribute dict of nodeTo,
+        so that each step does not look them up again by tuple key; laneId is the number of the lane (see LaneQueue).
+        """
+        self.nodeFrom = nodeFrom
+        self.nodeTo = nodeTo
+        self.direction = (nodeTo > nodeFrom)
+        self.edge = edge
+        self.lane = edge["population"][self.direction]
+        self.laneId = self.lane.laneId
+        self.length = edge["length"]
+        nodes = self.graph.nodes
+        self.fromCoords = nodes[nodeFrom]["coords"]
+        self.toNode = nodes[nodeTo]
+        self.toCoords = self.toNode["coords"]
+
+    def weightedSpeed(self):
+        """
+        Weighted speed of the lane the position is on (edge["weighted speed"][direction]). With the array backend,
+        read straight from graph.arrays, without going through the EdgeView.
+        """
+        arrays = self.graph.arrays
+        if arrays is not None:
+            # the lane id (2 * edge id + direction) is the flat index of the lane in the (edges, 2) column
+            return arrays.weightedSpeed.item(self.laneId)
+        return self.edge["weighted speed"][self.direction]
 
     # used to interpolate between positions of the two nodes and get coordinates; useful only for visualization
     def calcCoords(self):
         """
         Takes no arguments other than self, but depends internally on having coordinates
-        for nodeFrom and nodeTo
+        for nodeFrom and nodeTo. Returns the (x, y) coordinates of a position along its edge.
         """
         prog = (self.toNext if self.direction else self.dist) / float(self.length)
-        self.xPos = int(prog * self.fromCoords[0] + (1-prog) * self.toCoords[0])
-        self.yPos = int(prog * self.fromCoords[1] + (1-prog) * self.toCoords[1])
+        xPos = int(prog * self.fromCoords[0] + (1-prog) * self.toCoords[0])
+        yPos = int(prog * self.fromCoords[1] + (1-prog) * self.toCoords[1])
 
         # if using lanes implemenation, adjust coords to move to side of line
         if self.lanes:
             xDiff = float(self.toCoords[0] - self.fromCoords[0])
             yDiff = float(self.toCoords[1] - self.fromCoords[1])
             # x += margin * sin(theta)
-            self.xPos += int((self.carSize * 1.5) * (-yDiff/self.length))
+            xPos += int((self.carSize * 1.5) * (-yDiff/self.length))
             # y += margin * cos(theta)
-            self.yPos += int((self.carSize * 1.5 ) * (xDiff/self.length))
+            yPos += int((self.carSize * 1.5 ) * (xDiff/self.length))
+
+        return (xPos, yPos)
+
+    # coordinates only matter for drawing: they are computed when read, so that runs which draw nothing
+    # (or draw once every several steps) never pay for them
+    @property
+    def coords(self):
+        """
+        Tuple of the x and y coordinates of the position: those of nodeTo at a node, otherwise see calcCoords.
+        """
+        if self.atNode:
+            return self.toCoords
+        return self.calcCoords()
+
+    @property
+    def xPos(self):
+        return self.coords[0]
+
+    @property
+    def yPos(self):
+        return self.coords[1]
 
-        self.coords = (self.xPos, self.yPos)
 # equivalence operator: created a bug with the population list's remove method.
 # NOT CURRENTLY USED, used a different implementation in the end
     # equivalence operator (==)
@@ -123,7 +173,7 @@ class Position:
         Moves position along edge. If car is already at destination node, fails.
         Takes displacement from previous position as argument. Preferably an integer
         Adds displacement to distance along edge in the appropriate direction
-        Updates values: dist, xPos, yPos, coords, atNode
+        Updates values: dist, toNext, atNode
         """
 
         #check if car is on an edge, throw error otherwise
@@ -134,17 +184,16 @@ class Position:
         if self.lanes:
             # check to see if is already within reach of node
             if self.toNext <= displace:
+                node = self.toNode
                 # check if node is not fully populated
-                if self.graph.nodes[self.nodeTo]["capacity"] > len(self.graph.nodes[self.nodeTo]["population"]): # or self in self.graph.nodes[self.nodeTo]["population"]:
+                if node["capacity"] > len(node["population"]): # or self in node["population"]:
                     
                     # move to node: add self to population list
-                    self.graph.nodes[self.nodeTo]["population"].append(self)
+                    node["population"].append(self)
                     self.atNode = True
                     #compute coords
                     self.toNext = 0
                     self.dist += displace if self.direction else -displace
-                    self.coords = self.toCoords
-                    self.xPos, self.yPos = self.coords
                     # end the method here
                     return
                 # do nothing if node is already occupied
@@ -156,31 +205,29 @@ class Position:
         # Recompute distance to next node, according to direction
         self.toNext = self.length - self.dist if self.direction else self.dist
 
-        # Recalculate other coordinates
-        self.calcCoords()
-
         # if the new position is at or past its destination node, then set atNode=True and location at new node
         if not self.lanes and self.toNext <= 0:
             self.atNode = True
-            self.graph.nodes[self.nodeTo]["population"].append(self)
-            self.coords = self.toCoords
-            self.xPos, self.yPos = self.coords
+            self.toNode["population"].append(self)
     
-    # re-initalizes the Position object, using a given new node
-    def changeNodes(self, newNode):
+    # moves the Position object on to the edge towards a given new node
+    def changeNodes(self, newNode, edge = None):
         """
         Give the car a new destination node. Fails if the car is not at its destination node.
         If the graph has weighted=True, moves weighting from old edge to new edge.
         If the graph has lanes=True, checks that there is space to move to the new edge before doing so
-        Calls the init method to recalculate all values.
+        edge: the attribute dict of the new edge, if the caller already has it.
+        Places the position at the start of the new edge (see setEdge), without going through __init__ again.
         """
         if not self.atNode:
             raise ValueError("A car not at its destination node cannot change destination nodes")
 
         if self.toNext > self.carSize:
             print("A car skipped an edge, somehow.")
-        if not (self.nodeTo, newNode) in self.graph.edges:
-            raise ValueError("A car tried to move to a nonexistent edge.")
+        if edge is None:
+            if not (self.nodeTo, newNode) in self.graph.edges:
+                raise ValueError("A car tried to move to a nonexistent edge.")
+            edge = self.graph.edges[(self.nodeTo, newNode)]
         
 
         # # if using weighted graph behavior, update numbers of cars along street
@@ -188,11 +235,18 @@ class Position:
         #     self.graph.edges[(self.nodeFrom, self.nodeTo)]["population"][self.direction].remove(self)
 
             # if successfully moves away, remove self from population of node
-        self.graph.nodes[self.nodeTo]["population"].remove(self)
-
-        # self.nodeFrom = self.nodeTo
-        
-        self.__init__(self.graph, self.nodeTo, newNode, carSize=self.eqTol)
+        self.toNode["population"].remove(self)
+
+        # the old destination is the new departure node
+        self.setEdge(self.nodeTo, newNode, edge)
+        self.atNode = False
+        # at the start of the new edge
+        if self.direction:
+            self.dist = 0
+            self.toNext = self.length
+        else:
+            self.dist = self.length
+            self.toNext = self.dist
 
                 
 
@@ -212,7 +266,13 @@ class Car:
     nodeWait: sets the number of time steps it takes a car to get through a node  
     pos: defaults to 0, not used. If is an instance of Position class and randomBehavior is False, should be a starting position.  
     carSize: sets the size of car in pixel, used in lanes implementation and accessible for visualization  
+    startNode, nodeGoal: if given, used instead of the random dead-end nodes for the start and the goal of the car  
     """
+    # no __dict__, as for Position; nodeGoal, routeId and cursor are only set for cars which follow a route
+    __slots__ = ("graph", "lanes", "weighted", "randomBehavior", "pos", "accel", "nodeWait", "carSize", "mistakes",
+                 "currentWait", "lifetime", "carId", "spawnStep", "random", "nodeGoal", "routeId", "cursor", "history",
+                 "speedLimit", "velocity", "lead", "follow", "queue")
+
     def __init__(self, graph, carBehavior = {}): # randomBehavior = True, carSize = 5, accel = 5, nodeWait = 1, pos = 0):
 
         self.graph = graph
@@ -229,6 +289,12 @@ class Car:
         self.currentWait = 0
 
         self.lifetime = 0
+        # for the trip log: a number unique to this car, and the time step during which it was created
+        self.carId = graph.carCount
+        graph.carCount += 1
+        self.spawnStep = graph.stepCount
+        # random numbers: the car's own stream if the graph has streams (see streams.py), otherwise np.random
+        self.random = graph.streams.stream(self.carId) if graph.streams is not None else streams.GLOBAL
         # TUNING
         # Inital car position
 
@@ -238,7 +304,9 @@ class Car:
         # startDist = np.random.randint(0, self.graph.edges[startNodes]["length"])
 
         # Option 2: random dead-end node, at node
-        startNode = np.random.choice(self.graph.endNodes)
+        startNode = carBehavior.get("startNode")
+        if startNode is None:
+            startNode = self.random.choice(self.graph.endNodes)
         startNodes = (startNode, self.graph.nodes[startNode]["connect"][0])
         startDist = 0
 
@@ -251,20 +319,28 @@ class Car:
             # Still uses random goals, but follows a direct course to the goal
             # TUNING
             # self.nodeGoal = np.random.randint(0, graph.size)
-            self.nodeGoal = np.random.choice(graph.endNodes)
+            self.nodeGoal = carBehavior.get("nodeGoal")
+            if self.nodeGoal is None:
+                self.nodeGoal = self.random.choice(graph.endNodes)
             # /TUNING
-            self.plan = self.routePlan(self.pos.nodeTo, self.nodeGoal)
-            # Plan includes current nodeTo, so remove that from list
-            self.plan.pop(0)
+            # goals are end nodes, so the route comes from the graph's precomputed table instead of a new search
+            # the route is shared by every car going the same way (see Graph.internRoute): the car keeps its index
+            # in graph.routes, and a cursor to the next node to go to
+            self.routeId = self.graph.internRoute(self.pos.nodeTo, self.nodeGoal)
+            # Route includes current nodeTo, so start after it
+            self.cursor = 1
             
         self.history = []
         self.history += startNodes
 
         # for purposes of edge population tracking, needs to already be at an edge and fully initialized at edge. Copied from below
-        self.speedLimit = self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["speed"]
-        self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].append(self)
+        self.speedLimit = self.pos.edge["speed"]
+        self.pos.lane.append(self)
+        self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
 
         self.velocity = 0
+        if graph.edgeStats is not None:
+            graph.edgeStats.enter(self)
     
     def updatePosition(self):
         """
@@ -278,6 +354,7 @@ class Car:
         # if at node, move to the next edge (or end movement and remove the car)
         if self.pos.atNode:
             return self.nodeBehavior()
+        velocity = self.velocity
 
         # Acceleration handling: lanes implementation, which avoids collision
         if self.lanes:        
@@ -303,6 +380,9 @@ class Car:
             print("A car tried to go faster than the speed limit.")
         # travel along edge
         self.pos.update(self.velocity)
+        # edge statistics count the cars standing still on each lane (see edgeStats.py)
+        if (velocity == 0) != (self.velocity == 0) and self.graph.edgeStats is not None:
+            self.graph.edgeStats.stop(self.pos.laneId, self.velocity == 0)
 
     def accelWithFollowing(self, nextCar):
         """
@@ -347,7 +427,12 @@ class Car:
 
         # if using weighted graph behavior, fetch weighted speed limit at each update
         if self.graph.weighted:
-            self.speedLimit = self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["weighted speed"][self.pos.direction]
+            arrays = self.graph.arrays
+            if arrays is not None:
+                # Position.weightedSpeed, inlined: this runs for every car at every step
+                self.speedLimit = arrays.weightedSpeed.item(self.pos.laneId)
+            else:
+                self.speedLimit = self.pos.edge["weighted speed"][self.pos.direction]
 
         # if car has room to decelerate later before reaching node, accelerate up to speed limit
         if self.pos.toNext > self.velocity + self.accel +  decelDist:
@@ -370,9 +455,6 @@ class Car:
         """
         Takes no arguments. If finds a car ahead of self on the same edge, returns that car; otherwise, returns False.
         """
-        # Get list of all cars on same edge
-        edgeCars = self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction]
-
         # Find the nearest car ahead, if there is one
 
         # # Arithmetic implementation: seems to work worse than the list implementation below
@@ -387,13 +469,18 @@ class Car:
         #     elif self.pos.toNext > car.pos.toNext and car.pos.toNext > nextCar.pos.toNext and not car is self:
         #         nextCar = car
 
-        # List Implementation
-        ind = edgeCars.index(self) 
-        if ind == 0:
+        # # List Implementation: replaced by the links of the LaneQueue, which avoid searching the list
+        # ind = edgeCars.index(self) 
+        # if ind == 0:
+        #     return False
+        # else:
+        #     nextCar = edgeCars[ind - 1]
+        #     return nextCar
+
+        # Queue Implementation: edgeCars is a LaneQueue, which stores the car ahead in self.lead
+        if self.lead is None:
             return False
-        else:
-            nextCar = edgeCars[ind - 1]
-            return nextCar
+        return self.lead
 
 
     def nodeBehavior(self):
@@ -409,18 +496,21 @@ class Car:
 
         # decide what the next node should be
         if self.randomBehavior:
-            newNode = np.random.choice(self.graph.nodes[self.pos.nodeTo]["connect"])
+            newNode = self.random.choice(self.pos.toNode["connect"])
         else:
+            route = self.graph.routes[self.routeId]
             # check if has reached goal node
-            if self.pos.nodeTo == self.nodeGoal or len(self.plan) == 0:
-                self.graph.nodes[self.pos.nodeTo]["population"].remove(self.pos)
-                self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].remove(self)
+            if self.pos.nodeTo == self.nodeGoal or self.cursor >= len(route):
+                if self.graph.edgeStats is not None:
+                    self.graph.edgeStats.leave(self)
+                self.pos.toNode["population"].remove(self.pos)
+                self.pos.lane.remove(self)
+                self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
 
                 # execute any other code dealing with car reaching goal
                 # TODO
                 travelDist = sum( [ self.graph.edges[(self.history[i], self.history[i+1])]["length"] for i in range(len(self.history)-1) ] ) 
-                outputStr = "Lifetime (time steps): {0} \t Distance traveled: {1} \t Average speed: {2:.2f} \t Overall route: {3}".format(self.lifetime, travelDist, travelDist/float(self.lifetime), self.history)
-                self.graph.history.append(outputStr)
+                self.graph.recordTrip(self.carId, self.spawnStep, self.lifetime, self.history, travelDist)
 
                 # delete the car, return true
                 del self
@@ -429,123 +519,224 @@ class Car:
             else:
                 if not self.mistakes:
                     # go to correct node
-                    newNode = self.plan[0]
+                    newNode = route[self.cursor]
                 else:
                     # 9/10 chance of correct node, 1/10 chance of picking a wrong node
-                    diceRoll = np.random.randint(0, 10)
+                    diceRoll = self.random.randint(10)
                     if diceRoll < 9:
-                        newNode = self.plan[0]
+                        newNode = route[self.cursor]
                     else:
-                        opts = self.graph.nodes[self.pos.nodeTo]["connect"]
-                        ind = opts.index(self.plan[0])
+                        opts = self.pos.toNode["connect"]
+                        ind = opts.index(route[self.cursor])
                         newNode = opts[ind-1]
-                        # create new route plan
-                        self.plan = self.routePlan(newNode, self.nodeGoal)
+                        # switch to the (shared) route from the wrong node, which starts with it
+                        self.routeId = self.graph.internRoute(newNode, self.nodeGoal)
+                        self.cursor = 0
 
 
         # if using lanes, check if the next position along the desired edge is available
+        # (the edge is looked up once, and handed to changeNodes)
+        edge = None
         if self.lanes:
-            population = self.graph.edges[(self.pos.nodeTo, newNode)]["population"][0 if self.pos.nodeTo > newNode else 1]
+            edge = self.graph.edges[(self.pos.nodeTo, newNode)]
+            population = edge["population"][0 if self.pos.nodeTo > newNode else 1]
             if len(population) > 0:
                 nextCar = population[-1]
                 if nextCar.pos.toNext >= nextCar.pos.length - self.carSize:
                     # if there is a car within carSize of the node along the desired edge, do nothing and end function
                     return 
 
-        # remove self from old population list, if using weights or lanes
-        if self.weighted or self.lanes:
-            self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].remove(self)
+        # remove self from old population list (always: a car can only be in one LaneQueue, and is added to the new one below)
+        stats = self.graph.edgeStats
+        if stats is not None:
+            stats.leave(self)
+        self.pos.lane.remove(self)
+        self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
 
 
         # move to next edge
-        self.pos.changeNodes(newNode)
+        self.pos.changeNodes(newNode, edge)
                     
         # If successfully moves, execute the rest of this function
 
         # add newNode to car's route history
         self.history.append(newNode)
 
-        # remove newNode from plan
+        # move the cursor past newNode
         if not self.randomBehavior:
-            self.plan.pop(0)
+            self.cursor += 1
 
         # add self to new population list, if using weights or lanes
         # if self.weighted or self.lanes:
-        self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["population"][self.pos.direction].append(self)
+        self.pos.lane.append(self)
+        self.graph.markDirty(self.pos.nodeFrom, self.pos.nodeTo)
+        if stats is not None:
+            stats.enter(self)
 
         self.currentWait = 0
-        self.speedLimit = self.graph.edges[(self.pos.nodeFrom, self.pos.nodeTo)]["speed"]
+        self.speedLimit = self.pos.edge["speed"]
         return
 
 
+    @property
+    def plan(self):
+        """
+        The nodes the car still has to go through, as a new list (the route itself is shared, see Graph.internRoute).
+        None for a car with randomBehavior, which has no route (as for the cars of a fleet.Fleet).
+        """
+        # routeId is only set for cars which follow a route
+        if self.randomBehavior:
+            return None
+        return list(self.graph.routes[self.routeId][self.cursor:])
+
     def routePlan(self, startNode, endNode):
-        # Based on: https://github.com/laurentluce/python-algorithms/blob/master/algorithms/a_star_path_finding.py
-        """
-        A* search for best path from startNode to endNode.
-        Returns list of nodes, which form a route from startNode to endNode.
-        If there is no possible route, returns an empty list and prints a message saying so.
-        """
-        def h(node):
-            """
-            Estimates with distance, minimum speed limit
-            Update this later probably?
-            """
-            # TODO make this more relevant?
-            xDiff = self.graph.nodes[endNode]["coords"][0] - self.graph.nodes[node]["coords"][0]
-            yDiff = self.graph.nodes[endNode]["coords"][1] - self.graph.nodes[node]["coords"][1]
-            return np.sqrt(xDiff*xDiff + yDiff*yDiff)
-
-        def update(next, current):
-            node_g[next] = node_g[current] + self.graph.heuristicWeight(current, next)
-            node_h[next] = h(next)
-            node_parent[next] = current
-            node_f[next] = node_g[next] + node_h[next]
+        """
+        A* search for best path from startNode to endNode; see the module-level routePlan function.
+        """
+        return routePlan(self.graph, startNode, endNode)
+
+    def pack(self):
+        """
+        Returns the state of a car which is on an edge (not at a node) as plain Python values, without the graph,
+        so that it can be pickled and moved to another process. unpackCar rebuilds the car from it.
+        """
+        state = dict((k, getattr(self, k)) for k in Car.__slots__ if k not in ("graph", "pos", "lead", "follow", "queue") and hasattr(self, k))
+        # route ids are only valid on this graph: send the route itself
+        if "routeId" in state:
+            state["routeId"] = self.graph.routes[self.routeId]
+        pos = self.pos
+        # Position takes the distance from the departure node
+        state["pos"] = (pos.nodeFrom, pos.nodeTo, pos.dist if pos.direction else pos.length - pos.dist, pos.carSize)
+        return state
 
+
+def unpackCar(graph, state):
+    """
+    Rebuilds a car packed with Car.pack on graph (a copy of the graph it came from), and adds it to the population of its edge.
+    """
+    car = Car.__new__(Car)
+    for k, v in state.items():
+        setattr(car, k, v)
+    car.graph = graph
+    if "routeId" in state:
+        car.routeId = graph.addRoute(state["routeId"])
+    nodeFrom, nodeTo, dist, carSize = state["pos"]
+    car.pos = Position(graph, nodeFrom, nodeTo, dist, carSize)
+    car.pos.lane.append(car)
+    graph.markDirty(nodeFrom, nodeTo)
+    if graph.edgeStats is not None:
+        graph.edgeStats.enter(car)
+    return car
+
+
+def routePlan(graph, startNode, endNode):
+    """
+    A* search for best path from startNode to endNode on graph.
+    Returns list of nodes, which form a route from startNode to endNode.
+    If there is no possible route, returns an empty list and prints a message saying so.
+    Kept outside of the Car class so that engines without Car objects (see fleet.py) can plan routes too.
+    Uses the graph's RoutePlanner, which is created on first use and discarded by graph.invalidateRoutes(),
+    or its contraction hierarchy if graph.buildHierarchy() was called.
+    """
+    if graph.hierarchy is not None:
+        return graph.hierarchy.route(startNode, endNode)
+    if graph.routePlanner is None:
+        graph.routePlanner = RoutePlanner(graph)
+    return graph.routePlanner.plan(startNode, endNode)
+
+
+class RoutePlanner:
+    """
+    A* search on a graph, with a priority queue for the open set and buffers which are reused between searches.  \n
+    Edge costs are graph.heuristicWeight (travel time at the speed limit). The estimate for the remaining cost is
+    the straight-line distance to the goal divided by the highest speed limit, scaled down by the smallest ratio of
+    edge length to straight-line edge length (edge lengths are rounded down to ints), so that it never overestimates
+    and the first route found to the goal is the fastest one.  \n
+    Built from the graph's current lengths and speeds: create a new one after changing them.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        size = graph.size
+
+        # node coordinates for the estimate, and each node's connections with their travel times
+        self.xs = [float(node["coords"][0]) for node in graph.nodes]
+        self.ys = [float(node["coords"][1]) for node in graph.nodes]
+        if graph.arrays is not None:
+            # read the travel times straight from the edge columns
+            arrays = graph.arrays
+            times = arrays.travelTimes()[arrays.csrEdge].tolist()
+            targets = arrays.targets.tolist()
+            offsets = arrays.offsets.tolist()
+            self.adj = [list(zip(targets[offsets[n]:offsets[n+1]], times[offsets[n]:offsets[n+1]])) for n in range(size)]
+            node1, node2 = arrays.edgeNodes[:, 0], arrays.edgeNodes[:, 1]
+            speeds, lengths = arrays.speed, arrays.length
+            crows = np.hypot(arrays.nodeX[node1] - arrays.nodeX[node2], arrays.nodeY[node1] - arrays.nodeY[node2])
+        else:
+            self.adj = [[(next, graph.heuristicWeight(node, next)) for next in graph.nodes[node]["connect"]] for node in range(size)]
+            keys = [key for key in graph.edges.keys() if key[0] < key[1]]
+            speeds = np.array([graph.edges[key]["speed"] for key in keys], dtype=float)
+            lengths = np.array([graph.edges[key]["length"] for key in keys], dtype=float)
+            crows = np.array([math.hypot(self.xs[a] - self.xs[b], self.ys[a] - self.ys[b]) for a, b in keys])
+
+        maxSpeed = speeds.max() if len(speeds) else 0
+        straight = crows > 0
+        scale = min(1.0, (lengths[straight] / crows[straight]).min()) if straight.any() else 1.0
+        self.hFactor = float(scale / maxSpeed) if maxSpeed > 0 else 0.0
+
+        # search buffers: an entry is only valid if its stamp matches the current search number
+        self.g = [0.0] * size
+        self.parent = [-1] * size
+        self.seen = [0] * size
+        self.closed = [0] * size
+        self.search = 0
+
+    def plan(self, startNode, endNode):
+        """
+        Returns the fastest route from startNode to endNode as a list of nodes, in the same format as routePlan.
+        """
         if startNode == endNode:
             return [startNode]
-        
-        size = self.graph.size
-        node_g = [0 for i in range(size)]
-        node_f = [0 for i in range(size)]
-        node_h = [0 for i in range(size)]
-        node_parent = ["" for i in range(size)]
-
-        closed = []
-        open = [startNode]
-
-        while len(open):
-            #pop index of next node from list
-            current = open.pop(0)
-            closed.append(current)
+
+        self.search += 1
+        search = self.search
+        g, parent, seen, closed, adj = self.g, self.parent, self.seen, self.closed, self.adj
+        xs, ys, hFactor = self.xs, self.ys, self.hFactor
+        goalX, goalY = xs[endNode], ys[endNode]
+
+        g[startNode] = 0.0
+        parent[startNode] = -1
+        seen[startNode] = search
+        open = [(hFactor * math.hypot(xs[startNode] - goalX, ys[startNode] - goalY), startNode)]
+
+        while open:
+            # pop the node with the lowest estimated total cost
+            f, current = heapq.heappop(open)
+            if closed[current] == search:
+                continue
             # if at goal, return final path
             if current == endNode:
                 node = endNode
                 path = [node]
-                while node_parent[node] != startNode:
-                    node = node_parent[node]
+                while parent[node] != startNode:
+                    node = parent[node]
                     path.append(node)
                 path.append(startNode)
                 path.reverse()
                 return path
-            # iterate through connected nodes
-            adjNodes = self.graph.nodes[current]["connect"]
-            for next in adjNodes:
-                if next not in closed:
-                    if next in open:
-                        if node_g[next] > node_g[current] + self.graph.heuristicWeight(current, next):
-                            update(next, current)
-                #Probable bug right here: does it work if the node is unexplored?
-                    else:
-                        update(next, current)
-                        open.append(next)
-        
+            closed[current] = search
+
+            gCurrent = g[current]
+            for next, weight in adj[current]:
+                if closed[next] == search:
+                    continue
+                gNext = gCurrent + weight
+                if seen[next] != search or gNext < g[next]:
+                    seen[next] = search
+                    g[next] = gNext
+                    parent[next] = current
+                    heapq.heappush(open, (gNext + hFactor * math.hypot(xs[next] - goalX, ys[next] - goalY), next))
+
         # If the route planning fails, warn the user and return an empty list.
         print("Route planning system found no possible route for a car.")
         print("Attempted route from node", startNode, "to node", endNode)
         return []
-        
-
-            
-
-    
-
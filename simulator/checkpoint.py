@@ -0,0 +1,309 @@
+# Checkpoints: the whole state of a running simulation saved to one file, to resume it later or fork several runs from it
+
+# Usage:
+#   checkpoint.save("warm.npz", graph, carList)
+#   ...later, on a new graph built from the same map with the same settings, before any car is created:
+#   carList = checkpoint.load("warm.npz", graph)
+
+# The file is a NumPy .npz archive of flat arrays, one column per attribute of the cars (as in fleet.Fleet),
+# with the variable-length routes and histories packed one after the other (as in tripLog.py); each route followed
+# by a car is saved once, and the cars keep an index into those routes and their cursor along it.
+# Nothing in it is pickled: the links between cars, positions and populations are saved as the place of each car
+# in its lane and node queues, and rebuilt on load. Saved: the cars (a list of cars.Car or a fleet.Fleet) with their
+# positions, velocities, routes, histories, waits and lifetimes; the order of the cars in every lane and node;
+# the weighted speeds and the edges waiting for updateWeights; the graph's counters and history; the state of np.random,
+# of the cars' random streams (see streams.py) and of the draws of a demand.Demand, if given.
+# Not saved: the route tables (rebuilt on demand) and graph.tripLog (attach a new one after loading).
+
+import numpy as np
+import simulator.cars as cars
+import simulator.fleet as fleet
+import simulator.streams as streams
+
+VERSION = 2
+
+# attributes of cars.Car saved as one column each
+CAR_COLUMNS = ("velocity", "speedLimit", "currentWait", "lifetime", "carId", "spawnStep",
+               "accel", "nodeWait", "carSize", "mistakes", "randomBehavior")
+# attributes of cars.Position saved as one column each
+POSITION_COLUMNS = ("nodeFrom", "nodeTo", "dist", "toNext", "atNode", "carSize")
+# per-car arrays of fleet.Fleet (see Fleet._grow)
+FLEET_ARRAYS = ("alive", "seq", "edge", "lane", "direction", "nodeFrom", "nodeTo", "dist", "toNext", "length",
+                "velocity", "speedLimit", "currentWait", "lifetime", "carId", "spawnStep", "atNode", "lead", "follow", "cursor")
+# arrays of fleet.Fleet which are not per car
+FLEET_STATE = ("laneHead", "laneTail", "laneCount", "nodeCount")
+FLEET_SETTINGS = ("randomBehavior", "accel", "nodeWait", "carSize", "mistakes")
+
+
+def packLists(lists):
+    """
+    Packs a list of lists of ints (or None) into two arrays: values, all of them one after the other,
+    and offsets, where list i is values[offsets[i]:offsets[i+1]]; None is marked with an offset of -1 in missing.
+    """
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(l) if l is not None else 0 for l in lists])
+    values = np.fromiter((n for l in lists if l is not None for n in l), dtype=np.int64, count=offsets[-1])
+    missing = np.array([l is None for l in lists], dtype=bool)
+    return values, offsets, missing
+
+
+def unpackLists(values, offsets, missing):
+    values = values.tolist()
+    offsets = offsets.tolist()
+    return [None if missing[i] else values[offsets[i]:offsets[i + 1]] for i in range(len(missing))]
+
+
+def saveRoutes(data, graph, routeIds):
+    """
+    Saves the routes of graph.routes used by the cars (routeIds, -1 for cars without a route), each only once.
+    Returns the index of each car's route among the saved ones (or -1).
+    """
+    used = sorted(set(routeIds) - set([-1]))
+    index = dict((routeId, i) for i, routeId in enumerate(used))
+    data["routeValues"], data["routeOffsets"], data["routeMissing"] = packLists([graph.routes[routeId] for routeId in used])
+    return np.array([index.get(routeId, -1) for routeId in routeIds], dtype=np.int64)
+
+
+def loadRoutes(data, graph):
+    """
+    Adds the saved routes to graph.routes; returns their new ids, in the order they were saved.
+    """
+    routes = unpackLists(data["routeValues"], data["routeOffsets"], data["routeMissing"])
+    return [graph.addRoute(route) for route in routes]
+
+
+def edgeKeys(graph):
+    """
+    One key per edge of a graph which stores its edges as dicts, in a fixed order (the order of graph.edges).
+    """
+    return [key for key in graph.edges.keys() if key[0] < key[1]]
+
+
+def saveRandom(data, prefix, state):
+    """
+    Saves the state of a RandomState (as returned by its get_state) under names starting with prefix.
+    """
+    name, keys, pos, hasGauss, cachedGaussian = state
+    data.update({prefix + "Keys": keys, prefix + "Pos": pos, prefix + "HasGauss": hasGauss, prefix + "Gaussian": cachedGaussian})
+
+
+def loadRandom(data, prefix):
+    """
+    The state saved by saveRandom, to pass to set_state.
+    """
+    return ("MT19937", data[prefix + "Keys"], int(data[prefix + "Pos"]), int(data[prefix + "HasGauss"]),
+            float(data[prefix + "Gaussian"]))
+
+
+def save(filename, graph, carList, compress = False, trips = None):
+    """
+    Saves the state of a simulation: graph and its cars (a list of cars.Car or a fleet.Fleet), and np.random.  \n
+    compress: if True, the arrays are compressed (smaller files, slower to write and read).  \n
+    trips: the demand.Demand creating the cars, if any: the state of its draws is saved too.
+    """
+    data = dict(
+        version = VERSION,
+        graphSize = graph.size,
+        edgeNum = len(graph.edges),
+        lanes = graph.lanes,
+        weighted = graph.weighted,
+        carCount = graph.carCount,
+        stepCount = graph.stepCount,
+        trips = graph.trips,
+        history = np.array(graph.history, dtype=str),
+        streamsSeed = graph.streams.seed if graph.streams is not None else -1,
+    )
+
+    # state of np.random, and of the draws of the departures (a demand takes its step from graph.stepCount)
+    saveRandom(data, "random", np.random.get_state())
+    if trips is not None:
+        saveRandom(data, "demandRandom", trips.random.get_state())
+
+    if isinstance(carList, fleet.Fleet):
+        saveFleet(data, graph, carList)
+    else:
+        saveCars(data, graph, carList)
+
+    write = np.savez_compressed if compress else np.savez
+    # through a file object, so that np.savez does not add .npz to the filename
+    with open(filename, "wb") as f:
+        write(f, **data)
+
+
+def saveCars(data, graph, carList):
+    data["engine"] = "cars"
+    # place of every car in its lane, and of every position in its node
+    laneOrder = {}
+    if graph.arrays is not None:
+        populations = [p for p in graph.arrays.populations if p is not None]
+    else:
+        populations = [graph.edges[key]["population"] for key in edgeKeys(graph)]
+    for population in populations:
+        for queue in population:
+            for i, car in enumerate(queue):
+                laneOrder[id(car)] = i
+    nodeOrder = {}
+    for node in graph.nodes:
+        for i, pos in enumerate(node["population"]):
+            nodeOrder[id(pos)] = i
+
+    for name in CAR_COLUMNS:
+        data["car_" + name] = np.array([getattr(car, name) for car in carList])
+    for name in POSITION_COLUMNS:
+        data["pos_" + name] = np.array([getattr(car.pos, name) for car in carList])
+    data["laneOrder"] = np.array([laneOrder[id(car)] for car in carList], dtype=np.int64)
+    data["nodeOrder"] = np.array([nodeOrder.get(id(car.pos), -1) for car in carList], dtype=np.int64)
+    data["nodeGoal"] = np.array([getattr(car, "nodeGoal", -1) for car in carList], dtype=np.int64)
+    data["randomDrawn"] = np.array([car.random.drawn for car in carList], dtype=np.int64)
+    data["routeIndex"] = saveRoutes(data, graph, [getattr(car, "routeId", -1) for car in carList])
+    data["cursor"] = np.array([getattr(car, "cursor", 0) for car in carList], dtype=np.int64)
+    data["historyValues"], data["historyOffsets"], data["historyMissing"] = packLists([car.history for car in carList])
+
+    if graph.weighted:
+        if graph.arrays is not None:
+            data["weightedSpeed"] = graph.arrays.weightedSpeed
+        else:
+            data["weightedSpeed"] = np.array([list(graph.edges[key]["weighted speed"]) for key in edgeKeys(graph)]).reshape(-1, 2)
+    data["dirtyEdges"] = np.array(sorted(graph.dirtyEdges), dtype=np.int64).reshape(-1, 2)
+
+
+def saveFleet(data, graph, carFleet):
+    data["engine"] = "fleet"
+    for name in FLEET_SETTINGS:
+        data["fleet_" + name] = getattr(carFleet, name)
+    for name in FLEET_ARRAYS + FLEET_STATE:
+        data["fleet_" + name] = getattr(carFleet, name)
+    data["fleet_nextSeq"] = carFleet.nextSeq
+    data["fleet_free"] = np.array(carFleet.free, dtype=np.int64)
+    data["fleet_dirtyEdges"] = np.array(sorted(carFleet.dirtyEdges), dtype=np.int64)
+    data["nodeGoal"] = np.array([-1 if g is None else g for g in carFleet.nodeGoal], dtype=np.int64)
+    data["randomDrawn"] = np.array([-1 if r is None else r.drawn for r in carFleet.random], dtype=np.int64)
+    data["routeIndex"] = saveRoutes(data, graph, carFleet.routeId.tolist())
+    data["historyValues"], data["historyOffsets"], data["historyMissing"] = packLists(carFleet.history)
+    data["weightedSpeed"] = carFleet.arrays.weightedSpeed
+
+
+def load(filename, graph, restoreRandom = True, trips = None):
+    """
+    Restores a simulation saved with save onto graph, and returns its cars (a list of cars.Car or a fleet.Fleet, as saved).  \n
+    graph must be built from the same map with the same settings as the saved one (xmlGetStreetProperties already called),
+    and must not have any cars yet.  \n
+    restoreRandom: if True, np.random continues from where the saved run was; pass False (and seed np.random)
+    to fork runs with different random draws from the same state.  \n
+    trips: the demand.Demand of the resumed run, if any: with restoreRandom, its draws continue from where those
+    of the saved run were (the checkpoint must have been saved with a demand).
+    """
+    with np.load(filename, allow_pickle = False) as f:
+        data = dict(f.items())
+
+    if int(data["version"]) != VERSION:
+        raise ValueError(filename + " was saved by an incompatible version of checkpoint.py.")
+    if int(data["graphSize"]) != graph.size or int(data["edgeNum"]) != len(graph.edges):
+        raise ValueError("The checkpoint was saved on a different map.")
+    if bool(data["lanes"]) != graph.lanes or bool(data["weighted"]) != graph.weighted:
+        raise ValueError("The checkpoint was saved with different lanes or weighted settings.")
+    if graph.carCount != 0:
+        raise ValueError("Checkpoints can only be loaded on a graph without cars.")
+    if trips is not None and restoreRandom and "demandRandomKeys" not in data:
+        raise ValueError("The checkpoint was saved without a demand.")
+
+    graph.carCount = int(data["carCount"])
+    graph.stepCount = int(data["stepCount"])
+    graph.trips = int(data["trips"])
+    graph.history = data["history"].tolist()
+    if int(data["streamsSeed"]) >= 0:
+        graph.streams = streams.RandomStreams(int(data["streamsSeed"]))
+
+    if data["engine"] == "fleet":
+        carList = loadFleet(data, graph)
+    else:
+        carList = loadCars(data, graph)
+
+    if restoreRandom:
+        np.random.set_state(loadRandom(data, "random"))
+        if trips is not None:
+            trips.random.set_state(loadRandom(data, "demandRandom"))
+    return carList
+
+
+def loadCars(data, graph):
+    carNum = len(data["laneOrder"])
+    columns = dict((name, data["car_" + name].tolist()) for name in CAR_COLUMNS)
+    posColumns = dict((name, data["pos_" + name].tolist()) for name in POSITION_COLUMNS)
+    nodeGoals = data["nodeGoal"].tolist()
+    drawn = data["randomDrawn"].tolist()
+    routeIds = loadRoutes(data, graph)
+    routeIndex = data["routeIndex"].tolist()
+    cursors = data["cursor"].tolist()
+    histories = unpackLists(data["historyValues"], data["historyOffsets"], data["historyMissing"])
+
+    carList = []
+    for i in range(carNum):
+        car = cars.Car.__new__(cars.Car)
+        car.graph = graph
+        car.lanes = graph.lanes
+        car.weighted = graph.weighted
+        for name in CAR_COLUMNS:
+            setattr(car, name, columns[name][i])
+        car.history = histories[i]
+        car.random = graph.streams.stream(car.carId, drawn[i]) if graph.streams is not None else streams.GLOBAL
+        if not car.randomBehavior:
+            car.nodeGoal = nodeGoals[i]
+            car.routeId = routeIds[routeIndex[i]]
+            car.cursor = cursors[i]
+
+        # the Position is rebuilt from its saved values rather than with __init__, which would place it anew
+        pos = cars.Position.__new__(cars.Position)
+        pos.graph = graph
+        pos.lanes = graph.lanes
+        for name in POSITION_COLUMNS:
+            setattr(pos, name, posColumns[name][i])
+        pos.eqTol = pos.carSize
+        # direction, length, coordinates of the nodes and references to the edge and its lane
+        pos.setEdge(pos.nodeFrom, pos.nodeTo, graph.edges[(pos.nodeFrom, pos.nodeTo)])
+        car.pos = pos
+        carList.append(car)
+
+    # put the cars back in their lanes and nodes, in their saved order
+    for i in np.argsort(data["laneOrder"], kind="stable").tolist():
+        carList[i].pos.lane.append(carList[i])
+    nodeOrder = data["nodeOrder"]
+    for i in np.argsort(nodeOrder, kind="stable").tolist():
+        if nodeOrder[i] >= 0:
+            pos = carList[i].pos
+            graph.nodes[pos.nodeTo]["population"].append(pos)
+
+    if graph.weighted:
+        weightedSpeed = data["weightedSpeed"]
+        if graph.arrays is not None:
+            graph.arrays.weightedSpeed = weightedSpeed.copy()
+        else:
+            for key, speeds in zip(edgeKeys(graph), weightedSpeed.tolist()):
+                graph.edges[key]["weighted speed"] = speeds
+    graph.dirtyEdges = set(tuple(edge) for edge in data["dirtyEdges"].tolist())
+    return carList
+
+
+def loadFleet(data, graph):
+    carBehavior = dict((name, data["fleet_" + name].item()) for name in FLEET_SETTINGS)
+    carFleet = fleet.Fleet(graph, carBehavior, 0)
+
+    for name in FLEET_ARRAYS + FLEET_STATE:
+        setattr(carFleet, name, data["fleet_" + name].copy())
+    carFleet.capacity = len(carFleet.alive)
+    carFleet.nextSeq = int(data["fleet_nextSeq"])
+    carFleet.free = data["fleet_free"].tolist()
+    carFleet.dirtyEdges = set(data["fleet_dirtyEdges"].tolist())
+    carFleet.nodeGoal = [None if g < 0 else g for g in data["nodeGoal"].tolist()]
+    routeIds = loadRoutes(data, graph)
+    carFleet.routeId = np.array([routeIds[i] if i >= 0 else -1 for i in data["routeIndex"].tolist()], dtype=int)
+    carFleet.history = unpackLists(data["historyValues"], data["historyOffsets"], data["historyMissing"])
+    carFleet.random = [None if drawn < 0 else graph.streams.stream(carId, drawn) if graph.streams is not None else streams.GLOBAL
+                       for carId, drawn in zip(carFleet.carId.tolist(), data["randomDrawn"].tolist())]
+    carFleet.views = [fleet.CarView(carFleet, s) if alive else None for s, alive in enumerate(carFleet.alive.tolist())]
+
+    carFleet.arrays.weightedSpeed = data["weightedSpeed"].copy()
+    if carFleet.weighted:
+        carFleet.laneSpeed = carFleet.arrays.weightedSpeed.reshape(-1)
+    carFleet._coords = None
+    return carFleet
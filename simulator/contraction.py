@@ -0,0 +1,350 @@
+# Contraction hierarchy: preprocessing of a graph which makes fastest-route queries much cheaper than A*
+
+# Usage:
+#   graph.buildHierarchy("map.xml.ch.npz")   # builds it, or loads it from that file if it was built for the same edges
+#   route = cars.routePlan(graph, startNode, endNode)   # now answered by graph.hierarchy
+#   ...or directly: graph.hierarchy.route(startNode, endNode)
+
+# Nodes are removed ("contracted") one at a time, least important first. Removing a node v adds a shortcut u -> w
+# for each pair of remaining neighbors u -> v -> w, unless a path from u to w which avoids v is at least as fast
+# (a "witness", looked for with a small Dijkstra search). The position of a node in that order is its rank.
+# Every fastest route then goes up in rank and comes back down, so a query is two small Dijkstra searches which
+# only follow edges towards higher ranks: one forward from the start, one backwards from the goal. Shortcuts
+# remember the node they skip, and are expanded back into the original edges at the end.
+
+# Edges are directed as in graph.nodes[n]["connect"], so one-way streets are respected; their cost is
+# graph.heuristicWeight (length / speed limit), the same as RoutePlanner and buildRouteTable use.
+
+import hashlib
+import heapq
+import os
+import numpy as np
+
+# bump when the contents of the saved file change, so that old files are rebuilt
+VERSION = 1
+# most nodes settled by a witness search; a search which gives up early only costs an unneeded shortcut
+WITNESS_SETTLE_LIMIT = 60
+
+
+def edgeList(graph):
+    """
+    The directed edges of graph, as three arrays: source node, target node and travel time (heuristicWeight).
+    """
+    if graph.arrays is not None:
+        # read the travel times straight from the edge columns, in CSR order
+        arrays = graph.arrays
+        sources = np.repeat(np.arange(graph.size), np.diff(arrays.offsets))
+        return sources, np.asarray(arrays.targets, dtype=np.int64), np.asarray(arrays.travelTimes()[arrays.csrEdge], dtype=float)
+    sources, targets, weights = [], [], []
+    for node in range(graph.size):
+        for next in graph.nodes[node]["connect"]:
+            sources.append(node)
+            targets.append(next)
+            weights.append(graph.heuristicWeight(node, next))
+    return np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64), np.array(weights, dtype=float)
+
+
+def fingerprint(graph):
+    """
+    SHA-256 (hex) of the directed edges and their travel times: a saved hierarchy is only used on a graph with the same one.
+    """
+    sources, targets, weights = edgeList(graph)
+    order = np.lexsort((targets, sources))
+    digest = hashlib.sha256()
+    digest.update(np.int64(graph.size).tobytes())
+    for column in (sources[order], targets[order], weights[order]):
+        digest.update(np.ascontiguousarray(column).tobytes())
+    return digest.hexdigest()
+
+
+def build(graph, settleLimit = WITNESS_SETTLE_LIMIT):
+    """
+    Contracts every node of graph and returns the resulting Hierarchy.
+    """
+    size = graph.size
+    # the graph which is left: out[u][w] and into[w][u] are the cost of edge u -> w, shortcuts included
+    out = [{} for i in range(size)]
+    into = [{} for i in range(size)]
+    for u, w, cost in zip(*(column.tolist() for column in edgeList(graph))):
+        if u != w and cost < out[u].get(w, np.inf):
+            out[u][w] = cost
+            into[w][u] = cost
+    # (u, w) -> node skipped by the shortcut u -> w
+    middle = {}
+
+    def witness(source, skip, limit, targets):
+        """
+        Costs of the fastest paths from source which avoid skip, for the nodes of targets (up to limit, and settleLimit nodes).
+        """
+        dist = {source: 0.0}
+        queue = [(0.0, source)]
+        left = len(targets)
+        settled = 0
+        while queue and left and settled < settleLimit:
+            d, node = heapq.heappop(queue)
+            if d > dist[node]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            if node in targets:
+                left -= 1
+            for next, cost in out[node].items():
+                if next == skip:
+                    continue
+                newDist = d + cost
+                if newDist < dist.get(next, np.inf):
+                    dist[next] = newDist
+                    heapq.heappush(queue, (newDist, next))
+        return dist
+
+    def shortcuts(v):
+        """
+        The shortcuts (u, w, cost) needed if v were contracted now.
+        """
+        needed = []
+        for u, costIn in into[v].items():
+            targets = dict((w, costIn + costOut) for w, costOut in out[v].items() if w != u)
+            if not targets:
+                continue
+            dist = witness(u, v, max(targets.values()), targets)
+            for w, cost in targets.items():
+                if dist.get(w, np.inf) > cost:
+                    needed.append((u, w, cost))
+        return needed
+
+    # contracted neighbors and depth of each node, which spread the contraction evenly over the graph
+    deleted = [0] * size
+    level = [0] * size
+
+    def priority(v, needed = None):
+        if needed is None:
+            needed = shortcuts(v)
+        return 2 * (len(needed) - len(into[v]) - len(out[v])) + deleted[v] + level[v]
+
+    current = [priority(v) for v in range(size)]
+    queue = [(p, v) for v, p in enumerate(current)]
+    heapq.heapify(queue)
+    rank = [-1] * size
+    up = [None] * size
+    down = [None] * size
+    order = 0
+
+    while queue:
+        p, v = heapq.heappop(queue)
+        if rank[v] >= 0 or p != current[v]:
+            continue
+        # priorities go stale as the graph shrinks: check this one before contracting (lazy update)
+        needed = shortcuts(v)
+        p = current[v] = priority(v, needed)
+        if queue and p > queue[0][0]:
+            heapq.heappush(queue, (p, v))
+            continue
+
+        for u, w, cost in needed:
+            if cost < out[u].get(w, np.inf):
+                out[u][w] = cost
+                into[w][u] = cost
+                middle[(u, w)] = v
+        rank[v] = order
+        order += 1
+        # the edges of v all lead to nodes contracted later: they are its upward edges, forwards and backwards
+        up[v] = list(out[v].items())
+        down[v] = list(into[v].items())
+        neighbors = set(out[v]) | set(into[v])
+        for w in out[v]:
+            del into[w][v]
+        for u in into[v]:
+            del out[u][v]
+        out[v] = into[v] = None
+        for n in neighbors:
+            deleted[n] += 1
+            level[n] = max(level[n], level[v] + 1)
+            current[n] = priority(n)
+            heapq.heappush(queue, (current[n], n))
+
+    return Hierarchy(rank, up, down, middle)
+
+
+class Hierarchy:
+    """
+    A contraction hierarchy of a graph (see build), which answers fastest-route queries with route(startNode, endNode).  \n
+    rank: the contraction order of each node.  \n
+    up[v]: (node, cost) for the edges v -> node towards higher ranks; down[v]: (node, cost) for the edges node -> v
+    from higher ranks.  \n
+    middle: (u, w) -> node skipped by the shortcut u -> w; edges which are not in it are edges of the graph.  \n
+    Built from the graph's current lengths and speeds: build a new one after changing them.
+    """
+    def __init__(self, rank, up, down, middle, fingerprint = None):
+        self.rank = rank
+        self.up = up
+        self.down = down
+        self.middle = middle
+        # fingerprint of the graph it was built for, filled in by Graph.buildHierarchy
+        self.fingerprint = fingerprint
+
+    @property
+    def shortcutCount(self):
+        return len(self.middle)
+
+    def route(self, startNode, endNode):
+        """
+        Returns the fastest route from startNode to endNode as a list of nodes, in the same format as cars.routePlan.
+        """
+        if startNode == endNode:
+            return [startNode]
+        up, down = self.up, self.down
+        heappush, heappop = heapq.heappush, heapq.heappop
+        inf = np.inf
+
+        # forward search from the start on the up edges, backward search from the goal on the down edges
+        distF = {startNode: 0.0}
+        distB = {endNode: 0.0}
+        parentF = {startNode: -1}
+        parentB = {endNode: -1}
+        queueF = [(0.0, startNode)]
+        queueB = [(0.0, endNode)]
+        best = inf
+        meet = -1
+
+        while True:
+            # advance the search with the lowest key; each one stops once it cannot beat the best route found
+            if queueF and queueF[0][0] < best and not (queueB and queueB[0][0] < queueF[0][0]):
+                d, node = heappop(queueF)
+                if d > distF[node]:
+                    continue
+                other = distB.get(node)
+                if other is not None and d + other < best:
+                    best = d + other
+                    meet = node
+                # stall on demand: a higher node already reached node faster, so nothing goes up from here
+                for prev, cost in down[node]:
+                    if distF.get(prev, inf) + cost < d:
+                        break
+                else:
+                    for next, cost in up[node]:
+                        newDist = d + cost
+                        if newDist < distF.get(next, inf):
+                            distF[next] = newDist
+                            parentF[next] = node
+                            heappush(queueF, (newDist, next))
+            elif queueB and queueB[0][0] < best:
+                d, node = heappop(queueB)
+                if d > distB[node]:
+                    continue
+                other = distF.get(node)
+                if other is not None and d + other < best:
+                    best = d + other
+                    meet = node
+                for next, cost in up[node]:
+                    if distB.get(next, inf) + cost < d:
+                        break
+                else:
+                    for prev, cost in down[node]:
+                        newDist = d + cost
+                        if newDist < distB.get(prev, inf):
+                            distB[prev] = newDist
+                            parentB[prev] = node
+                            heappush(queueB, (newDist, prev))
+            else:
+                break
+
+        if meet < 0:
+            # If the route planning fails, warn the user and return an empty list.
+            print("Route planning system found no possible route for a car.")
+            print("Attempted route from node", startNode, "to node", endNode)
+            return []
+
+        # nodes of the search trees, from the start up to the meeting node and down to the goal
+        chain = [meet]
+        node = meet
+        while parentF[node] >= 0:
+            node = parentF[node]
+            chain.append(node)
+        chain.reverse()
+        node = meet
+        while parentB[node] >= 0:
+            node = parentB[node]
+            chain.append(node)
+
+        # expand the shortcuts into the nodes they skip
+        path = [startNode]
+        middle = self.middle
+        for i in range(len(chain) - 1):
+            stack = [(chain[i], chain[i+1])]
+            while stack:
+                a, b = stack.pop()
+                m = middle.get((a, b))
+                if m is None:
+                    path.append(b)
+                else:
+                    stack.append((m, b))
+                    stack.append((a, m))
+        return path
+
+    def save(self, filename):
+        """
+        Writes the hierarchy to a .npz file (see load). The upward edges are stored in CSR form.
+        """
+        def csr(lists):
+            offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(edges) for edges in lists])
+            nodes = np.array([n for edges in lists for n, c in edges], dtype=np.int64)
+            costs = np.array([c for edges in lists for n, c in edges], dtype=float)
+            return offsets, nodes, costs
+
+        upOffsets, upNodes, upCosts = csr(self.up)
+        downOffsets, downNodes, downCosts = csr(self.down)
+        keys = list(self.middle.keys())
+        # write to a temporary name first, so that concurrent processes never read a half-written file
+        temporary = "{0}.{1}.tmp.npz".format(filename, os.getpid())
+        np.savez(temporary, version = VERSION, fingerprint = self.fingerprint or "",
+                 rank = np.array(self.rank, dtype=np.int64),
+                 upOffsets = upOffsets, upNodes = upNodes, upCosts = upCosts,
+                 downOffsets = downOffsets, downNodes = downNodes, downCosts = downCosts,
+                 shortcutFrom = np.array([k[0] for k in keys], dtype=np.int64),
+                 shortcutTo = np.array([k[1] for k in keys], dtype=np.int64),
+                 shortcutMiddle = np.array([self.middle[k] for k in keys], dtype=np.int64))
+        os.replace(temporary, filename)
+
+
+def load(filename):
+    """
+    Reads a hierarchy written by Hierarchy.save. Raises ValueError if it was written by another version.
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        if int(data["version"]) != VERSION:
+            raise ValueError("{0} was saved by version {1} of the contraction hierarchy, not {2}".format(filename, int(data["version"]), VERSION))
+
+        def lists(offsets, nodes, costs):
+            offsets, nodes, costs = offsets.tolist(), nodes.tolist(), costs.tolist()
+            return [list(zip(nodes[offsets[n]:offsets[n+1]], costs[offsets[n]:offsets[n+1]])) for n in range(len(offsets) - 1)]
+
+        up = lists(data["upOffsets"], data["upNodes"], data["upCosts"])
+        down = lists(data["downOffsets"], data["downNodes"], data["downCosts"])
+        middle = dict(zip(zip(data["shortcutFrom"].tolist(), data["shortcutTo"].tolist()), data["shortcutMiddle"].tolist()))
+        return Hierarchy(data["rank"].tolist(), up, down, middle, str(data["fingerprint"]) or None)
+
+
+def loadOrBuild(graph, filename = None):
+    """
+    The hierarchy of graph: read from filename if that file was built for the same edges and travel times,
+    otherwise built (and written to filename, if given). Failing to read or write the file is not an error.
+    """
+    key = fingerprint(graph)
+    if filename is not None and os.path.exists(filename):
+        try:
+            hierarchy = load(filename)
+            if hierarchy.fingerprint == key:
+                return hierarchy
+        except (OSError, ValueError, KeyError):
+            # unreadable, outdated or incomplete file: rebuild it
+            pass
+    hierarchy = build(graph)
+    hierarchy.fingerprint = key
+    if filename is not None:
+        try:
+            hierarchy.save(filename)
+        except OSError:
+            pass
+    return hierarchy
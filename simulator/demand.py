@@ -0,0 +1,103 @@
+# Travel demand: cars created from an origin-destination matrix with rates which change over the day
+
+# Usage:
+#   od = demand.uniformOD(graph, tripsPerHour = 20000)
+#   trips = demand.Demand(graph, od, profile = demand.PROFILES["morning"], startHour = 6, seed = 1234)
+#   ...then each step: run.stepCars(carList, graph, 0, carSettings, trips)
+
+# Instead of topping the simulation up to a constant number of cars, each step draws the trips which depart during it:
+# how many (a Poisson draw, from the total rate of the matrix at that hour) and between which nodes
+# (one search in the cumulative rates of all pairs for all of them). Routes towards every destination are computed
+# in one go when the Demand is created (Graph.buildRouteTable), and a fleet.Fleet places all of a step's cars at once.
+
+import numpy as np
+import simulator.cars as cars
+import simulator.fleet as fleet
+
+# multiplier of the rates for each hour of the day, starting at midnight
+PROFILES = {
+    "flat": [1.0] * 24,
+    "morning": [0.1, 0.05, 0.05, 0.05, 0.1, 0.3, 0.9, 2.2, 3.0, 1.8, 1.0, 0.9,
+                0.9, 0.9, 0.8, 0.8, 0.9, 1.0, 0.9, 0.7, 0.5, 0.4, 0.3, 0.2],
+    "twoPeaks": [0.1, 0.05, 0.05, 0.05, 0.1, 0.3, 0.9, 2.2, 2.6, 1.5, 0.9, 0.9,
+                 1.0, 1.0, 0.9, 1.0, 1.6, 2.4, 2.2, 1.2, 0.7, 0.5, 0.3, 0.2],
+}
+
+
+def uniformOD(graph, tripsPerHour, nodes = None):
+    """
+    OD matrix with tripsPerHour trips in total, spread evenly over all pairs of different nodes (default: graph.endNodes).
+    Returns (origins, destinations, rates), as taken by Demand.
+    """
+    nodes = list(graph.endNodes if nodes is None else nodes)
+    rates = np.full((len(nodes), len(nodes)), 1.0)
+    np.fill_diagonal(rates, 0)
+    rates *= tripsPerHour / rates.sum() if rates.sum() > 0 else 0
+    return nodes, nodes, rates
+
+
+class Demand:
+    """
+    Creates the cars of a simulation from an OD matrix.  \n
+    od: (origins, destinations, rates), rates[i][j] being the trips per hour from origins[i] to destinations[j]
+    (see uniformOD). Origins must have at least one connection; pairs without a route should have a rate of 0.  \n
+    profile: multiplier of the rates for each hour (see PROFILES), repeated after its last hour; defaults to constant rates.  \n
+    stepsPerHour: number of time steps in a simulated hour; startHour: hour of the profile at step 0.  \n
+    seed: seeds the draws of the departures, which are independent of np.random.
+    """
+
+    def __init__(self, graph, od, profile = None, stepsPerHour = 3600, startHour = 0, seed = 0):
+        origins, destinations, rates = od
+        rates = np.asarray(rates, dtype=float)
+        self.graph = graph
+        self.profile = list(profile) if profile is not None else [1.0]
+        self.stepsPerHour = stepsPerHour
+        self.startHour = startHour
+        self.random = np.random.RandomState(seed)
+
+        # the pairs with a rate, and their cumulative share of the total
+        pairs = np.flatnonzero(rates.reshape(-1) > 0)
+        self.origins = np.asarray(origins, dtype=int)[pairs // rates.shape[1]]
+        self.destinations = np.asarray(destinations, dtype=int)[pairs % rates.shape[1]]
+        pairRates = rates.reshape(-1)[pairs]
+        self.tripsPerHour = pairRates.sum()
+        self.cumulative = np.cumsum(pairRates) / self.tripsPerHour if len(pairs) else np.zeros(0)
+
+        # routes towards every destination, computed once here instead of when each car is created
+        # (not needed with a contraction hierarchy, which answers each route on its own)
+        goals = sorted(set(self.destinations.tolist()) - set(graph.routeTable))
+        if goals and graph.hierarchy is None:
+            graph.buildRouteTable(goals)
+
+    def rate(self, step):
+        """
+        Expected number of departures during time step step.
+        """
+        hour = int(self.startHour + step / float(self.stepsPerHour)) % len(self.profile)
+        return self.tripsPerHour * self.profile[hour] / self.stepsPerHour
+
+    def departures(self, step):
+        """
+        Draws the trips departing during time step step: returns their origins and destinations, as two int arrays.
+        """
+        count = self.random.poisson(self.rate(step)) if len(self.cumulative) else 0
+        pairs = np.searchsorted(self.cumulative, self.random.random_sample(count), side="right")
+        # rounding can leave the last cumulative value just below 1
+        pairs = np.minimum(pairs, len(self.cumulative) - 1)
+        return self.origins[pairs], self.destinations[pairs]
+
+    def spawn(self, carList, carSettings):
+        """
+        Adds the cars departing during the current step (graph.stepCount) to carList, a list of cars.Car or a fleet.Fleet.
+        Returns how many were added.
+        """
+        origins, destinations = self.departures(self.graph.stepCount)
+        if isinstance(carList, fleet.Fleet):
+            carList.spawnBatch(origins, destinations.tolist())
+        else:
+            settings = dict(carSettings)
+            for origin, goal in zip(origins.tolist(), destinations.tolist()):
+                settings["startNode"] = origin
+                settings["nodeGoal"] = goal
+                carList.append(cars.Car(self.graph, settings))
+        return len(origins)
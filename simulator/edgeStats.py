@@ -0,0 +1,302 @@
+# Per-edge traffic statistics, collected while the simulation runs
+
+# Usage:
+#   graph.edgeStats = edgeStats.EdgeStats(graph, binSize = 100, steps = totalSimulationSteps)
+#   ...run the simulation (run.stepCars, events.EventScheduler)...
+#   graph.edgeStats.means()            (at any time: mean occupancy, queue, flow and speed of each lane, per time bin)
+#   graph.edgeStats.save("stats.npz")  (read back with edgeStats.load)
+
+# Nothing scans the lanes at each step: cars report the events which change the numbers, and each report is O(1):
+#   enter / leave: a car joins or leaves a lane (spawn, turn onto the next edge, arrival at its goal)
+#   stop: a car's velocity becomes 0, or stops being 0
+# A report only appends the lane (its number, pos.laneId) to a list; the stepping loop marks where each step starts in
+# those lists (mark). A car which was not updated at the step it stopped or started (asleep, see events.py) reports it
+# later with that step (stopAt).
+# When a time bin ends (or the numbers are read), the lists are turned into per-lane totals in a few NumPy passes:
+# a car which joins a lane at step t adds (end of the bin - t) car-steps to its occupancy, one which leaves removes
+# as many, and the lanes start the next bin with the cars on them. Stopped cars give the queue the same way.
+# The distance covered on each lane comes from the lengths of the lanes entered, and the distance left to go by the
+# cars on the lane at the start and end of the bin (the only scan of the lanes, once per bin).
+# Lanes are the two directions of each edge: lane 2 * edge + direction, direction 1 being towards the higher node
+# (as in edge["population"][direction]). Edges are numbered like the edge ids of graphArrays.GraphArrays.
+
+import numpy as np
+
+# totals kept per time bin and lane
+#   entries, exits: cars which joined or left the lane (flow)
+#   occupancy: car-steps on the lane; divided by the steps of the bin, the mean number of cars on it
+#   queue: car-steps with velocity 0; divided by the steps of the bin, the mean number of stopped cars
+#   distance: distance covered by the cars on the lane; divided by the occupancy, their mean speed
+FIELDS = ("entries", "exits", "occupancy", "queue", "distance")
+
+
+def graphLanes(graph):
+    """
+    Returns the nodes of each edge of graph (in the order of graphArrays.GraphArrays), the population lanes
+    of each edge, two per edge, and the length of each lane.
+    """
+    if graph.arrays is not None:
+        edgeNodes = graph.arrays.edgeNodes.tolist()
+        lanes = [lane for edge in range(len(edgeNodes)) for lane in graph.arrays.population(edge)]
+        lengths = np.repeat(graph.arrays.length.astype(float), 2)
+        return edgeNodes, lanes, lengths
+    edgeNodes = []
+    lanes = []
+    lengths = []
+    seen = set()
+    for key, edge in graph.edges.items():
+        if key in seen:
+            continue
+        seen.add(key)
+        seen.add((key[1], key[0]))
+        edgeNodes.append(key)
+        lanes.extend(edge["population"])
+        lengths.extend([edge["length"]] * 2)
+    return edgeNodes, lanes, np.array(lengths, dtype=float)
+
+
+class EdgeStats:
+    """
+    Accumulates traffic numbers for each direction of each edge of graph, in time bins of binSize steps.  \n
+    steps: expected length of the run, to allocate the arrays once; they grow if the run is longer.  \n
+    Set it as graph.edgeStats for the cars to report to it. Cars already on the graph are counted from now on.
+    """
+    def __init__(self, graph, binSize = 100, steps = 0):
+        if binSize < 1:
+            raise ValueError("The bins of EdgeStats must be at least one step long.")
+        self.graph = graph
+        self.binSize = binSize
+        self.startStep = graph.stepCount
+        edgeNodes, self.lanes, self.lengths = graphLanes(graph)
+        self.edgeNodes = np.array(edgeNodes, dtype=np.int64).reshape(len(edgeNodes), 2)
+        self.laneNum = len(self.lanes)
+
+        # reports since the last flush: the lane of each event, in order
+        self.entering = []
+        self.leaving = []
+        self.stopping = []
+        self.starting = []
+        # (lane, step, 1 if it stopped or -1 if it started) of the reports made after their step
+        self.late = []
+        # (step, lengths of the four lists) at the start of each step since the last flush; reports before the first
+        # mark belong to logStep
+        self.marks = []
+        self.logStep = self.startStep
+        # distance of cars which did not enter at the start of a lane or leave at its end (loaded from a checkpoint)
+        self.extraDistance = {}
+
+        # finished bins: one row per bin, one column per lane
+        bins = max(1, -(-steps // binSize))
+        self.binned = dict((name, np.zeros((bins, self.laneNum))) for name in FIELDS)
+        self.bin = 0
+        self.binEnd = self.startStep + binSize
+        # the current bin: cars (and stopped cars) on each lane when it started and now, and totals so far, each event
+        # counted up to the end of the bin
+        self.count = np.zeros(self.laneNum)
+        self.stopped = np.zeros(self.laneNum)
+        # cars already on the graph (for instance loaded from a checkpoint)
+        for i, lane in enumerate(self.lanes):
+            for car in lane:
+                self.count[i] += 1
+                if car.velocity == 0:
+                    self.stopped[i] += 1
+        self.toGo = self.distanceToGo()
+        self.resetBin()
+
+    def resetBin(self):
+        self.startCount = self.count.copy()
+        self.startStopped = self.stopped.copy()
+        self.current = dict((name, np.zeros(self.laneNum)) for name in FIELDS)
+
+    def distanceToGo(self):
+        """
+        Returns the distance left to the end of its lane of all the cars on each lane.
+        """
+        toGo = np.zeros(self.laneNum)
+        for i in np.flatnonzero(self.count):
+            # toNext can be below 0 at a node without lanes
+            toGo[i] = sum(max(car.pos.toNext, 0) for car in self.lanes[i])
+        return toGo
+
+    def enter(self, car):
+        """
+        Called when car joins the lane car.pos.lane.
+        """
+        pos = car.pos
+        i = pos.laneId
+        self.entering.append(i)
+        if car.velocity == 0:
+            self.stopping.append(i)
+        if pos.toNext != pos.length:
+            # not at the start of the lane: only the rest of it is covered
+            self.extraDistance[i] = self.extraDistance.get(i, 0) + pos.toNext - pos.length
+
+    def leave(self, car):
+        """
+        Called when car leaves the lane car.pos.lane (before it is removed from it).
+        """
+        pos = car.pos
+        i = pos.laneId
+        self.leaving.append(i)
+        if car.velocity == 0:
+            self.starting.append(i)
+        if pos.toNext > 0:
+            # not at the end of the lane
+            self.extraDistance[i] = self.extraDistance.get(i, 0) - pos.toNext
+
+    def stop(self, lane, stopped):
+        """
+        Called when the velocity of a car on lane (its laneId) becomes 0 (stopped = True) or stops being 0 (stopped = False).
+        """
+        (self.stopping if stopped else self.starting).append(lane)
+
+    def stopAt(self, lane, stopped, step):
+        """
+        As stop, for a car which stopped or started at an earlier step of the current bin (or at the current step).
+        """
+        self.late.append((lane, step, 1 if stopped else -1))
+
+    def mark(self):
+        """
+        Called by the stepping loop at the start of each step, once graph.stepCount is the new step.
+        """
+        step = self.graph.stepCount
+        if step >= self.binEnd:
+            self.roll(step)
+        if self.entering or self.leaving or self.stopping or self.starting:
+            self.marks.append((step, len(self.entering), len(self.leaving), len(self.stopping), len(self.starting)))
+        else:
+            self.logStep = step
+
+    def flush(self):
+        """
+        Adds the reports since the last flush to the current bin, each one counted up to the end of the bin.
+        """
+        marks = np.array(self.marks, dtype=np.int64).reshape(len(self.marks), 5)
+        steps = np.concatenate([[self.logStep], marks[:, 0]])
+        current = self.current
+        for column, log, state, name, sign in ((1, self.entering, self.count, "occupancy", 1),
+                                               (2, self.leaving, self.count, "occupancy", -1),
+                                               (3, self.stopping, self.stopped, "queue", 1),
+                                               (4, self.starting, self.stopped, "queue", -1)):
+            if not log:
+                continue
+            lanes = np.array(log, dtype=np.intp)
+            # step of each report: the step of the last mark before it
+            logSteps = np.repeat(steps, np.diff(np.concatenate([[0], marks[:, column], [len(log)]])))
+            events = np.bincount(lanes, minlength = self.laneNum)
+            state += sign * events
+            current[name] += sign * np.bincount(lanes, weights = self.binEnd - logSteps, minlength = self.laneNum)
+            if column == 1:
+                current["entries"] += events
+                current["distance"] += events * self.lengths
+            elif column == 2:
+                current["exits"] += events
+            del log[:]
+        if self.late:
+            lanes, lateSteps, signs = np.array(self.late, dtype=np.int64).T
+            self.stopped += np.bincount(lanes, weights = signs, minlength = self.laneNum)
+            current["queue"] += np.bincount(lanes, weights = signs * (self.binEnd - lateSteps), minlength = self.laneNum)
+            self.late = []
+        for i, distance in self.extraDistance.items():
+            current["distance"][i] += distance
+        self.extraDistance.clear()
+        self.marks = []
+        self.logStep = self.graph.stepCount
+
+    def roll(self, step):
+        """
+        Closes every bin which ends at or before step, and moves its totals into the arrays.
+        Called before any car moves in step: the cars are where they were at the end of the bin.
+        """
+        self.flush()
+        while step >= self.binEnd:
+            if self.bin >= len(self.binned["occupancy"]):
+                # longer run than expected: double the arrays
+                for name in FIELDS:
+                    self.binned[name] = np.concatenate([self.binned[name], np.zeros_like(self.binned[name])])
+            toGo = self.distanceToGo()
+            for name in ("entries", "exits"):
+                self.binned[name][self.bin] = self.current[name]
+            self.binned["occupancy"][self.bin] = self.current["occupancy"] + self.startCount * self.binSize
+            self.binned["queue"][self.bin] = self.current["queue"] + self.startStopped * self.binSize
+            self.binned["distance"][self.bin] = self.current["distance"] + self.toGo - toGo
+            self.toGo = toGo
+            self.resetBin()
+            self.bin += 1
+            self.binEnd += self.binSize
+
+    def totals(self):
+        """
+        Returns the totals of FIELDS up to the end of the last step, as arrays of shape (bins, edges, 2), the last bin
+        being the current one (possibly not finished); and binSteps, the number of steps in each bin.
+        The numbers of a bin are those of the end of each of its steps: the step count when the statistics started is
+        the first step of the first bin.
+        Can be called at any time between steps (with events.EventScheduler, after its sync).
+        """
+        now = self.graph.stepCount + 1
+        if now >= self.binEnd:
+            self.roll(now)
+        else:
+            self.flush()
+        # the current bin, unless it has just started
+        currentSteps = now - (self.binEnd - self.binSize)
+        bins = self.bin + (1 if currentSteps > 0 else 0)
+        result = {}
+        for name in FIELDS:
+            result[name] = np.zeros((bins, self.laneNum))
+            result[name][:self.bin] = self.binned[name][:self.bin]
+        if currentSteps > 0:
+            # up to now, without closing the bin: the events were counted up to its end
+            remaining = self.binEnd - now
+            current = self.current
+            result["entries"][-1] = current["entries"]
+            result["exits"][-1] = current["exits"]
+            result["occupancy"][-1] = (current["occupancy"] - (self.count - self.startCount) * remaining +
+                                       self.startCount * currentSteps)
+            result["queue"][-1] = (current["queue"] - (self.stopped - self.startStopped) * remaining +
+                                   self.startStopped * currentSteps)
+            result["distance"][-1] = current["distance"] + self.toGo - self.distanceToGo()
+        for name in FIELDS:
+            result[name] = result[name].reshape(bins, len(self.edgeNodes), 2)
+        binSteps = np.full(bins, self.binSize, dtype=np.int64)
+        if currentSteps > 0:
+            binSteps[-1] = currentSteps
+        result["binSteps"] = binSteps
+        return result
+
+    def means(self):
+        """
+        Returns, as arrays of shape (bins, edges, 2) (see totals): the mean number of cars (occupancy) and of stopped
+        cars (queue) on each lane, the cars leaving it per step (flow), and the mean speed of the cars on it
+        (speed: distance per car-step, NaN without any car).
+        """
+        totals = self.totals()
+        binSteps = totals["binSteps"].reshape(-1, 1, 1).astype(float)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            speed = np.where(totals["occupancy"] > 0, totals["distance"] / totals["occupancy"], np.nan)
+        return dict(
+            occupancy = totals["occupancy"] / binSteps,
+            queue = totals["queue"] / binSteps,
+            flow = totals["exits"] / binSteps,
+            speed = speed,
+            binSteps = totals["binSteps"],
+        )
+
+    def save(self, filename):
+        """
+        Writes the totals (see totals) to filename as an .npz file, with edgeNodes (the two nodes of each edge),
+        binSize and startStep (the step count when the statistics started).
+        """
+        totals = self.totals()
+        # through a file object, so that np.savez does not add .npz to the filename
+        with open(filename, "wb") as f:
+            np.savez(f, edgeNodes = self.edgeNodes, binSize = self.binSize, startStep = self.startStep, **totals)
+
+
+def load(filename):
+    """
+    Reads statistics saved with EdgeStats.save, as a dict of arrays.
+    """
+    with np.load(filename, allow_pickle = False) as f:
+        return dict(f.items())
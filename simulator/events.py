@@ -0,0 +1,508 @@
+# Discrete-event stepping: only the cars with something to decide are updated, the others sleep until an event
+
+# Usage:
+#   scheduler = events.EventScheduler(graph, carList, carsNum, carSettings)
+#   ...then each step: scheduler.step()      (instead of run.stepCars(carList, graph, carsNum, carSettings))
+#   scheduler.sync()                         (before reading the cars: rendering, checkpoint.save, end of the run)
+
+# Most car updates change nothing interesting: a car waiting at a node counts currentWait up to nodeWait, a car
+# alone on its lane at the speed limit moves by the same amount each step, and a car stuck behind a full node
+# (or behind such a car) repeats the same one or two states every step. After each update, a car in one of those
+# situations goes to sleep, with what it needs to work out its state at any later step:
+#   WAIT: at a node with currentWait < nodeWait - 1; wakes when the wait expires (a timed event).
+#   CRUISE: first on its lane (or without lanes) at the speed limit, far from its next node; moves speedLimit per step
+#       and wakes on approaching the node (a timed event).
+#       A car following a CRUISE car at the same speed, far enough behind it never to brake, cruises as well, and
+#       wakes with it if the car ahead wakes first.
+#   FREE: first on its lane (or without lanes), speeding up towards the speed limit: its next states do not depend on
+#       anything else, so they are worked out once (and cached per velocity, distance and car settings) and it wakes
+#       when it reaches the speed limit or nears the node (a timed event).
+#   CYCLE: with lanes, its state (velocity, position) repeats every one or two steps, while its input stays the same:
+#       the node ahead is full (it is first on its lane), or the car ahead is itself sleeping in WAIT or CYCLE.
+#       Wakes when a car leaves that node (capacity release) or when the car ahead wakes (leader interaction).
+#       A car standing still behind a car which does not move (asleep or not) sleeps at once, as a one-state CYCLE:
+#       a queue falls asleep in one step, car by car from its head. It wakes when the car ahead moves, so a queue
+#       wakes from its head one car at a time as it starts moving, rather than all at once.
+# Timed events are kept in a priority queue; the other wakeups are lists of sleeping cars per node, per sleeping car
+# ahead, and per awake car ahead (watchers, checked after each update of that car).
+# With a weighted graph, the speed limits change when cars join or leave a lane: the cars sleeping on the lanes whose
+# weighted speed changed are woken before the step.
+# A sleeping car costs nothing per step. When another car looks at it (as the car ahead, or as the last car of a lane
+# it wants to enter), its fields are first brought to the right step (sync), exactly as if it had been updated.
+
+# Cars are still updated in the order of the car list and draw the same random numbers (sleeping cars never draw),
+# so the results are the same as with run.stepCars: same trips, same states after sync, same np.random state.
+# With edge statistics (graph.edgeStats, see edgeStats.py), a car which stops or starts moving while asleep (FREE, or a
+# CYCLE alternating between standing and moving) reports it, with the step it happened at, whenever it is brought up
+# to date (edgeStats.EdgeStats.stopAt); every car is brought up to date before a time bin ends, so the statistics
+# are the same as well.
+
+import heapq
+import simulator.cars as cars
+
+WAIT = "wait"
+CRUISE = "cruise"
+FREE = "free"
+CYCLE = "cycle"
+
+
+def cruiseThreshold(car, velocity):
+    """
+    For a car with nothing ahead going at its speed limit: while its toNext is above the returned value, an update changes
+    nothing but its position (see Car.accelWithoutFollowing). None if the car is not at its speed limit.
+    """
+    if velocity != car.speedLimit or velocity <= 0:
+        return None
+    accel = car.accel
+    steps = int(velocity / accel)
+    return max(velocity + accel + accel * (steps * (steps + 1) // 2), car.carSize)
+
+
+def freePath(car):
+    """
+    The next updates of a car with nothing ahead, as long as they depend on nothing but the car itself: until it reaches
+    its next node (with lanes: until it reaches for it, since the room on the node decides what happens then), or gets
+    to cruising at its speed limit. Returns a tuple with the velocity and the distance covered since now after each one.  \n
+    Uses the car's own accelWithoutFollowing, on its fields set to each state in turn and then put back.
+    """
+    pos = car.pos
+    saved = (car.velocity, pos.toNext)
+    velocity, toNext = car.velocity, pos.toNext
+    lanes = car.lanes
+    covered = 0
+    path = []
+    try:
+        while True:
+            car.velocity, pos.toNext = velocity, toNext
+            velocity += car.accelWithoutFollowing()
+            if velocity < 0:
+                velocity = 0
+            elif velocity > car.speedLimit:
+                # the update would warn about it: leave it to the car
+                break
+            if lanes and toNext <= velocity:
+                break
+            covered += velocity
+            toNext = saved[1] - covered
+            if not lanes and toNext <= 0:
+                break
+            path.append((velocity, covered))
+            threshold = cruiseThreshold(car, velocity)
+            if threshold is not None and toNext > threshold:
+                break
+    finally:
+        car.velocity, pos.toNext = saved
+    return tuple(path)
+
+
+class Sleep:
+    """
+    What a sleeping car needs to compute its state at a later step: its kind (WAIT, CRUISE or CYCLE), the step of its last
+    update (base), its lifetime then, and for CRUISE and CYCLE its (velocity, dist, toNext) after the last two updates
+    (states, the last one first for CRUISE). dependents: the cars sleeping behind it.
+    reported: the step up to which it reported stopping and starting to the edge statistics.
+    """
+    __slots__ = ("car", "kind", "base", "lifetime", "currentWait", "states", "dependents", "reported")
+
+    def __init__(self, car, kind, base, states = None):
+        self.car = car
+        self.kind = kind
+        self.base = base
+        self.lifetime = car.lifetime
+        self.currentWait = car.currentWait
+        self.states = states
+        self.dependents = []
+        self.reported = base
+
+    @property
+    def stationary(self):
+        # the car does not move while asleep: the cars behind it only need to wake once it does
+        return self.kind == WAIT or (self.kind == CYCLE and self.states[0] == self.states[1])
+
+
+class EventScheduler:
+    """
+    Steps a list of cars.Car like run.stepCars (same arguments), updating only the cars which are awake (see above).  \n
+    carList: the list of cars, which is kept up to date (finished cars removed, new cars appended).  \n
+    trips: if a demand.Demand, the new cars are the trips it draws for each step, as in run.stepCars.  \n
+    updates: number of car updates actually done; carSteps: number of car updates stepCars would have done.
+    """
+    def __init__(self, graph, carList, carsNum, carSettings, trips = None):
+        if not isinstance(carList, list):
+            raise ValueError("The event scheduler steps a list of cars.Car, not a fleet.Fleet.")
+        self.graph = graph
+        self.carList = carList
+        self.carsNum = carsNum
+        self.carSettings = carSettings
+        self.trips = trips
+
+        # cars are updated in the order of carList, which only ever grows at the end: number them in that order
+        self.order = {}
+        self.nextOrder = 0
+        # cars updated every step, sleeping cars and their timed events (wake step, order, count, record)
+        self.awake = set()
+        self.sleeping = {}
+        self.timed = []
+        self.eventCount = 0
+        # node -> records of the cars waiting for room on it
+        self.blocked = {}
+        # awake car -> records of the cars standing still behind it, woken once it moves
+        self.watchers = {}
+        # car -> its last two (state, input) observations, to find repeating states
+        self.recent = {}
+        # free paths (see freePath) by starting state
+        self.paths = {}
+        # the queue of cars still to update in the current step, and the order of the one being updated
+        self.queue = []
+        self.current = -1
+
+        self.updates = 0
+        self.carSteps = 0
+        for car in carList:
+            self.add(car)
+
+    def add(self, car):
+        self.order[car] = self.nextOrder
+        self.nextOrder += 1
+        self.awake.add(car)
+
+    def step(self):
+        """
+        Moves every car by one time step, then adds new cars, as run.stepCars does.
+        """
+        graph = self.graph
+        stats = graph.edgeStats
+        if stats is not None and graph.stepCount + 1 >= stats.binEnd:
+            # the edge statistics read where every car is at the end of a bin
+            self.sync()
+        graph.stepCount += 1
+        now = graph.stepCount
+        if stats is not None:
+            stats.mark()
+        self.carSteps += len(self.carList)
+        if graph.weighted:
+            self.updateWeights()
+
+        # timed events due at this step
+        timed = self.timed
+        while timed and timed[0][0] <= now:
+            record = heapq.heappop(timed)[-1]
+            if self.sleeping.get(record.car) is record:
+                self.wake(record)
+
+        order = self.order
+        sleeping = self.sleeping
+        lanes = graph.lanes
+        # the awake cars in order, merged with the cars woken during the step (self.queue)
+        awake = sorted(self.awake, key = order.__getitem__)
+        orders = [order[car] for car in awake]
+        count = len(awake)
+        self.queue = queue = []
+        recent = self.recent
+        materialize = self.materialize
+        i = 0
+        updates = 0
+        finished = []
+        while i < count or queue:
+            if queue and (i == count or queue[0][0] < orders[i]):
+                self.current, car = heapq.heappop(queue)
+            else:
+                self.current, car = orders[i], awake[i]
+                i += 1
+            pos = car.pos
+            # bring the cars this one looks at up to date
+            if sleeping and lanes:
+                lead = car.lead
+                if lead is not None and lead in sleeping:
+                    # as syncCar does
+                    materialize(sleeping[lead], now if order[lead] < self.current else now - 1)
+                if pos.atNode:
+                    node = pos.nodeTo
+                    for next in graph.nodes[node]["connect"]:
+                        tail = graph.edges[(node, next)]["population"][0 if node > next else 1].tail
+                        if tail is not None and tail in sleeping:
+                            self.syncCar(tail)
+
+            nodeBefore = pos.nodeTo if pos.atNode else None
+            stoppedBefore = car.velocity == 0
+            watchers = self.watchers.get(car)
+            if watchers is not None:
+                before = (car.velocity, pos.dist, pos.toNext, pos.atNode, pos.lane)
+            updates += 1
+            if car.updatePosition():
+                finished.append(car)
+                self.awake.discard(car)
+                recent.pop(car, None)
+                del order[car]
+                self.release(nodeBefore)
+                if watchers is not None:
+                    self.wakeWatchers(car)
+                continue
+            if nodeBefore is not None and not pos.atNode:
+                self.release(nodeBefore)
+            if watchers is not None and before != (car.velocity, pos.dist, pos.toNext, pos.atNode, pos.lane):
+                self.wakeWatchers(car)
+            if lanes and car.velocity > 0 and car.lead is not None and car.lead not in sleeping and not pos.atNode:
+                # following a car which is awake (the most common case on busy maps): see observe
+                recent.pop(car, None)
+                continue
+            self.observe(car, now, stoppedBefore)
+        self.current = -1
+        self.updates += updates
+
+        for car in finished:
+            self.carList.remove(car)
+        # new cars, as in run.stepCars
+        count = len(self.carList)
+        if self.trips is not None:
+            self.trips.spawn(self.carList, self.carSettings)
+        else:
+            while len(self.carList) < self.carsNum:
+                self.carList.append(cars.Car(graph, self.carSettings))
+        for car in self.carList[count:]:
+            self.add(car)
+
+    def observe(self, car, now, stoppedBefore):
+        """
+        Puts car to sleep after its update at step now, if it is in one of the situations described at the top.
+        stoppedBefore: the car was standing still before the update.
+        """
+        graph = self.graph
+        pos = car.pos
+        if pos.atNode:
+            self.recent.pop(car, None)
+            # as for FREE below, a single step is not worth a sleep
+            if car.nodeWait - car.currentWait > 1:
+                self.sleep(Sleep(car, WAIT, now), now + car.nodeWait - car.currentWait + 1)
+            return
+
+        lead = car.lead if graph.lanes else None
+        velocity = car.velocity
+        if lead is not None and velocity == 0 and stoppedBefore and pos.toNext > 0:
+            # the update left it where it was, looking at the car ahead as that one is now: it stays until that one moves
+            # (which the car ahead does not do while asleep in WAIT or a one-state CYCLE)
+            record = self.sleeping.get(lead)
+            if record is None or record.stationary:
+                self.recent.pop(car, None)
+                state = (velocity, pos.dist, pos.toNext)
+                follower = Sleep(car, CYCLE, now, (state, state))
+                self.sleep(follower)
+                if record is None:
+                    self.watchers.setdefault(lead, []).append(follower)
+                else:
+                    record.dependents.append(follower)
+                return
+        if lead is not None and lead not in self.sleeping:
+            # following a car which is awake: nothing to predict
+            self.recent.pop(car, None)
+            return
+        # with a weighted graph, each update without a car close ahead sets the speed limit to the weighted speed of the
+        # lane: until one has (a car which just left a node has the speed of the edge), its next updates differ
+        limited = not graph.weighted or car.speedLimit == pos.weightedSpeed()
+        if limited and lead is None:
+            threshold = cruiseThreshold(car, velocity)
+            if threshold is not None and pos.toNext > threshold:
+                # number of steps until toNext is no longer above the threshold
+                count = -((threshold - pos.toNext) // velocity)
+                self.recent.pop(car, None)
+                self.sleep(Sleep(car, CRUISE, now, (velocity, pos.dist, pos.toNext)), now + int(count) + 1)
+                return
+            # the path only depends on these: cars entering edges of the same length at the same speed share it
+            key = (velocity, pos.toNext, car.speedLimit, car.accel, car.carSize)
+            path = self.paths.get(key)
+            if path is None:
+                path = self.paths[key] = freePath(car)
+            # a single step is not worth a sleep, and would hide the repeating states of a car stuck at a full node
+            if len(path) > 1:
+                self.recent.pop(car, None)
+                self.sleep(Sleep(car, FREE, now, (velocity, pos.dist, path)), now + len(path) + 1)
+                return
+        elif limited:
+            record = self.sleeping[lead]
+            threshold = cruiseThreshold(car, velocity)
+            if record.kind == CRUISE and record.states[0] == velocity and threshold is not None and pos.toNext > threshold:
+                # a car far enough behind a cruising car at the same speed cruises too (see Car.accelWithFollowing),
+                # since the distance between them stays the same: until its own cruise ends, or the car ahead wakes
+                step = now + 1 if self.order[lead] < self.order[car] else now
+                leadToNext = record.states[2] - velocity * (step - record.base)
+                accel = car.accel
+                decelDist = 2 * car.carSize + accel * sum(range(int(velocity / accel) - 1, int(velocity / accel) + 1))
+                if pos.toNext - leadToNext > decelDist:
+                    count = -((threshold - pos.toNext) // velocity)
+                    self.recent.pop(car, None)
+                    follower = Sleep(car, CRUISE, now, (velocity, pos.dist, pos.toNext))
+                    self.sleep(follower, now + int(count) + 1)
+                    record.dependents.append(follower)
+                    return
+        if not graph.lanes:
+            return
+
+        # what the next update depends on, besides the car's own state: the node ahead being full, or the sleeping car ahead
+        state = (velocity, pos.dist, pos.toNext)
+        if lead is None:
+            node = graph.nodes[pos.nodeTo]
+            source = pos.nodeTo if node["capacity"] <= len(node["population"]) else None
+        else:
+            record = self.sleeping.get(lead)
+            # a car which reaches for the node also depends on the room on it: only cars further back count
+            source = record if record is not None and record.kind in (WAIT, CYCLE) and pos.toNext > velocity else None
+        previous = self.recent.get(car)
+        self.recent[car] = (state, source, previous[0] if previous is not None else None)
+        if source is None or previous is None or previous[1] != source or previous[2] != state:
+            return
+
+        # same input for the last two updates, and the same state as two updates ago: the last two states repeat
+        del self.recent[car]
+        record = Sleep(car, CYCLE, now, (previous[0], state))
+        self.sleep(record)
+        if lead is None:
+            self.blocked.setdefault(source, []).append(record)
+        else:
+            source.dependents.append(record)
+
+    def sleep(self, record, wakeStep = None):
+        car = record.car
+        self.awake.discard(car)
+        self.sleeping[car] = record
+        # the cars standing still behind it: they can keep sleeping if it does not move while asleep
+        watchers = self.watchers.pop(car, None)
+        if watchers is not None:
+            if record.stationary:
+                record.dependents.extend(watchers)
+            else:
+                for watcher in watchers:
+                    if self.sleeping.get(watcher.car) is watcher:
+                        self.wake(watcher)
+        if wakeStep is not None:
+            # the count keeps entries for the same car and step (one of them stale) apart
+            self.eventCount += 1
+            heapq.heappush(self.timed, (wakeStep, self.order[car], self.eventCount, record))
+
+    def wake(self, record):
+        """
+        Wakes a sleeping car, and the cars sleeping behind it. A car which comes after the one being updated (or any car,
+        between steps) is updated in the current step; the others already had their turn, and are updated from the next one.
+        """
+        car = record.car
+        del self.sleeping[car]
+        self.awake.add(car)
+        now = self.graph.stepCount
+        if self.order[car] > self.current:
+            self.materialize(record, now - 1)
+            if self.current >= 0:
+                heapq.heappush(self.queue, (self.order[car], car))
+        else:
+            self.materialize(record, now)
+        if record.stationary:
+            # the cars behind it only need to wake once it moves
+            if record.dependents:
+                self.watchers.setdefault(car, []).extend(record.dependents)
+            return
+        for dependent in record.dependents:
+            if self.sleeping.get(dependent.car) is dependent:
+                self.wake(dependent)
+
+    def wakeWatchers(self, car):
+        """
+        The awake car moved (or left the map): wakes the cars standing still behind it.
+        """
+        for record in self.watchers.pop(car):
+            if self.sleeping.get(record.car) is record:
+                self.wake(record)
+
+    def updateWeights(self):
+        """
+        graph.updateWeights, then wakes the cars sleeping on the lanes whose weighted speed changed: their speed limit
+        (or the one of the car ahead) is no longer the one they fell asleep with.
+        """
+        graph = self.graph
+        edges = graph.edges
+        before = [(key, list(edges[key]["weighted speed"])) for key in graph.dirtyEdges]
+        graph.updateWeights()
+        if not self.sleeping:
+            return
+        for key, speeds in before:
+            edge = edges[key]
+            for direction in (0, 1):
+                if edge["weighted speed"][direction] != speeds[direction]:
+                    for car in edge["population"][direction]:
+                        record = self.sleeping.get(car)
+                        if record is not None and record.kind != WAIT:
+                            self.wake(record)
+
+    def release(self, node):
+        """
+        A car left node: wakes the cars waiting for room on it.
+        """
+        if node is None or node not in self.blocked:
+            return
+        for record in self.blocked.pop(node):
+            if self.sleeping.get(record.car) is record:
+                self.wake(record)
+
+    def syncCar(self, car):
+        """
+        Brings the fields of a sleeping car to the state other cars should see now: after the current step
+        if its turn in it has passed, after the previous step otherwise.
+        """
+        now = self.graph.stepCount
+        self.materialize(self.sleeping[car], now if self.order[car] < self.current else now - 1)
+
+    def sync(self):
+        """
+        Brings every sleeping car up to date with the last step, so that all the cars can be read (or saved).
+        Call it between steps; the cars keep sleeping.
+        """
+        for record in self.sleeping.values():
+            self.materialize(record, self.graph.stepCount)
+
+    def materialize(self, record, step):
+        """
+        Sets the fields of the car of record to its state after step, as if it had been updated every step since it fell asleep.
+        """
+        car = record.car
+        elapsed = step - record.base
+        car.lifetime = record.lifetime + elapsed
+        if record.kind == WAIT:
+            car.currentWait = record.currentWait + elapsed
+            return
+        pos = car.pos
+        if record.kind == CRUISE:
+            velocity, dist, toNext = record.states
+            pos.dist = dist + velocity * elapsed if pos.direction else dist - velocity * elapsed
+            pos.toNext = pos.length - pos.dist if pos.direction else pos.dist
+        elif record.kind == FREE:
+            velocity, dist, path = record.states
+            if elapsed > 0:
+                velocity, covered = path[elapsed - 1]
+                dist = dist + covered if pos.direction else dist - covered
+            pos.dist = dist
+            pos.toNext = pos.length - dist if pos.direction else dist
+        else:
+            velocity, pos.dist, pos.toNext = record.states[1 if elapsed % 2 == 0 else 0]
+        car.velocity = velocity
+        stats = self.graph.edgeStats
+        if stats is not None and step > record.reported and record.kind != CRUISE:
+            self.reportStops(record, step, stats)
+
+    def reportStops(self, record, step, stats):
+        """
+        Reports to the edge statistics the steps after record.reported and up to step at which the sleeping car stopped or
+        started moving.
+        """
+        lane = record.car.pos.laneId
+        if record.kind == FREE:
+            velocity, dist, path = record.states
+            velocities = [velocity] + [state[0] for state in path]
+            for elapsed in range(record.reported - record.base + 1, step - record.base + 1):
+                if (velocities[elapsed - 1] == 0) != (velocities[elapsed] == 0):
+                    stats.stopAt(lane, velocities[elapsed] == 0, record.base + elapsed)
+        elif (record.states[0][0] == 0) != (record.states[1][0] == 0):
+            # alternating: a change at every step, towards states[0] after an odd number of steps
+            for elapsed in range(record.reported - record.base + 1, step - record.base + 1):
+                stats.stopAt(lane, record.states[elapsed % 2 == 0][0] == 0, record.base + elapsed)
+        record.reported = step
+
+    @property
+    def sleepingCount(self):
+        return len(self.sleeping)
@@ -0,0 +1,1012 @@
+# Vectorized stepping engine: an alternative to calling Car.updatePosition() once per car
+
+# Depends on the graph data structure created by graphGen.py, and reproduces the behavior of cars.py
+
+import numpy as np
+import simulator.graphArrays as graphArrays
+import simulator.streams as streams
+
+# Position always gets the default carSize of 5 from Car, so the lane offset and the
+# "skipped an edge" check use this value instead of the car's own carSize
+POS_CAR_SIZE = 5
+# with lanes, when fewer cars than this need computing again, they are done one at a time (see Fleet._stepFar)
+SERIAL_CARS = 32
+
+
+def select(conditions, choices, default):
+    """
+    np.select, with np.where: much cheaper for the small arrays of the later rounds of a step.
+    """
+    result = default
+    for condition, choice in zip(reversed(conditions), reversed(choices)):
+        result = np.where(condition, choice, result)
+    return result
+
+
+class Fleet:
+    """
+    Holds the state of every car in NumPy arrays (struct of arrays) and advances all of them in one call to step().  \n
+    graph argument: a fully built graph (xmlGetStreetProperties or calcEdgeLengths/genEdgeSpeeds already called).
+    Car behavior is determined by graph.lanes and graph.weighted, as with the Car class.  \n
+    carBehavior argument: the same dict accepted by cars.Car; every car in the fleet shares it.  \n
+    carsNum: number of cars created at init, in the same order as [cars.Car(graph, carBehavior) for i in range(carsNum)].  \n\n
+    Gives the same results as stepping a list of Car objects in order (as update_system in main_pygame.py does):
+    the cars on edges are advanced together with array operations, and the cars at nodes one at a time in car order.
+    Each step has a fixed cost of a few hundred microseconds of array operations, so the fleet is slower than Car
+    objects with few cars. Measured on storage_a.xml (500 steps): with weighted, 0.4x with 20 cars, even from about 200
+    to 300, then 1.6x with 500 and 2.4x with 2000. With lanes, a car's step also depends on the cars before it in the
+    order (see _stepLanes), which costs more: 0.15x with 20 cars, 0.75x with 2000, 1.3x with 5000; on a 2500-node grid,
+    even at about 15000 cars.  \n
+    The fleet keeps its own edge and node populations; it does not use the "population" lists of the graph.
+    Iterating over the fleet gives a CarView for each car, which has the attributes used by main_pygame.update_screen.
+    """
+
+    def __init__(self, graph, carBehavior = {}, carsNum = 0):
+
+        self.graph = graph
+        self.lanes = graph.lanes
+        self.weighted = graph.weighted
+
+        self.randomBehavior = carBehavior.get("randomBehavior", True)
+        self.accel = carBehavior.get("accel", 5)
+        self.nodeWait = carBehavior.get("nodeWait", 1)
+        self.carSize = carBehavior.get("carSize", 5)
+        self.mistakes = carBehavior.get("mistakes", False)
+
+        # edge ids and columns come from the graph's array backend; a snapshot is built if the graph uses dicts
+        self.arrays = graph.arrays if graph.arrays is not None else graphArrays.GraphArrays(graph)
+        arrays = self.arrays
+        self.edgeLength = arrays.length.astype(float)
+        self.edgeSpeed = arrays.speed.astype(float)
+        # lane = 2 * edge id + direction, the same indexing as edge["population"][direction]
+        if self.weighted:
+            self.laneSpeed = arrays.weightedSpeed.reshape(-1)
+        laneNum = 2 * arrays.edgeNum
+        self.laneHead = np.full(laneNum, -1, dtype=int)
+        self.laneTail = np.full(laneNum, -1, dtype=int)
+        self.laneCount = np.zeros(laneNum, dtype=int)
+        # edges whose lane counts changed since the last updateWeights
+        self.dirtyEdges = set()
+
+        self.nodeX = arrays.nodeX
+        self.nodeY = arrays.nodeY
+        self.nodeCapacity = np.array([n.get("capacity", 0) for n in graph.nodes], dtype=int)
+        self.nodeCount = np.zeros(graph.size, dtype=int)
+
+        # per-car arrays; a slot is reused once its car reaches its goal
+        self.capacity = 0
+        self._grow(max(carsNum, 16))
+        self.nextSeq = 0
+        self._coords = None
+
+        for i in range(carsNum):
+            self.spawn()
+
+    # -------------------------------------------------------------------------
+    # Storage
+
+    def _grow(self, capacity):
+        """
+        Reallocates all per-car arrays with room for capacity cars, keeping the existing values.
+        """
+        old = self.capacity
+        def extend(name, fill, dtype):
+            arr = np.full(capacity, fill, dtype=dtype)
+            if old:
+                arr[:old] = getattr(self, name)
+            setattr(self, name, arr)
+
+        extend("alive", False, bool)
+        extend("seq", -1, int)
+        extend("edge", -1, int)
+        extend("lane", -1, int)
+        extend("direction", False, bool)
+        extend("nodeFrom", -1, int)
+        extend("nodeTo", -1, int)
+        extend("dist", 0, float)
+        extend("toNext", 0, float)
+        extend("length", 0, float)
+        extend("velocity", 0, float)
+        extend("speedLimit", 0, float)
+        extend("currentWait", 0, int)
+        extend("lifetime", 0, int)
+        extend("carId", -1, int)
+        extend("spawnStep", 0, int)
+        extend("atNode", False, bool)
+        extend("lead", -1, int)
+        extend("follow", -1, int)
+        # route of each planned car (an index in graph.routes, shared with the other cars on the same route) and its next node
+        extend("routeId", -1, int)
+        extend("cursor", 0, int)
+        # per-car Python objects: kept as lists so that histories hold the same values as Car's
+        for name in ("history", "nodeGoal", "views", "random"):
+            values = getattr(self, name, [])
+            setattr(self, name, values + [None] * (capacity - old))
+        self.free = list(range(capacity - 1, old - 1, -1)) + getattr(self, "free", [])
+        self.capacity = capacity
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def slots(self):
+        """
+        Returns an array with the slots of all cars, in the order a list of Car objects would have them.
+        """
+        slots = np.flatnonzero(self.alive)
+        return slots[np.argsort(self.seq[slots], kind="stable")]
+
+    def __iter__(self):
+        for s in self.slots():
+            yield self.views[s]
+
+    # -------------------------------------------------------------------------
+    # Edge populations: a doubly linked list per lane, with the car ahead stored in lead
+
+    def _laneAppend(self, s, lane):
+        tail = self.laneTail[lane]
+        self.lead[s] = tail
+        self.follow[s] = -1
+        if tail >= 0:
+            self.follow[tail] = s
+        else:
+            self.laneHead[lane] = s
+        self.laneTail[lane] = s
+        self.laneCount[lane] += 1
+        self.dirtyEdges.add(lane >> 1)
+
+    def _laneRemove(self, s, lane):
+        ahead, behind = self.lead[s], self.follow[s]
+        if ahead >= 0:
+            self.follow[ahead] = behind
+        else:
+            self.laneHead[lane] = behind
+        if behind >= 0:
+            self.lead[behind] = ahead
+        else:
+            self.laneTail[lane] = ahead
+        self.lead[s] = self.follow[s] = -1
+        self.laneCount[lane] -= 1
+        self.dirtyEdges.add(lane >> 1)
+
+    def _placeOnEdge(self, s, nodeFrom, nodeTo, e = None):
+        """
+        Equivalent of Position.__init__ with dist = 0: puts slot s at nodeFrom, on the edge towards nodeTo
+        (edge id e, if already known).
+        """
+        if e is None:
+            e = self.arrays.edgeId(nodeFrom, nodeTo)
+        direction = nodeTo > nodeFrom
+        length = self.edgeLength[e]
+        self.edge[s] = e
+        self.direction[s] = direction
+        self.lane[s] = 2 * e + direction
+        self.nodeFrom[s] = nodeFrom
+        self.nodeTo[s] = nodeTo
+        self.length[s] = length
+        self.dist[s] = 0 if direction else length
+        self.toNext[s] = length
+        self.atNode[s] = False
+
+    # -------------------------------------------------------------------------
+    # Creating and removing cars
+
+    def spawn(self):
+        """
+        Adds one car to the fleet, making the same random draws and route plan as cars.Car.__init__.
+        Returns the CarView of the new car.
+        """
+        if not self.free:
+            self._grow(2 * self.capacity)
+        s = self.free.pop()
+        graph = self.graph
+        # random numbers: the car's own stream if the graph has streams (see streams.py), otherwise np.random
+        random = self.random[s] = graph.streams.stream(graph.carCount) if graph.streams is not None else streams.GLOBAL
+
+        startNode = random.choice(graph.endNodes)
+        startNodes = (startNode, graph.nodes[startNode]["connect"][0])
+        self._placeOnEdge(s, startNodes[0], startNodes[1])
+
+        if not self.randomBehavior:
+            self.nodeGoal[s] = random.choice(graph.endNodes)
+            self.routeId[s] = graph.internRoute(startNodes[1], self.nodeGoal[s])
+            self.cursor[s] = 1
+
+        self.history[s] = list(startNodes)
+        self.speedLimit[s] = self.edgeSpeed[self.edge[s]]
+        self._laneAppend(s, self.lane[s])
+
+        self.velocity[s] = 0
+        self.currentWait[s] = 0
+        self.lifetime[s] = 0
+        self.carId[s] = graph.carCount
+        graph.carCount += 1
+        self.spawnStep[s] = graph.stepCount
+        self.alive[s] = True
+        self.seq[s] = self.nextSeq
+        self.nextSeq += 1
+        self.views[s] = CarView(self, s)
+        self._coords = None
+        return self.views[s]
+
+    def spawnBatch(self, startNodes, goals = None):
+        """
+        Adds one car for each start node (and goal node, for planned cars), all at once: the same cars as calling
+        spawn() for each of them in order, but with the start nodes and goals given instead of drawn (see demand.py).
+        The cars start on the first connection of their start node, like cars.Car.
+        """
+        count = len(startNodes)
+        if count == 0:
+            return
+        while len(self.free) < count:
+            self._grow(2 * self.capacity)
+        graph = self.graph
+        arrays = self.arrays
+        slots = np.array([self.free.pop() for i in range(count)], dtype=int)
+        startNodes = np.asarray(startNodes, dtype=int)
+
+        # first connection of each start node, and its edge, straight from the CSR adjacency
+        first = arrays.offsets[startNodes]
+        nextNodes = arrays.targets[first].astype(int)
+        edges = arrays.csrEdge[first].astype(int)
+        direction = nextNodes > startNodes
+        length = self.edgeLength[edges]
+        lanes = 2 * edges + direction
+        self.edge[slots] = edges
+        self.direction[slots] = direction
+        self.lane[slots] = lanes
+        self.nodeFrom[slots] = startNodes
+        self.nodeTo[slots] = nextNodes
+        self.length[slots] = length
+        self.dist[slots] = np.where(direction, 0, length)
+        self.toNext[slots] = length
+        self.atNode[slots] = False
+        self.speedLimit[slots] = self.edgeSpeed[edges]
+        self.velocity[slots] = 0
+        self.currentWait[slots] = 0
+        self.lifetime[slots] = 0
+        self.carId[slots] = graph.carCount + np.arange(count)
+        self.spawnStep[slots] = graph.stepCount
+        self.alive[slots] = True
+        self.seq[slots] = self.nextSeq + np.arange(count)
+        self.cursor[slots] = 1
+
+        startList = startNodes.tolist()
+        nextList = nextNodes.tolist()
+        goalList = list(goals) if goals is not None else [None] * count
+        for i, s in enumerate(slots.tolist()):
+            if not self.randomBehavior:
+                self.nodeGoal[s] = goalList[i]
+                self.routeId[s] = graph.internRoute(nextList[i], goalList[i])
+            self.history[s] = [startList[i], nextList[i]]
+            self.random[s] = graph.streams.stream(graph.carCount + i) if graph.streams is not None else streams.GLOBAL
+            self.views[s] = CarView(self, s)
+        graph.carCount += count
+        self.nextSeq += count
+
+        # append to the lanes in car order: new cars on the same lane are chained to each other, the first one to the old tail
+        order = np.lexsort((np.arange(count), lanes))
+        chain = slots[order]
+        chainLanes = lanes[order]
+        firstOfLane = np.r_[True, chainLanes[1:] != chainLanes[:-1]]
+        lastOfLane = np.r_[chainLanes[1:] != chainLanes[:-1], True]
+        self.lead[chain] = np.where(firstOfLane, self.laneTail[chainLanes], np.r_[-1, chain[:-1]])
+        self.follow[chain] = np.where(lastOfLane, -1, np.r_[chain[1:], -1])
+        heads = chain[firstOfLane]
+        headLanes = chainLanes[firstOfLane]
+        oldTails = self.laneTail[headLanes]
+        self.follow[oldTails[oldTails >= 0]] = heads[oldTails >= 0]
+        self.laneHead[headLanes[oldTails < 0]] = heads[oldTails < 0]
+        self.laneTail[chainLanes[lastOfLane]] = chain[lastOfLane]
+        np.add.at(self.laneCount, lanes, 1)
+        self.dirtyEdges.update((lanes >> 1).tolist())
+        self._coords = None
+
+    def fill(self, carsNum):
+        """
+        Spawns cars until the fleet holds carsNum cars, like the loop at the end of main_pygame.update_system.
+        """
+        while len(self) < carsNum:
+            self.spawn()
+
+    def _finish(self, s):
+        """
+        Handles a car reaching its goal node: removes it from the populations and records its trip with graph.recordTrip.
+        """
+        self._leaveGraph(s)
+        self._recordTrip(s)
+
+    def _leaveGraph(self, s):
+        """
+        First half of _finish: takes the car off its node and its lane.
+        """
+        self.nodeCount[self.nodeTo[s]] -= 1
+        self._laneRemove(s, self.lane[s])
+
+    def _recordTrip(self, s):
+        """
+        Second half of _finish: records the trip and frees the slot.
+        """
+        history = self.history[s]
+        lifetime = int(self.lifetime[s])
+        travelDist = sum( [ self.graph.edges[(history[i], history[i+1])]["length"] for i in range(len(history)-1) ] )
+        self.graph.recordTrip(int(self.carId[s]), int(self.spawnStep[s]), lifetime, history, travelDist)
+
+        self.alive[s] = False
+        self.seq[s] = -1
+        self.history[s] = self.nodeGoal[s] = self.views[s] = self.random[s] = None
+        self.routeId[s] = -1
+        self.free.append(s)
+
+    # -------------------------------------------------------------------------
+    # Stepping
+
+    def updateWeights(self):
+        """
+        Same rule as Graph.updateWeights, applied at once to the edges whose lanes gained or lost a car since the
+        last call, using the fleet's populations.
+        Writes the weighted speeds into the graph's GraphArrays (or the fleet's own snapshot of them).
+        """
+        if not self.dirtyEdges:
+            return
+        edges = np.fromiter(self.dirtyEdges, dtype=int, count=len(self.dirtyEdges))
+        self.dirtyEdges = set()
+        self.arrays.updateWeights(self.laneCount.reshape(-1, 2)[edges], edges)
+        self.laneSpeed = self.arrays.weightedSpeed.reshape(-1)
+
+    def step(self):
+        """
+        Moves every car by one time step, as calling updatePosition() on each car in order would.
+        Returns the number of cars which reached their goal and were removed.
+        """
+        if self.weighted:
+            self.updateWeights()
+
+        slots = self.slots()
+        self.lifetime[slots] += 1
+        self._coords = None
+
+        # state at the beginning of the step, read by cars which come earlier in the car order
+        self._preVelocity = self.velocity.copy()
+        self._preToNext = self.toNext.copy()
+        if self.lanes:
+            return self._stepLanes(slots)
+
+        # without lanes, cars on edges do not see each other and nodes have no capacity: every car on an edge
+        # moves at once, then the cars at nodes (the only ones drawing random numbers) go one at a time in car order
+        atNode = slots[self.atNode[slots]]
+        onEdge = slots[~self.atNode[slots]]
+        velocity, speedLimit = self._accelerate(onEdge)
+        self._advance(onEdge, velocity, speedLimit)
+        arrived = onEdge[self.toNext[onEdge] <= 0]
+        self.atNode[arrived] = True
+        np.add.at(self.nodeCount, self.nodeTo[arrived], 1)
+        finished = 0
+        for s in atNode.tolist():
+            if self._nodeBehavior(s):
+                finished += 1
+        return finished
+
+    def _stepLanes(self, slots):
+        """
+        step() with lanes: a car follows the car ahead of it, moves onto its node only if the node has room, and
+        onto the next edge only if the start of that lane is free, so a car's step can depend on cars before it in
+        the car order. The step is resolved in rounds, each of which goes as far as it can without an unresolved car
+        earlier in the order:
+        - the cars on edges which cannot reach their node in this step only need the car ahead of them, if that one
+          comes earlier (a later one is seen as it was at the start of the step, even once it has moved): they are
+          advanced together with array operations (see _stepFar);
+        - the cars which may move onto or off a node (the cars at it, and the cars close enough to reach it) are
+          taken one at a time in car order, since each one sees the room the earlier ones left. One which cannot go
+          yet holds up the later ones of its node, and of the lane it moves onto, until the next round.
+        The earliest unresolved car can always go, so every round advances some cars; a few rounds cover the step.
+        Returns the number of cars which reached their goal and were removed.
+        """
+        seq = self.seq
+        accel = self.accel
+        self._preLead = self.lead.copy()
+        # cars which left their lane (onto the next one, or off the graph) so far in this step
+        self._left = np.zeros(self.capacity, dtype=bool)
+        todo = np.zeros(self.capacity, dtype=bool)
+        todo[slots] = True
+
+        atNode = self.atNode[slots]
+        edgeCars = slots[~atNode]
+        nodeCars = slots[atNode]
+        # cars still waiting at their node only count the step
+        waiting = self.currentWait[nodeCars] < self.nodeWait
+        self.currentWait[nodeCars[waiting]] += 1
+        todo[nodeCars[waiting]] = False
+        # the others pick their next node now, in car order: the choice (and its random draw) depends on the car only
+        leaving = nodeCars[~waiting]
+        self._newNode = np.full(self.capacity, -1, dtype=int)
+        # lane each of them moves onto; -1 for cars at their goal
+        self._target = np.full(self.capacity, -1, dtype=int)
+        for s in leaving.tolist():
+            newNode = self._newNode[s] = self._choose(s)
+            if newNode >= 0:
+                self._target[s] = self._newLane(s, newNode)
+        # cars on an edge close enough to reach their node in this step, whatever the cars around them do
+        near = self.toNext[edgeCars] <= np.maximum(self.velocity[edgeCars] + max(accel, 1), accel)
+        far = edgeCars[~near]
+        nodeEvents = np.concatenate([leaving, edgeCars[near]])
+        nodeEvents = nodeEvents[np.argsort(seq[nodeEvents], kind="stable")].tolist()
+
+        finished = []
+        blocker = np.full(self.capacity, -1, dtype=int)
+        while len(far) or nodeEvents:
+            remaining = len(far) + len(nodeEvents)
+            todo[self._stepFar(far, todo, blocker)] = False
+            far = far[todo[far]]
+
+            # nodes and lanes with an unresolved event earlier in this round
+            heldNodes = set()
+            heldLanes = set()
+            held = []
+            for s in nodeEvents:
+                node = self.nodeTo[s]
+                if node in heldNodes:
+                    held.append(s)
+                    continue
+                if not self.atNode[s]:
+                    # the car ahead, if it comes earlier, must have moved
+                    ahead = self._carAhead(s)
+                    if ahead >= 0 and todo[ahead] and seq[ahead] < seq[s]:
+                        heldNodes.add(node)
+                        held.append(s)
+                        continue
+                    self._stepEdgeCar(s, ahead)
+                    todo[s] = False
+                    continue
+                # a car leaving its lane as the last car on it changes what the later cars moving onto it see, and
+                # a car moving onto a lane needs the earlier cars moving onto it, and the car at its end, to have moved
+                target = self._target[s]
+                lane = self.lane[s]
+                ready = target not in heldLanes and not (self.laneTail[lane] == s and lane in heldLanes)
+                if ready and target >= 0:
+                    tail = self.laneTail[target]
+                    ready = tail < 0 or not todo[tail] or seq[tail] > seq[s]
+                if not ready:
+                    heldNodes.add(node)
+                    if target >= 0:
+                        heldLanes.add(target)
+                    held.append(s)
+                    continue
+                self._leaveNode(s, finished)
+                todo[s] = False
+            nodeEvents = held
+
+            if len(far) + len(nodeEvents) == remaining:
+                # the earliest car always goes, so this is only a guard: finish one at a time rather than loop
+                rest = np.concatenate([far, np.array(nodeEvents, dtype=int)])
+                for s in rest[np.argsort(seq[rest], kind="stable")].tolist():
+                    if not self.atNode[s]:
+                        self._stepEdgeCar(s, self._carAhead(s))
+                    else:
+                        self._leaveNode(s, finished)
+                break
+
+        # trips are recorded in car order, as the cars would have finished them
+        finished.sort(key=lambda s: seq[s])
+        for s in finished:
+            self._recordTrip(s)
+        return len(finished)
+
+    def _stepFar(self, far, todo, blocker):
+        """
+        Advances the cars at far (cars on edges which cannot reach their node in this step) whose step does not depend
+        on an unresolved car which may move onto or off a node (todo marks the unresolved cars), and returns them.
+        blocker holds, for the others, the car they wait for: those are only looked at again once it is resolved.  \n
+        A car following an earlier one needs that car's new state, so the cars of a queue depend on each other from
+        its head to its tail. Each car is first computed as if the earlier car ahead of it kept its velocity; then the
+        cars behind a car which did not are computed again, until nothing changes. In a queue of stopped cars, or of
+        cars keeping their speed, that takes a pass or two however long the queue is.
+        """
+        seq = self.seq
+        inFar = np.zeros(self.capacity, dtype=bool)
+        inFar[far] = True
+        # blocked: behind an unresolved earlier car which may move onto or off a node, possibly through other cars
+        blocked = np.zeros(self.capacity, dtype=bool)
+        waiting = blocker[far] >= 0
+        blocked[far[waiting]] = todo[blocker[far[waiting]]]
+        far = far[~blocked[far]]
+        ahead = self._aheadOf(far)
+        hasAhead = ahead >= 0
+        safeAhead = np.where(hasAhead, ahead, 0)
+        earlier = hasAhead & (seq[safeAhead] < seq[far]) & todo[safeAhead]
+        direct = earlier & ~inFar[safeAhead]
+        blocked[far[direct]] = True
+        blocker[far] = np.where(direct, safeAhead, -1)
+        # the first car of the chain of earlier cars ahead of each car
+        top = np.arange(self.capacity)
+        dependsOn = np.full(self.capacity, -1, dtype=int)
+        chained = earlier & inFar[safeAhead]
+        dependsOn[far[chained]] = safeAhead[chained]
+        pending = far[chained]
+        while len(pending):
+            # pointer jumping: each pass doubles the length of queue covered
+            target = dependsOn[pending]
+            top[pending] = top[target]
+            dependsOn[pending] = dependsOn[target]
+            pending = pending[dependsOn[pending] >= 0]
+        blocked[far] = blocked[top[far]]
+        blocker[far[chained]] = blocker[top[far[chained]]]
+        free = ~blocked[far]
+        cars, ahead, safeAhead = far[free], ahead[free], safeAhead[free]
+        chained = chained[free]
+
+        # a later car is seen as it was at the start of the step, an earlier resolved one as it is now, and an
+        # earlier unresolved one (in cars) as last computed
+        later = seq[safeAhead] > seq[cars]
+        newVelocity = self.velocity.copy()
+        newToNext = self.toNext.copy()
+        # first guess: every car keeps its velocity
+        newToNext[cars] -= self.velocity[cars]
+        newLimit = self.speedLimit.copy()
+        behind = np.full(self.capacity, -1, dtype=int)
+        behind[safeAhead[chained]] = cars[chained]
+        position = np.full(self.capacity, -1, dtype=int)
+        position[cars] = np.arange(len(cars))
+        update = np.arange(len(cars))
+        while len(update) > SERIAL_CARS:
+            idx, lead = cars[update], safeAhead[update]
+            aheadVelocity = np.where(later[update], self._preVelocity[lead], newVelocity[lead])
+            aheadToNext = np.where(later[update], self._preToNext[lead], newToNext[lead])
+            velocity, speedLimit = self._accelerate(idx, ahead[update], aheadVelocity, aheadToNext)
+            toNext = self.toNext[idx] - velocity
+            changed = (velocity != newVelocity[idx]) | (toNext != newToNext[idx])
+            newVelocity[idx] = velocity
+            newToNext[idx] = toNext
+            newLimit[idx] = speedLimit
+            # the cars following one whose result changed
+            following = behind[idx[changed]]
+            update = position[following[following >= 0]]
+        # the few changes left, one car at a time
+        stack = update.tolist()
+        while stack:
+            i = stack.pop()
+            s, lead = cars[i], safeAhead[i]
+            # _freeAccel sets the speed limit in place (with weights): keep the one the car started the step with
+            speedLimit = self.speedLimit[s]
+            if ahead[i] < 0:
+                velocity = self.velocity[s] + self._freeAccel(s)
+            elif later[i]:
+                velocity = self.velocity[s] + self._followAccel(s, self._preVelocity[lead], self._preToNext[lead])
+            else:
+                velocity = self.velocity[s] + self._followAccel(s, newVelocity[lead], newToNext[lead])
+            newLimit[s] = self.speedLimit[s]
+            self.speedLimit[s] = speedLimit
+            velocity = min(max(velocity, 0), newLimit[s])
+            toNext = self.toNext[s] - velocity
+            if velocity != newVelocity[s] or toNext != newToNext[s]:
+                newVelocity[s] = velocity
+                newToNext[s] = toNext
+                if behind[s] >= 0:
+                    stack.append(position[behind[s]])
+        self._advance(cars, newVelocity[cars], newLimit[cars])
+        return cars
+
+    def _leaveNode(self, s, finished):
+        """
+        Moves car s, at a node with its wait over, onto the lane it picked in _stepLanes, or off the graph (adding it
+        to finished) if it is at its goal.
+        """
+        if self._target[s] < 0:
+            self._leaveGraph(s)
+            finished.append(s)
+            self._left[s] = True
+        else:
+            self._left[s] = self._depart(s, self._newNode[s], self._target[s])
+
+    def _aheadOf(self, idx):
+        """
+        The car ahead of each car at idx (-1 for none) as calling updatePosition() in car order would find it: the
+        closest car ahead at the start of the step, leaving out the earlier cars which have left the lane since. A
+        later car is still there for it, even once a round of _stepLanes has moved it off the lane.
+        """
+        ahead = self._preLead[idx]
+        while True:
+            hasAhead = ahead >= 0
+            safeAhead = np.where(hasAhead, ahead, 0)
+            gone = hasAhead & self._left[safeAhead] & (self.seq[safeAhead] < self.seq[idx])
+            if not gone.any():
+                return ahead
+            ahead = np.where(gone, self._preLead[safeAhead], ahead)
+
+    def _advance(self, idx, velocity, speedLimit):
+        """
+        Sets the new velocity and speed limit of the cars at idx, and moves them along their edges (Position.update).
+        """
+        self.velocity[idx] = velocity
+        self.speedLimit[idx] = speedLimit
+        direction = self.direction[idx]
+        dist = self.dist[idx] + np.where(direction, velocity, -velocity)
+        self.dist[idx] = dist
+        self.toNext[idx] = np.where(direction, self.length[idx] - dist, dist)
+
+    def _accelerate(self, idx, ahead = None, aheadVelocity = None, aheadToNext = None):
+        """
+        Computes the new velocity and speed limit of the cars at idx, as Car.updatePosition does before moving.  \n
+        With lanes, the cars ahead of them and the velocity and toNext those have are found as the step goes on,
+        unless given (see _stepFar).
+        """
+        velocity = self.velocity[idx]
+        speedLimit = self.speedLimit[idx].copy()
+        free, freeLimit = self._accelWithoutFollowing(idx, velocity)
+        if self.lanes:
+            if ahead is None:
+                # a car ahead which comes later in the car order is seen as it was at the start of the step, an
+                # earlier one as it is now
+                ahead = self._aheadOf(idx)
+                safeAhead = np.where(ahead >= 0, ahead, 0)
+                later = self.seq[safeAhead] > self.seq[idx]
+                aheadVelocity = np.where(later, self._preVelocity[safeAhead], self.velocity[safeAhead])
+                aheadToNext = np.where(later, self._preToNext[safeAhead], self.toNext[safeAhead])
+            hasAhead = ahead >= 0
+            following, callsFree = self._accelWithFollowing(idx, velocity, aheadVelocity, aheadToNext, free)
+            change = np.where(hasAhead, following, free)
+            usedFree = ~hasAhead | callsFree
+        else:
+            change = free
+            usedFree = np.ones(len(idx), dtype=bool)
+        if self.weighted:
+            # accelWithoutFollowing updates the speed limit whenever it is called
+            speedLimit = np.where(usedFree, freeLimit, speedLimit)
+
+        velocity = velocity + change
+        velocity = np.where(velocity < 0, 0, np.where(velocity > speedLimit, speedLimit, velocity))
+        return velocity, speedLimit
+
+    def _accelWithoutFollowing(self, idx, velocity):
+        """
+        Array version of Car.accelWithoutFollowing. Returns the acceleration and the speed limit it used.
+        """
+        accel = self.accel
+        k = np.floor(velocity / accel)
+        decelDist = accel * (k * (k + 1) // 2)
+        if self.weighted:
+            speedLimit = self.laneSpeed[self.lane[idx]]
+        else:
+            speedLimit = self.speedLimit[idx]
+        toNext = self.toNext[idx]
+
+        speedUnder = speedLimit - velocity
+        conditions = [
+            (toNext > velocity + accel + decelDist) & (velocity < speedLimit),
+            (toNext <= self.carSize) & (velocity < accel),
+            toNext <= decelDist,
+        ]
+        choices = [np.where(speedUnder >= accel, accel, speedUnder), accel - velocity, -accel]
+        return select(conditions, choices, 0), speedLimit
+
+    def _accelWithFollowing(self, idx, velocity, aheadVelocity, aheadToNext, free):
+        """
+        Array version of Car.accelWithFollowing. free holds the result of accelWithoutFollowing for the same cars.
+        Returns the acceleration, and where accelWithoutFollowing was used.
+        """
+        accel = self.accel
+        carSize = self.carSize
+        veloDiff = aheadVelocity - velocity
+        distDiff = self.toNext[idx] - aheadToNext
+        # sum(range(a, b)) in closed form
+        a = np.floor(aheadVelocity / accel) - 1
+        b = np.floor(velocity / accel) + 1
+        n = np.maximum(b - a, 0)
+        decelDist = 2 * carSize + accel * (n * (a + b - 1) // 2)
+
+        conditions = [
+            distDiff == 0,
+            (veloDiff > 0) & (distDiff > carSize),
+            (veloDiff < 0) & (distDiff <= decelDist + velocity),
+            (veloDiff < 0) & (distDiff > decelDist),
+            (veloDiff == 0) & (distDiff <= decelDist),
+            (veloDiff == 0) & (distDiff > decelDist),
+        ]
+        choices = [
+            np.where(velocity > 0, -1, 1),
+            np.where(veloDiff >= accel, accel, veloDiff),
+            np.where(velocity >= accel, -accel, -velocity),
+            free,
+            0,
+            free,
+        ]
+        change = select(conditions, choices, 0)
+        callsFree = select(conditions, [False, False, False, True, False, True], False)
+        return change, callsFree
+
+    # -------------------------------------------------------------------------
+    # One car at a time: same logic as the Car methods, reading the arrays
+
+    def _aheadState(self, s, current):
+        """
+        Velocity and toNext of car s as seen by car current: where it was at the start of the step if it comes later
+        in the car order (even if a round of _stepLanes has already moved it), where it is now otherwise.
+        """
+        if self.seq[s] > self.seq[current]:
+            return self._preVelocity[s], self._preToNext[s]
+        return self.velocity[s], self.toNext[s]
+
+    def _freeAccel(self, s):
+        """
+        Car.accelWithoutFollowing for one car.
+        """
+        velocity = self.velocity[s]
+        accel = self.accel
+        decelDist = accel * sum(range(int(velocity/accel)+1))
+        if self.weighted:
+            self.speedLimit[s] = self.laneSpeed[self.lane[s]]
+        speedLimit = self.speedLimit[s]
+        toNext = self.toNext[s]
+
+        if toNext > velocity + accel + decelDist:
+            if velocity < speedLimit:
+                speedUnder = speedLimit - velocity
+                return accel if speedUnder >= accel else speedUnder
+        if toNext <= self.carSize and velocity < accel:
+            return accel - velocity
+        elif toNext <= decelDist:
+            return -accel
+        return 0
+
+    def _followAccel(self, s, aheadVelocity, aheadToNext):
+        """
+        Car.accelWithFollowing for one car, following a car with the given velocity and toNext.
+        """
+        velocity = self.velocity[s]
+        accel = self.accel
+        veloDiff = aheadVelocity - velocity
+        distDiff = self.toNext[s] - aheadToNext
+        decelDist = 2 * self.carSize + accel * sum(range(int(aheadVelocity/accel)-1, int(velocity/accel)+1))
+
+        if distDiff == 0:
+            return -1 if velocity > 0 else 1
+        elif veloDiff > 0 and distDiff > self.carSize:
+            return accel if veloDiff >= accel else veloDiff
+        elif veloDiff < 0 and distDiff <= decelDist + velocity:
+            return -accel if velocity >= accel else -velocity
+        elif veloDiff < 0 and distDiff > decelDist:
+            return self._freeAccel(s)
+        elif veloDiff == 0 and distDiff <= decelDist:
+            return 0
+        elif veloDiff == 0 and distDiff > decelDist:
+            return self._freeAccel(s)
+        return 0
+
+    def _carAhead(self, s):
+        """
+        _aheadOf for one car.
+        """
+        ahead = self._preLead[s]
+        while ahead >= 0 and self._left[ahead] and self.seq[ahead] < self.seq[s]:
+            ahead = self._preLead[ahead]
+        return ahead
+
+    def _stepEdgeCar(self, s, ahead):
+        """
+        Car.updatePosition and Position.update for one car on an edge (lanes mode), following car ahead (-1 for none).
+        """
+        if ahead >= 0:
+            velocity = self.velocity[s] + self._followAccel(s, *self._aheadState(ahead, s))
+        else:
+            velocity = self.velocity[s] + self._freeAccel(s)
+        if velocity < 0:
+            velocity = 0
+        elif velocity > self.speedLimit[s]:
+            velocity = self.speedLimit[s]
+        self.velocity[s] = velocity
+
+        direction = self.direction[s]
+        nodeTo = self.nodeTo[s]
+        if self.toNext[s] <= velocity:
+            # move to node only if it is not fully populated
+            if self.nodeCapacity[nodeTo] > self.nodeCount[nodeTo]:
+                self.nodeCount[nodeTo] += 1
+                self.atNode[s] = True
+                self.toNext[s] = 0
+                self.dist[s] += velocity if direction else -velocity
+            return
+
+        self.dist[s] += velocity if direction else -velocity
+        self.toNext[s] = self.length[s] - self.dist[s] if direction else self.dist[s]
+
+    def _nodeBehavior(self, s):
+        """
+        Car.nodeBehavior for one car. Returns True if the car reached its goal and was removed.
+        """
+        if self.currentWait[s] < self.nodeWait:
+            self.currentWait[s] += 1
+            return False
+        newNode = self._choose(s)
+        if newNode < 0:
+            self._finish(s)
+            return True
+        self._depart(s, newNode, self._newLane(s, newNode))
+        return False
+
+    def _choose(self, s):
+        """
+        The first part of Car.nodeBehavior, once the wait is over: returns the node the car goes to next, or -1 if it is
+        at its goal. Makes the same random draws as Car.nodeBehavior, and re-plans after a wrong turn.
+        """
+        graph = self.graph
+        nodeTo = int(self.nodeTo[s])
+        if self.randomBehavior:
+            return self.random[s].choice(graph.nodes[nodeTo]["connect"])
+        route = graph.routes[self.routeId[s]]
+        cursor = self.cursor[s]
+        if nodeTo == self.nodeGoal[s] or cursor >= len(route):
+            return -1
+        if not self.mistakes:
+            return route[cursor]
+        # 9/10 chance of correct node, 1/10 chance of picking a wrong node
+        diceRoll = self.random[s].randint(10)
+        if diceRoll < 9:
+            return route[cursor]
+        opts = graph.nodes[nodeTo]["connect"]
+        ind = opts.index(route[cursor])
+        newNode = opts[ind-1]
+        self.routeId[s] = graph.internRoute(newNode, self.nodeGoal[s])
+        self.cursor[s] = 0
+        return newNode
+
+    def _newLane(self, s, newNode):
+        """
+        The lane from the node of car s towards newNode.
+        """
+        nodeTo = int(self.nodeTo[s])
+        newEdge = self.arrays.edgeId(nodeTo, newNode)
+        if newEdge < 0:
+            raise ValueError("A car tried to move to a nonexistent edge.")
+        return 2 * newEdge + (0 if nodeTo > newNode else 1)
+
+    def _depart(self, s, newNode, newLane):
+        """
+        The rest of Car.nodeBehavior: moves car s onto newLane, towards newNode, unless (with lanes) the start of
+        that lane is taken. Returns True if the car moved.
+        """
+        # if using lanes, check if the next position along the desired edge is available
+        if self.lanes:
+            last = self.laneTail[newLane]
+            if last >= 0:
+                lastToNext = self._aheadState(last, s)[1]
+                if lastToNext >= self.length[last] - self.carSize:
+                    return False
+
+        if self.toNext[s] > POS_CAR_SIZE:
+            print("A car skipped an edge, somehow.")
+
+        nodeTo = int(self.nodeTo[s])
+        self._laneRemove(s, self.lane[s])
+        self.nodeCount[nodeTo] -= 1
+        self._placeOnEdge(s, nodeTo, newNode, newLane >> 1)
+
+        self.history[s].append(newNode)
+        if not self.randomBehavior:
+            self.cursor[s] += 1
+        self._laneAppend(s, self.lane[s])
+        self.currentWait[s] = 0
+        self.speedLimit[s] = self.edgeSpeed[self.edge[s]]
+        return True
+
+    # -------------------------------------------------------------------------
+    # Visualization
+
+    def coords(self):
+        """
+        Computes the screen coordinates of every slot at once, as Position.calcCoords does one car at a time.
+        Returns two int arrays (x and y) indexed by slot; cached until the next step or spawn.
+        """
+        if self._coords is not None:
+            return self._coords
+        fromX, fromY = self.nodeX[self.nodeFrom], self.nodeY[self.nodeFrom]
+        toX, toY = self.nodeX[self.nodeTo], self.nodeY[self.nodeTo]
+        length = np.where(self.alive, self.length, 1)
+        prog = np.where(self.direction, self.toNext, self.dist) / length
+        xPos = np.trunc(prog * fromX + (1-prog) * toX)
+        yPos = np.trunc(prog * fromY + (1-prog) * toY)
+        if self.lanes:
+            xPos += np.trunc((POS_CAR_SIZE * 1.5) * (-(toY - fromY)/length))
+            yPos += np.trunc((POS_CAR_SIZE * 1.5) * ((toX - fromX)/length))
+        xPos = np.where(self.atNode, toX, xPos).astype(int)
+        yPos = np.where(self.atNode, toY, yPos).astype(int)
+        self._coords = (xPos, yPos)
+        return self._coords
+
+
+class PositionView:
+    """
+    Read-only stand-in for a cars.Position, backed by the arrays of a Fleet.
+    """
+    def __init__(self, fleet, slot):
+        self.fleet = fleet
+        self.slot = slot
+
+    @property
+    def coords(self):
+        xPos, yPos = self.fleet.coords()
+        return (int(xPos[self.slot]), int(yPos[self.slot]))
+
+    @property
+    def xPos(self):
+        return self.coords[0]
+
+    @property
+    def yPos(self):
+        return self.coords[1]
+
+    @property
+    def nodeFrom(self):
+        return int(self.fleet.nodeFrom[self.slot])
+
+    @property
+    def nodeTo(self):
+        return int(self.fleet.nodeTo[self.slot])
+
+    @property
+    def direction(self):
+        return bool(self.fleet.direction[self.slot])
+
+    @property
+    def dist(self):
+        return self.fleet.dist[self.slot]
+
+    @property
+    def toNext(self):
+        return self.fleet.toNext[self.slot]
+
+    @property
+    def length(self):
+        return self.fleet.length[self.slot]
+
+    @property
+    def atNode(self):
+        return bool(self.fleet.atNode[self.slot])
+
+
+class CarView:
+    """
+    Read-only stand-in for a cars.Car, backed by the arrays of a Fleet.
+    One view exists per car for the car's whole life, so id(view) is stable like id(car).
+    """
+    def __init__(self, fleet, slot):
+        self.fleet = fleet
+        self.slot = slot
+        self.pos = PositionView(fleet, slot)
+        self.carSize = fleet.carSize
+        self.accel = fleet.accel
+
+    @property
+    def velocity(self):
+        return self.fleet.velocity[self.slot]
+
+    @property
+    def speedLimit(self):
+        return self.fleet.speedLimit[self.slot]
+
+    @property
+    def lifetime(self):
+        return int(self.fleet.lifetime[self.slot])
+
+    @property
+    def currentWait(self):
+        return int(self.fleet.currentWait[self.slot])
+
+    @property
+    def carId(self):
+        return int(self.fleet.carId[self.slot])
+
+    @property
+    def spawnStep(self):
+        return int(self.fleet.spawnStep[self.slot])
+
+    @property
+    def plan(self):
+        routeId = self.fleet.routeId[self.slot]
+        return list(self.fleet.graph.routes[routeId][self.fleet.cursor[self.slot]:]) if routeId >= 0 else None
+
+    @property
+    def history(self):
+        return self.fleet.history[self.slot]
+
+    @property
+    def nodeGoal(self):
+        return self.fleet.nodeGoal[self.slot]
@@ -0,0 +1,283 @@
+# Array-backed edge storage for graphGen.Graph: CSR adjacency and NumPy columns, with integer edge ids
+
+import numpy as np
+from simulator.laneQueue import LaneQueue
+
+# edge attributes stored as NumPy columns; any other key is kept in a small dict per edge
+COLUMNS = ("length", "speed", "capacity")
+
+
+class GraphArrays:
+    """
+    Compact storage for the nodes' connections and the edges of a graph.  \n
+    Adjacency is in CSR form: the nodes connected from node n (its "connect" list, in the same order) are
+    targets[offsets[n]:offsets[n+1]], and csrEdge holds the edge id of each of those connections.  \n
+    Each edge has an integer id (edges are numbered in the order they were added to the graph), and its attributes
+    are NumPy columns indexed by edge id: length, speed, capacity and weightedSpeed (one column per direction,
+    indexed like edge["weighted speed"][direction]). edgeNodes holds the two nodes of each edge, in the order they
+    were passed to Graph.connect.  \n
+    Built from a graph which uses dicts; see Graph.useArrays and EdgeMap for the dict-like interface on top of it.
+    """
+
+    def __init__(self, graph):
+        index = {}
+        edgeDicts = []
+        for key, edge in graph.edges.items():
+            if key in index:
+                continue
+            index[key] = index[(key[1], key[0])] = len(edgeDicts)
+            edgeDicts.append((key, edge))
+        edgeNum = len(edgeDicts)
+
+        self.size = graph.size
+        self.edgeNodes = np.array([key for key, edge in edgeDicts], dtype=np.int32).reshape(edgeNum, 2)
+        for name in COLUMNS:
+            setattr(self, name, np.array([edge.get(name, 0) for key, edge in edgeDicts]).reshape(edgeNum))
+        self.weightedSpeed = np.array([edge.get("weighted speed", [edge.get("speed", 0)] * 2) for key, edge in edgeDicts]).reshape(edgeNum, 2)
+        # population lists hold Python objects (cars); empty ones are dropped and created again when first used
+        self.populations = [edge["population"] if edge.get("population") and any(edge["population"]) else None for key, edge in edgeDicts]
+        self.extra = [dict((k, v) for k, v in edge.items() if k not in COLUMNS and k not in ("weighted speed", "population")) or None
+                      for key, edge in edgeDicts]
+
+        degrees = [len(node["connect"]) for node in graph.nodes]
+        self.offsets = np.zeros(self.size + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(degrees)
+        self.targets = np.array([next for node in graph.nodes for next in node["connect"]], dtype=np.int32)
+        self.csrEdge = np.array([index[(n, next)] for n, node in enumerate(graph.nodes) for next in node["connect"]], dtype=np.int32)
+
+        self.nodeX = np.array([node["coords"][0] if node["coords"] else 0 for node in graph.nodes], dtype=float)
+        self.nodeY = np.array([node["coords"][1] if node["coords"] else 0 for node in graph.nodes], dtype=float)
+
+    @property
+    def edgeNum(self):
+        return len(self.edgeNodes)
+
+    def edgeId(self, node1, node2):
+        """
+        Returns the id of the edge between node1 and node2 (in either order, as with the keys of graph.edges), or -1.
+        Searches the CSR rows of both nodes, so one-way edges are found from either end.
+        """
+        for a, b in ((node1, node2), (node2, node1)):
+            start, end = self.offsets[a], self.offsets[a + 1]
+            # rows hold a few nodes: a list search is much cheaper than an array comparison
+            row = self.targets[start:end].tolist()
+            if b in row:
+                return int(self.csrEdge[start + row.index(b)])
+        return -1
+
+    def travelTimes(self):
+        """
+        Travel time of each edge at its speed limit (Graph.heuristicWeight for every edge at once).
+        """
+        return self.length / self.speed.astype(float)
+
+    def population(self, edge):
+        """
+        Returns the population list of an edge (one list of cars per direction), creating it if needed.
+        """
+        if self.populations[edge] is None:
+            self.populations[edge] = [LaneQueue(2 * edge), LaneQueue(2 * edge + 1)]
+        return self.populations[edge]
+
+    def populationCounts(self, edges = None):
+        """
+        Number of cars in each direction of every edge (or of the given edge ids), as an (edgeNum, 2) array.
+        """
+        if edges is None:
+            edges = range(self.edgeNum)
+        counts = np.zeros((len(edges), 2), dtype=int)
+        for i, edge in enumerate(edges):
+            population = self.populations[edge]
+            if population is not None:
+                counts[i] = len(population[0]), len(population[1])
+        return counts
+
+    def updateWeights(self, counts = None, edges = None):
+        """
+        Graph.updateWeights for many edges at once: lowers the weighted speed of every direction of an edge which
+        holds more cars than its capacity, by 5 per extra car, down to a minimum of 5.  \n
+        edges: array of edge ids to update; defaults to all edges.
+        counts: number of cars in each direction of those edges, one row per edge; defaults to populationCounts(edges).
+        """
+        if counts is None:
+            counts = self.populationCounts(edges)
+        if edges is None:
+            edges = slice(None)
+        capacity = self.capacity[edges, None]
+        over = counts > capacity
+        slowed = np.maximum(self.speed[edges, None] - 5 * (counts - capacity), 5)
+        self.weightedSpeed = self.weightedSpeed.astype(np.result_type(self.weightedSpeed, slowed), copy=False)
+        rows = self.weightedSpeed[edges]
+        rows[over] = slowed[over]
+        self.weightedSpeed[edges] = rows
+
+    def setValue(self, name, edge, value):
+        """
+        Writes one value into a column, switching an int column to float if the value is not a whole number.
+        """
+        column = getattr(self, name)
+        if column.dtype.kind in "iub" and value != int(value):
+            column = column.astype(float)
+            setattr(self, name, column)
+        column[edge] = value
+
+
+class WeightedSpeedView:
+    """
+    Stands in for the two-item "weighted speed" list of an edge dict; reads and writes GraphArrays.weightedSpeed.
+    """
+    __slots__ = ("arrays", "edge")
+
+    def __init__(self, arrays, edge):
+        self.arrays = arrays
+        self.edge = edge
+
+    def __getitem__(self, direction):
+        return self.arrays.weightedSpeed[self.edge, int(direction)].item()
+
+    def __setitem__(self, direction, value):
+        self.arrays.setValue("weightedSpeed", (self.edge, int(direction)), value)
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        return iter([self[0], self[1]])
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class EdgeView:
+    """
+    Stands in for the attribute dict of one edge: edge["length"], edge["speed"], edge["capacity"],
+    edge["weighted speed"][direction] and edge["population"][direction] read and write the arrays.
+    Created once per edge by EdgeMap, along with its WeightedSpeedView.
+    """
+    __slots__ = ("arrays", "edge", "weightedSpeed")
+
+    def __init__(self, arrays, edge):
+        self.arrays = arrays
+        self.edge = edge
+        self.weightedSpeed = WeightedSpeedView(arrays, edge)
+
+    def __getitem__(self, key):
+        arrays = self.arrays
+        if key in COLUMNS:
+            return getattr(arrays, key)[self.edge].item()
+        if key == "weighted speed":
+            return self.weightedSpeed
+        if key == "population":
+            return arrays.population(self.edge)
+        extra = arrays.extra[self.edge]
+        if extra is None or key not in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        arrays = self.arrays
+        if key in COLUMNS:
+            arrays.setValue(key, self.edge, value)
+        elif key == "weighted speed":
+            for direction in (0, 1):
+                arrays.setValue("weightedSpeed", (self.edge, direction), value[direction])
+        elif key == "population":
+            arrays.populations[self.edge] = value
+        else:
+            if arrays.extra[self.edge] is None:
+                arrays.extra[self.edge] = {}
+            arrays.extra[self.edge][key] = value
+
+    def keys(self):
+        extra = self.arrays.extra[self.edge]
+        return list(COLUMNS) + ["weighted speed", "population"] + (list(extra) if extra else [])
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __eq__(self, other):
+        return isinstance(other, EdgeView) and other.arrays is self.arrays and other.edge == self.edge
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.arrays), self.edge))
+
+
+class EdgeMap:
+    """
+    Stands in for graph.edges when the graph uses GraphArrays: keyed by (node1, node2) in either order, and
+    returns an EdgeView for the edge. Edges cannot be added; build the graph with dicts, then call Graph.useArrays.  \n
+    The views are created when an edge is first looked up, and kept along with the keys they were looked up by:
+    the cars look up the edges they turn onto all the time, and a search in the CSR rows costs much more than a dict.
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.views = [None] * arrays.edgeNum
+        # key -> EdgeView, for the keys looked up so far
+        self.found = {}
+
+    def view(self, edge):
+        """
+        The EdgeView of edge id edge.
+        """
+        view = self.views[edge]
+        if view is None:
+            view = self.views[edge] = EdgeView(self.arrays, edge)
+        return view
+
+    def __getitem__(self, key):
+        view = self.found.get(key)
+        if view is None:
+            edge = self.arrays.edgeId(key[0], key[1])
+            if edge < 0:
+                raise KeyError(key)
+            view = self.found[key] = self.view(edge)
+        return view
+
+    def __setitem__(self, key, value):
+        raise ValueError("Edges cannot be added to a graph which uses the array backend.")
+
+    def __contains__(self, key):
+        return key in self.found or self.arrays.edgeId(key[0], key[1]) >= 0
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        # both orderings of every edge, as with the dict of dicts
+        for node1, node2 in self.arrays.edgeNodes.tolist():
+            yield (node1, node2)
+            yield (node2, node1)
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        for edge, (node1, node2) in enumerate(self.arrays.edgeNodes.tolist()):
+            view = self.view(edge)
+            yield (node1, node2), view
+            yield (node2, node1), view
+
+    def values(self):
+        for key, view in self.items():
+            yield view
+
+    def __len__(self):
+        return 2 * self.arrays.edgeNum
@@ -0,0 +1,97 @@
+# Compiled graph cache: stores what Graph needs from an XML file as NumPy arrays in a .npz file next to it
+
+import hashlib
+import os
+import numpy as np
+import xmlReader.InOut as IO
+
+# bump when the contents of the table change, so that old cache files are rebuilt
+CACHE_VERSION = 1
+
+
+def fileHash(filename):
+    """
+    SHA-256 of the contents of a file, as a hex string.
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cacheFilename(xml):
+    """
+    Name of the cache file for an XML file: the same name, with .npz added.
+    """
+    return xml + ".npz"
+
+
+def streetTable(nodes, streets):
+    """
+    Converts the node and street lists filled by InOut.read_XML (or read_XML_topology) into a dict of arrays:  \n
+    nodeIds, nodeX, nodeY: one entry per node, in file order.  \n
+    streetIds, streetNode1, streetNode2 (indices into the node arrays), speedLimit, nodeDistance,
+    allowedDirections and streetNames: one entry per street, in file order.
+    """
+    nodeIndex = {}
+    for i, node in enumerate(nodes):
+        nodeIndex.setdefault(node.id, i)
+    ends = [[nodeIndex[n.id] for n in street.nodes] for street in streets]
+    return dict(
+        nodeIds = np.array([node.id for node in nodes], dtype=np.int64),
+        nodeX = np.array([node.x for node in nodes], dtype=np.int64),
+        nodeY = np.array([node.y for node in nodes], dtype=np.int64),
+        streetIds = np.array([street.id for street in streets], dtype=np.int64),
+        streetNode1 = np.array([e[0] for e in ends], dtype=np.int64),
+        streetNode2 = np.array([e[1] for e in ends], dtype=np.int64),
+        speedLimit = np.array([street.speed_limit for street in streets], dtype=np.int64),
+        nodeDistance = np.array([street.node_distance for street in streets], dtype=np.float64),
+        allowedDirections = np.array([street.allowed_directions for street in streets], dtype=np.int8),
+        streetNames = np.array([street.name or "" for street in streets], dtype=np.str_),
+    )
+
+
+def loadTable(xml, cache = True):
+    """
+    Returns the street table (see streetTable) for an XML file.  \n
+    If cache is True, reads it from the cache file when that file was built from identical XML contents
+    (same SHA-256 and cache version); otherwise parses the XML and writes a new cache file.
+    Failing to write the cache file (for instance in a read-only directory) is not an error.
+    """
+    if not cache:
+        return parseTable(xml)
+
+    sourceHash = fileHash(xml)
+    filename = cacheFilename(xml)
+    if os.path.exists(filename):
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                if int(data["version"]) == CACHE_VERSION and str(data["sourceHash"]) == sourceHash:
+                    return dict((key, data[key]) for key in data.files if key not in ("version", "sourceHash"))
+        except (OSError, ValueError, KeyError):
+            # unreadable or incomplete cache file: rebuild it
+            pass
+
+    table = parseTable(xml)
+    try:
+        # write to a temporary name first, so that concurrent processes never read a half-written cache
+        temporary = "{0}.{1}.tmp.npz".format(filename, os.getpid())
+        np.savez(temporary, version = CACHE_VERSION, sourceHash = sourceHash, **table)
+        os.replace(temporary, filename)
+    except OSError:
+        pass
+    return table
+
+
+def parseTable(xml):
+    """
+    Reads an XML file with InOut.read_XML_topology and returns its street table.
+    """
+    nodes = []
+    streets = []
+    IO.read_XML_topology(nodes, streets, xml)
+    return streetTable(nodes, streets)
@@ -1,8 +1,12 @@
 # Built by Isaac Wheeler, interning at CNR-IIA, beginning on 23/5/2019
 
 
+import heapq
 import numpy as np
-import xmlReader.InOut as IO
+import simulator.graphArrays as graphArrays
+import simulator.graphCache as graphCache
+import simulator.contraction as contraction
+from simulator.laneQueue import LaneQueue
 
 class Graph:
     """
@@ -13,51 +17,65 @@ class Graph:
     xml: defaults to False. If is a string, graph imports from that filename.
     weighted: defaults to False. If True, interacts with Position class in cars.py to keep track of number of cars
     lanes: defaults to False. If True, interacts with Position class to keep track of cars
+    arrays: defaults to False. If True, stores the edges in NumPy arrays once they are built (see useArrays)
+    cache: defaults to True. If True, the contents of the xml file are read from (or saved to) a compiled cache file
+    next to it (see graphCache.py), which is used only if the xml file has not changed.
+    table: defaults to None. A street table (see graphCache.streetTable) to import instead of an xml file,
+    such as the synthetic networks of networks.py
     """
 
 
-    def __init__(self, nodeNum = 0, xml = False, weighted = False, lanes = False):
+    def __init__(self, nodeNum = 0, xml = False, weighted = False, lanes = False, arrays = False, cache = True, table = None):
         
+        # a street table (see graphCache.streetTable, or the generators in networks.py) stands in for an XML file
+        if table is not None:
+            self.xmlTable = table
+            nodeNum = len(table["nodeIds"])
         # if xml filename supplied, get information and set nodeNum
-        if type(xml) == str:
-            self.xmlNodeList = []
-            self.xmlEdgeList = []
-            IO.read_XML(self.xmlNodeList, self.xmlEdgeList, xml)
+        elif type(xml) == str:
+            # arrays with the nodes and streets of the file (see graphCache.streetTable)
+            self.xmlTable = graphCache.loadTable(xml, cache)
 
-            nodeNum = len(self.xmlNodeList)
-            #do something else to import information from xml
+            nodeNum = len(self.xmlTable["nodeIds"])
+        # the xml file, next to which buildHierarchy saves the contraction hierarchy
+        self.xmlFile = xml if type(xml) == str else None
 
         self.size = nodeNum
+        # interned routes, shared by all the cars which follow them (see internRoute); kept when the routes are invalidated,
+        # since cars may still be following the old ones
+        self.routes = []
         # create a list, with an empty dict for each node
-        self.nodes = [{"coords":(), "connect":[], "population":[]} for i in range(self.size)]
+        self.nodes = [{"coords":(), "connect":[], "population":LaneQueue()} for i in range(self.size)]
         # for the edges, create a dict of dicts
         self.edges = {}
         
         self.weighted = weighted
         self.lanes = lanes
-        self.xml = (type(xml) == str)
-
-        # if xml filename supplied, initialize the nodes and edges
-        if type(xml) == str:
-            self.nodeIDlist = []
-            self.edgeIDlist = []
-            for i, node in enumerate(self.xmlNodeList):
-                self.nodes[i]["coords"] = (node.x, node.y)
-                self.nodes[i]["id"] = node.id
-                self.nodeIDlist.append(node.id)
-            for edge in self.xmlEdgeList:
-                self.edgeIDlist.append(edge.id)
-                node1id, node2id = [i.id for i in edge.nodes]
-                node1 = self.nodeIDlist.index(node1id)
-                node2 = self.nodeIDlist.index(node2id)
-
+        self.xml = (type(xml) == str) or table is not None
+        # array backend for the edges: None while the edges are stored as dicts
+        self.arrays = None
+        # contraction hierarchy: None until buildHierarchy is called
+        self.hierarchy = None
+
+        # if xml filename (or table) supplied, initialize the nodes and edges
+        if self.xml:
+            table = self.xmlTable
+            self.nodeIDlist = table["nodeIds"].tolist()
+            self.edgeIDlist = table["streetIds"].tolist()
+            # XML node id -> index in self.nodes
+            self.nodeIndex = {}
+            for i, (nodeId, x, y) in enumerate(zip(self.nodeIDlist, table["nodeX"].tolist(), table["nodeY"].tolist())):
+                self.nodes[i]["coords"] = (x, y)
+                self.nodes[i]["id"] = nodeId
+                self.nodeIndex.setdefault(nodeId, i)
+            for node1, node2, direction in zip(table["streetNode1"].tolist(), table["streetNode2"].tolist(), table["allowedDirections"].tolist()):
                 # normal streets have 0, goes both ways
-                if edge.allowed_directions == 0:
+                if direction == 0:
                     self.connect(node1, node2)
                 # if direction is 1 or 2, is a one-way street; 1 or 2 indicate direction
-                elif edge.allowed_directions == 1:
+                elif direction == 1:
                     self.connect(node1, node2, oneWay = True)
-                elif edge.allowed_directions == 2:
+                elif direction == 2:
                     self.connect(node2, node1, oneWay = True)
         
         # make a list of nodes which have only one connection
@@ -67,8 +85,28 @@ class Graph:
                 self.endNodes.append(i)
 
 
+        # switch to the array backend only once the structure is known: edges cannot be added afterwards
+        if arrays:
+            self.useArrays()
+
         # create a list accessible to everything with the graph, which can track data
         self.history = []
+        # if set to a tripLog.TripLog, finished trips are written to it instead of to self.history (see recordTrip)
+        self.tripLog = None
+        # if set to an edgeStats.EdgeStats, cars report to it when they enter and leave edges, and stop or start moving
+        self.edgeStats = None
+        # number of finished trips, cars created so far (used as car ids) and time steps run (counted by run.stepCars)
+        self.trips = 0
+        self.carCount = 0
+        self.stepCount = 0
+        # if set to a streams.RandomStreams, each car draws its random numbers from its own stream instead of np.random
+        self.streams = None
+
+        # edges whose population changed since the last updateWeights (see markDirty)
+        self.dirtyEdges = set()
+
+        # fastest routes towards each end node, built on demand by endRoute()
+        self.invalidateRoutes()
 
 
 
@@ -81,6 +119,8 @@ class Graph:
         """
         if point1 == point2:
             raise ValueError("Cannot connect a node to itself.")
+        if self.arrays is not None:
+            raise ValueError("Edges cannot be added to a graph which uses the array backend.")
 
         # tuples for dictionary keys; both are used, so that index ordering doesn't matter
         nodeNumsUp = (point1, point2)
@@ -96,6 +136,9 @@ class Graph:
         if not oneWay:
             self.nodes[point2]["connect"].append(point1)
 
+        # edges are numbered in the order they are added (both orderings of the nodes are keys of each one)
+        edgeId = len(self.edges) // 2
+
         # if input is good, this is desired result:
         # references both orderings of points to same dictionary for the edge
         self.edges[nodeNumsUp] = {"length":0}
@@ -104,30 +147,165 @@ class Graph:
         # Set an attribute of dictionary for tracking cars on street
         # list has two items: one for each direction on the edge
         
-        self.edges[nodeNumsUp]["population"] = [[], []]
+        self.edges[nodeNumsUp]["population"] = [LaneQueue(2 * edgeId), LaneQueue(2 * edgeId + 1)]
+
+        # routes computed before this edge existed may no longer be the fastest
+        self.invalidateRoutes()
 
         
         # edge structure: dict of dicts, first is keyed by connected nodes and second is keyed by attributes of edge
         # ordering of node indices in outer dict keys doesn't matter
     
+    def useArrays(self):
+        """
+        Moves the edges into a graphArrays.GraphArrays (stored as self.arrays): CSR adjacency, integer edge ids,
+        and NumPy columns for length, speed, capacity and weighted speed.
+        self.edges becomes a graphArrays.EdgeMap, which keeps the same dict-like interface
+        (graph.edges[(node1, node2)]["length"] and so on), so the rest of the code keeps working.
+        Edges cannot be added with connect afterwards.
+        """
+        if self.arrays is None:
+            self.arrays = graphArrays.GraphArrays(self)
+            self.edges = graphArrays.EdgeMap(self.arrays)
+            # the travel times are the same: keep the hierarchy
+            hierarchy = self.hierarchy
+            self.invalidateRoutes()
+            self.hierarchy = hierarchy
+
     def heuristicWeight(self, edgeNode1, edgeNode2):
         #TODO: take traffic into account, not just speed limit
         edge = self.edges[(edgeNode1, edgeNode2)]
         return edge["length"] / edge["speed"]
 
+    def invalidateRoutes(self):
+        """
+        Discards the route table used by endRoute and the planner used by cars.routePlan. Call it after changing edge lengths or speeds;
+        the methods of this class which change them already do.
+        """
+        self.routeTable = {}
+        # (startNode, endNode) -> index in self.routes of the route between them
+        self.routeIds = {}
+        # A* planner used by cars.routePlan, which caches travel times too
+        self.routePlanner = None
+        # contraction hierarchy (see buildHierarchy), which answers cars.routePlan and internRoute when present
+        self.hierarchy = None
+
+    def buildHierarchy(self, filename = None):
+        """
+        Preprocesses the graph into a contraction hierarchy (see contraction.py), stored as self.hierarchy: from then on
+        cars.routePlan and internRoute take their routes from it, without A* searches or route tables.  \n
+        filename: .npz file the hierarchy is read from, if it was built for the same edges and travel times, or saved to otherwise.
+        Defaults to the xml file's name with .ch.npz added; graphs without an xml file are not saved unless a filename is given.  \n
+        Discarded by invalidateRoutes, like the other routes: call it again after changing lengths or speeds.
+        """
+        if filename is None and self.xmlFile is not None:
+            filename = self.xmlFile + ".ch.npz"
+        self.hierarchy = contraction.loadOrBuild(self, filename)
+        return self.hierarchy
+
+    def buildRouteTable(self, goals = None):
+        """
+        Computes, for every goal node (defaults to all of endNodes), the next node on the fastest route
+        from every other node towards that goal, using heuristicWeight as the cost of each edge.
+        One Dijkstra search per goal, on the graph with its edges reversed, so one-way streets are respected.
+        """
+        if goals is None:
+            goals = self.endNodes
+        # edges into each node: the reverse of the "connect" lists
+        incoming = [[] for i in range(self.size)]
+        for node in range(self.size):
+            for next in self.nodes[node]["connect"]:
+                incoming[next].append(node)
+
+        for goal in goals:
+            nextHop = np.full(self.size, -1, dtype=int)
+            cost = [np.inf] * self.size
+            cost[goal] = 0
+            done = [False] * self.size
+            queue = [(0, goal)]
+            while queue:
+                c, node = heapq.heappop(queue)
+                if done[node]:
+                    continue
+                done[node] = True
+                for prev in incoming[node]:
+                    newCost = c + self.heuristicWeight(prev, node)
+                    if newCost < cost[prev]:
+                        cost[prev] = newCost
+                        nextHop[prev] = node
+                        heapq.heappush(queue, (newCost, prev))
+            self.routeTable[goal] = nextHop
+
+    def endRoute(self, startNode, endNode):
+        """
+        Returns the fastest route from startNode to endNode as a new list, in the same format as cars.routePlan:
+        starts with startNode and ends with endNode; empty (with a printed message) if there is no route.  \n
+        endNode is normally one of endNodes. Routes come from the table built by buildRouteTable,
+        which is built once per goal and reused until invalidateRoutes is called, so each lookup costs no search.
+        """
+        return list(self.routes[self.internRoute(startNode, endNode)])
+
+    def internRoute(self, startNode, endNode):
+        """
+        Same route as endRoute, but returns the index of a tuple in self.routes instead of a new list:
+        every car going from startNode to endNode shares that one tuple, and follows it with a cursor (see cars.Car).
+        """
+        key = (startNode, endNode)
+        routeId = self.routeIds.get(key)
+        if routeId is not None:
+            return routeId
+        if startNode == endNode:
+            route = (int(startNode),)
+        elif self.hierarchy is not None and endNode not in self.routeTable:
+            route = tuple(self.hierarchy.route(startNode, endNode))
+        else:
+            if endNode not in self.routeTable:
+                self.buildRouteTable([endNode])
+            nextHop = self.routeTable[endNode]
+            if nextHop[startNode] < 0:
+                print("Route planning system found no possible route for a car.")
+                print("Attempted route from node", startNode, "to node", endNode)
+                route = ()
+            else:
+                route = [int(startNode)]
+                node = startNode
+                while node != endNode:
+                    node = int(nextHop[node])
+                    route.append(node)
+                route = tuple(route)
+        routeId = self.routeIds[key] = len(self.routes)
+        self.routes.append(route)
+        return routeId
+
+    def addRoute(self, route):
+        """
+        Interns a route which was not computed by internRoute on this graph (sent by another process, or read from
+        a checkpoint), and returns its index in self.routes. A route equal to the one already interned between the
+        same nodes shares it. All empty routes (cars which found none) share one entry, under the key ().
+        """
+        route = tuple(int(n) for n in route)
+        key = (route[0], route[-1]) if route else ()
+        routeId = self.routeIds.get(key)
+        if routeId is not None and self.routes[routeId] == route:
+            return routeId
+        if routeId is None:
+            self.routeIds[key] = len(self.routes)
+        self.routes.append(route)
+        return len(self.routes) - 1
+
 
     def xmlGetStreetProperties(self):
         """
-        Uses the xml filename stored at initialization. 
-        Accesses that file to get edge properties.
-        Uses the format and naming created by InOut.py.
+        Uses the street data read from the xml file at initialization
+        (in the format and naming created by InOut.py) to set edge properties.
         """
-        for edge in self.xmlEdgeList:
-            node1id, node2id = [i.id for i in edge.nodes]
-            nodeKey = (self.nodeIDlist.index(node1id), self.nodeIDlist.index(node2id))
+        table = self.xmlTable
+        for node1, node2, speed, distance in zip(table["streetNode1"].tolist(), table["streetNode2"].tolist(),
+                                                 table["speedLimit"].tolist(), table["nodeDistance"].tolist()):
+            nodeKey = (node1, node2)
 
-            self.edges[nodeKey]["speed"] = edge.speed_limit
-            self.edges[nodeKey]["length"] = int(edge.node_distance)
+            self.edges[nodeKey]["speed"] = speed
+            self.edges[nodeKey]["length"] = int(distance)
 
             # TUNING
             if self.weighted:
@@ -145,6 +323,9 @@ class Graph:
                 self.nodes[i]["capacity"] = 1
             # /TUNING
 
+        # lengths and speeds have changed
+        self.invalidateRoutes()
+
         
 
 
@@ -159,8 +340,7 @@ class Graph:
 
         # at the moment, just assigns positions randomly
         if self.size / 8.0 != 1:
-            pass
-            # do something different
+            raise ValueError("makeCoords8nodes only works with 8 nodes; see simulator/networks.py for larger graphs.")
         else:
             # randomly generate coordinates for the points
             xList = list(np.random.randint(0, xdim/2, 4)) + list(np.random.randint(xdim/2, xdim, 4))
@@ -209,6 +389,7 @@ class Graph:
             x1, y1 = self.nodes[p1]["coords"]
             x2, y2 = self.nodes[p2]["coords"]
             self.edges[i]["length"] = int(np.sqrt( (x1-x2)*(x1-x2) + (y1-y2)*(y1-y2) ))
+        self.invalidateRoutes()
 
     def genEdgeSpeeds(self):
         """
@@ -228,16 +409,54 @@ class Graph:
             if self.lanes:
                 self.nodes[i]["capacity"] = np.random.randint(1, 7)
 
+        self.invalidateRoutes()
+
 
-    def updateWeights(self):
+    def recordTrip(self, carId, spawnStep, lifetime, route, distance):
+        """
+        Called by cars when they reach their goal. Writes the trip to self.tripLog if there is one;
+        otherwise, appends a line describing it to self.history.
+        """
+        self.trips += 1
+        if self.tripLog is not None:
+            self.tripLog.write(carId, spawnStep, spawnStep + lifetime, route, distance)
+        else:
+            outputStr = "Lifetime (time steps): {0} \t Distance traveled: {1} \t Average speed: {2:.2f} \t Overall route: {3}".format(lifetime, distance, distance/float(lifetime), route)
+            self.history.append(outputStr)
+
+    def markDirty(self, node1, node2):
+        """
+        Records that a population list of the edge between node1 and node2 has changed, so that the next call
+        to updateWeights recomputes its weighted speed. Called by Car whenever it joins or leaves an edge.
+        """
+        if self.weighted:
+            self.dirtyEdges.add((node1, node2) if node1 < node2 else (node2, node1))
+
+    def updateWeights(self, allEdges = False):
+        """
+        Lowers the weighted speed of each direction of an edge which holds more cars than its capacity.  \n
+        Only the edges marked with markDirty since the last call are recomputed (the others would get the same value
+        again); pass allEdges = True after changing populations, speeds or capacities by hand.
+        """
         if not self.weighted:
             raise ValueError("Only call updateWeights if using weighted behavior.")
-        for i in self.edges.keys():
+        if self.arrays is not None:
+            if allEdges:
+                self.arrays.updateWeights()
+            elif self.dirtyEdges:
+                # through the views cached by EdgeMap, rather than searching the CSR rows for every edge
+                self.arrays.updateWeights(edges = np.array([self.edges[key].edge for key in self.dirtyEdges]))
+            self.dirtyEdges = set()
+            return
+        # only edges whose population changed since the last call can change weight
+        keys = self.edges.keys() if allEdges else self.dirtyEdges
+        for i in keys:
             for d in (0, 1):
                 if len(self.edges[i]["population"][d]) > self.edges[i]["capacity"]:
                     self.edges[i]["weighted speed"][d] = self.edges[i]["speed"] - 5 * (len(self.edges[i]["population"][d]) - self.edges[i]["capacity"])
                     if self.edges[i]["weighted speed"][d] < 5:
                         self.edges[i]["weighted speed"][d] = 5
+        self.dirtyEdges = set()
 
         
 
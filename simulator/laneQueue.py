@@ -0,0 +1,77 @@
+# Ordered queue of the cars on one lane (one direction of an edge), or of the positions on one node
+
+class LaneQueue:
+    """
+    Stands in for the population lists of the graph: holds objects in the order they were appended, so that
+    the first one is the car furthest along the edge and the last one is the car which entered it last.  \n
+    A doubly linked list through the objects themselves: each object stores the one ahead of it in its "lead"
+    attribute and the one behind it in "follow", and the queue it is in in "queue". Appending, removing and finding
+    the car ahead are O(1); an object can be in only one queue at a time, and removing it from another queue raises
+    ValueError (as list.remove did).  \n
+    Also supports len(), truth value, iteration, queue[0], queue[-1] and index(), as the lists did.  \n
+    laneId: for the lanes of edges, 2 * edge + direction, edges numbered in the order they were added to the graph
+    (as the edge ids of graphArrays.GraphArrays); None for the queues of nodes.
+    """
+    __slots__ = ("head", "tail", "count", "laneId")
+
+    def __init__(self, laneId = None):
+        self.laneId = laneId
+        self.head = None
+        self.tail = None
+        self.count = 0
+
+    def append(self, item):
+        item.queue = self
+        item.lead = self.tail
+        item.follow = None
+        if self.tail is not None:
+            self.tail.follow = item
+        else:
+            self.head = item
+        self.tail = item
+        self.count += 1
+
+    def remove(self, item):
+        # an item of another queue would unlink its neighbours there and change the ends and count of this one
+        if getattr(item, "queue", None) is not self:
+            raise ValueError("Item is not in the queue.")
+        ahead, behind = item.lead, item.follow
+        if ahead is not None:
+            ahead.follow = behind
+        else:
+            self.head = behind
+        if behind is not None:
+            behind.lead = ahead
+        else:
+            self.tail = ahead
+        item.lead = item.follow = item.queue = None
+        self.count -= 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        item = self.head
+        while item is not None:
+            yield item
+            item = item.follow
+
+    def __getitem__(self, index):
+        # the ends are O(1); anything else walks the queue
+        if index == 0 and self.head is not None:
+            return self.head
+        if index == -1 and self.tail is not None:
+            return self.tail
+        return list(self)[index]
+
+    def __contains__(self, item):
+        return getattr(item, "queue", None) is self
+
+    def index(self, item):
+        for i, other in enumerate(self):
+            if other is item:
+                return i
+        raise ValueError("Item is not in the queue.")
+
+    def __repr__(self):
+        return "LaneQueue({0})".format(list(self))
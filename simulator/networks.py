@@ -0,0 +1,287 @@
+# Synthetic road networks for benchmarks: grids, radial cities and random planar maps, from 10^2 to 10^6 nodes
+
+# Every generator returns a street table, in the same format as graphCache.streetTable, which can be turned
+# into a Graph with makeGraph or written to an XML file (readable by Graph(xml = ...)) with writeXML.
+
+# Usage: python -m simulator.networks --kind planar --nodes 100000 --one-way 0.2 --output planar.xml
+
+import argparse
+import numpy as np
+import simulator.graphGen as graphGen
+import xmlReader.InOut as IO
+
+
+def grid(rows, cols = None, spacing = 50, jitter = 0, oneWayRatio = 0.0, speeds = (30, 50, 70), speedWeights = None, deadEnds = None, seed = 0):
+    """
+    Square lattice of rows x cols intersections (cols defaults to rows), spacing pixels apart.  \n
+    jitter: maximum random displacement of each intersection, as a fraction of spacing.  \n
+    See finish() for oneWayRatio, speeds, speedWeights and deadEnds.
+    """
+    cols = rows if cols is None else cols
+    rng = np.random.RandomState(seed)
+    r, c = np.divmod(np.arange(rows * cols), cols)
+    x = (c + 0.5) * spacing + rng.uniform(-jitter, jitter, rows * cols) * spacing
+    y = (r + 0.5) * spacing + rng.uniform(-jitter, jitter, rows * cols) * spacing
+
+    index = np.arange(rows * cols).reshape(rows, cols)
+    across = np.stack([index[:, :-1].ravel(), index[:, 1:].ravel()], axis=1)
+    down = np.stack([index[:-1, :].ravel(), index[1:, :].ravel()], axis=1)
+    names = ["row {0}".format(i) for i in np.repeat(np.arange(rows), cols - 1)] + \
+            ["column {0}".format(j) for j in np.tile(np.arange(cols), rows - 1)]
+    return finish(rng, x, y, np.concatenate([across, down]), names, spacing, oneWayRatio, speeds, speedWeights, deadEnds)
+
+
+def radial(rings, spokes = 16, spacing = 50, oneWayRatio = 0.0, speeds = (30, 50, 70), speedWeights = None, deadEnds = None, seed = 0):
+    """
+    Radial city: a center, and rings concentric rings of spokes intersections each, spacing pixels apart.
+    Intersections on a ring are joined along the ring, and to the next ring out along the spokes.  \n
+    See finish() for oneWayRatio, speeds, speedWeights and deadEnds.
+    """
+    rng = np.random.RandomState(seed)
+    ring, spoke = np.divmod(np.arange(rings * spokes), spokes)
+    angle = 2 * np.pi * spoke / spokes
+    radius = (ring + 1) * spacing
+    extent = (rings + 1) * spacing
+    x = np.concatenate([[extent], extent + radius * np.cos(angle)])
+    y = np.concatenate([[extent], extent + radius * np.sin(angle)])
+
+    # node 0 is the center; ring r, spoke k is node 1 + r * spokes + k
+    node = 1 + np.arange(rings * spokes).reshape(rings, spokes)
+    around = np.stack([node.ravel(), np.roll(node, -1, axis=1).ravel()], axis=1)
+    out = np.stack([node[:-1, :].ravel(), node[1:, :].ravel()], axis=1)
+    center = np.stack([np.zeros(spokes, dtype=int), node[0]], axis=1)
+    names = ["ring {0}".format(i) for i in np.repeat(np.arange(rings), spokes)] + \
+            ["spoke {0}".format(k) for k in np.tile(np.arange(spokes), rings - 1)] + \
+            ["spoke {0}".format(k) for k in range(spokes)]
+    return finish(rng, x, y, np.concatenate([around, out, center]), names, spacing, oneWayRatio, speeds, speedWeights, deadEnds)
+
+
+def randomPlanar(nodeNum, spacing = 50, keepRatio = 0.75, oneWayRatio = 0.0, speeds = (30, 50, 70), speedWeights = None, deadEnds = None, seed = 0):
+    """
+    Random planar map with about nodeNum intersections: one random point in each cell of a square grid,
+    joined to the points of the neighboring cells and across one random diagonal of each cell (so no two
+    streets cross). Then only keepRatio of the streets are kept, always keeping enough of them for every
+    intersection to stay reachable.  \n
+    See finish() for oneWayRatio, speeds, speedWeights and deadEnds.
+    """
+    rng = np.random.RandomState(seed)
+    side = max(2, int(round(np.sqrt(nodeNum))))
+    r, c = np.divmod(np.arange(side * side), side)
+    x = (c + rng.uniform(0.1, 0.9, side * side)) * spacing
+    y = (r + rng.uniform(0.1, 0.9, side * side)) * spacing
+
+    index = np.arange(side * side).reshape(side, side)
+    across = np.stack([index[:, :-1].ravel(), index[:, 1:].ravel()], axis=1)
+    down = np.stack([index[:-1, :].ravel(), index[1:, :].ravel()], axis=1)
+    flip = rng.randint(0, 2, (side - 1) * (side - 1)).astype(bool)
+    diagonal = np.where(flip[:, None],
+                        np.stack([index[:-1, :-1].ravel(), index[1:, 1:].ravel()], axis=1),
+                        np.stack([index[:-1, 1:].ravel(), index[1:, :-1].ravel()], axis=1))
+    edges = np.concatenate([across, down, diagonal])
+
+    # keep a random spanning tree, then fill up to keepRatio with the other streets
+    order = rng.permutation(len(edges))
+    tree = spanningTree(side * side, edges[order])
+    keep = np.zeros(len(edges), dtype=bool)
+    keep[order[tree]] = True
+    extra = order[~tree][:max(0, int(keepRatio * len(edges)) - int(tree.sum()))]
+    keep[extra] = True
+    edges = edges[keep]
+    names = ["street {0}".format(i) for i in range(len(edges))]
+    return finish(rng, x, y, edges, names, spacing, oneWayRatio, speeds, speedWeights, deadEnds)
+
+
+def generate(kind, nodeNum, **options):
+    """
+    Builds a network of the given kind ("grid", "radial" or "planar") with about nodeNum intersections.
+    options are passed on to the generator.
+    """
+    if kind == "grid":
+        side = max(2, int(round(np.sqrt(nodeNum))))
+        return grid(side, **options)
+    elif kind == "radial":
+        spokes = options.pop("spokes", max(8, int(round(np.sqrt(nodeNum)))))
+        return radial(max(2, int(round(nodeNum / float(spokes)))), spokes, **options)
+    elif kind == "planar":
+        return randomPlanar(nodeNum, **options)
+    raise ValueError("Unknown network kind: " + str(kind))
+
+
+# -------------------------------------------------------------------------
+# Shared steps
+
+def finish(rng, x, y, edges, names, spacing, oneWayRatio, speeds, speedWeights, deadEnds):
+    """
+    Turns node coordinates and a list of streets into a street table.  \n
+    deadEnds: number of dead-end streets added to random intersections (their far ends are the graph's endNodes,
+    where planned cars start and finish); defaults to 1% of the intersections, at least 4.  \n
+    oneWayRatio: fraction of streets which are one-way, in a random direction. One-way streets which would leave
+    some intersection unreachable from another are made two-way again, so every route exists.  \n
+    speeds, speedWeights: speed limits are drawn from speeds, with probabilities speedWeights (uniform if None).
+    """
+    nodeNum = len(x)
+    if deadEnds is None:
+        deadEnds = max(4, nodeNum // 100)
+    if deadEnds:
+        anchors = rng.choice(nodeNum, deadEnds, replace = deadEnds > nodeNum)
+        angle = rng.uniform(0, 2 * np.pi, deadEnds)
+        x = np.concatenate([x, x[anchors] + 0.4 * spacing * np.cos(angle)])
+        y = np.concatenate([y, y[anchors] + 0.4 * spacing * np.sin(angle)])
+        edges = np.concatenate([edges, np.stack([anchors, nodeNum + np.arange(deadEnds)], axis=1)])
+        names = list(names) + ["dead end {0}".format(i) for i in range(deadEnds)]
+    x = np.round(x).astype(np.int64)
+    y = np.round(y).astype(np.int64)
+    edges = np.asarray(edges, dtype=np.int64)
+
+    # 0: two-way; 1: from node 1 to node 2; 2: from node 2 to node 1 (as in CreateGraph.Street)
+    directions = np.zeros(len(edges), dtype=np.int8)
+    if oneWayRatio > 0:
+        oneWay = rng.uniform(size=len(edges)) < oneWayRatio
+        # dead-end streets stay two-way
+        oneWay[len(edges) - deadEnds:] = False
+        directions[oneWay] = rng.randint(1, 3, oneWay.sum())
+        component = strongComponents(len(x), edges, directions)
+        directions[component[edges[:, 0]] != component[edges[:, 1]]] = 0
+
+    speedLimit = rng.choice(np.asarray(speeds, dtype=np.int64), size=len(edges), p=speedWeights)
+    distance = np.sqrt((x[edges[:, 0]] - x[edges[:, 1]])**2 + (y[edges[:, 0]] - y[edges[:, 1]])**2)
+    return dict(
+        nodeIds = np.arange(len(x), dtype=np.int64),
+        nodeX = x,
+        nodeY = y,
+        streetIds = np.arange(len(edges), dtype=np.int64),
+        streetNode1 = edges[:, 0],
+        streetNode2 = edges[:, 1],
+        speedLimit = speedLimit,
+        nodeDistance = distance,
+        allowedDirections = directions,
+        streetNames = np.array(names, dtype=np.str_),
+    )
+
+
+def spanningTree(nodeNum, edges):
+    """
+    Kruskal without weights: returns a boolean array marking the edges (taken in the given order)
+    which join two parts of the graph not yet connected.
+    """
+    parent = list(range(nodeNum))
+    def root(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+    used = np.zeros(len(edges), dtype=bool)
+    for i, (a, b) in enumerate(edges.tolist()):
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            parent[ra] = rb
+            used[i] = True
+    return used
+
+
+def strongComponents(nodeNum, edges, directions):
+    """
+    Labels the strongly connected components of the street network (iterative Kosaraju).
+    Returns an int array with a component number for each node.
+    """
+    forward = directions != 2
+    backward = directions != 1
+    sources = np.concatenate([edges[forward, 0], edges[backward, 1]])
+    targets = np.concatenate([edges[forward, 1], edges[backward, 0]])
+
+    def adjacency(fromNodes, toNodes):
+        order = np.argsort(fromNodes, kind="stable")
+        offsets = np.zeros(nodeNum + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(fromNodes, minlength=nodeNum))
+        return offsets.tolist(), toNodes[order].tolist()
+
+    offsets, targetList = adjacency(sources, targets)
+    # first pass: nodes in order of finishing time
+    visited = [False] * nodeNum
+    finished = []
+    for start in range(nodeNum):
+        if visited[start]:
+            continue
+        visited[start] = True
+        stack = [(start, offsets[start])]
+        while stack:
+            node, i = stack[-1]
+            if i < offsets[node + 1]:
+                stack[-1] = (node, i + 1)
+                next = targetList[i]
+                if not visited[next]:
+                    visited[next] = True
+                    stack.append((next, offsets[next]))
+            else:
+                stack.pop()
+                finished.append(node)
+
+    # second pass, on the reversed graph
+    offsets, targetList = adjacency(targets, sources)
+    component = [-1] * nodeNum
+    label = 0
+    for start in reversed(finished):
+        if component[start] >= 0:
+            continue
+        component[start] = label
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for next in targetList[offsets[node]:offsets[node + 1]]:
+                if component[next] < 0:
+                    component[next] = label
+                    stack.append(next)
+        label += 1
+    return np.array(component)
+
+
+# -------------------------------------------------------------------------
+# Output
+
+def makeGraph(table, weighted = False, lanes = False, arrays = False):
+    """
+    Builds a graphGen.Graph from a street table and sets its street properties, as for a graph read from XML.
+    """
+    graph = graphGen.Graph(table = table, weighted = weighted, lanes = lanes, arrays = arrays)
+    graph.xmlGetStreetProperties()
+    return graph
+
+
+def writeXML(table, filename):
+    """
+    Writes a street table to an XML file with InOut.write_XML, in the format of the storage_*.xml files.
+    """
+    nodes = []
+    for nodeId, x, y in zip(table["nodeIds"].tolist(), table["nodeX"].tolist(), table["nodeY"].tolist()):
+        node = IO.Node(x, y)
+        node.id = nodeId
+        nodes.append(node)
+    streets = []
+    for i, (streetId, node1, node2) in enumerate(zip(table["streetIds"].tolist(), table["streetNode1"].tolist(), table["streetNode2"].tolist())):
+        street = IO.Street(str(table["streetNames"][i]), [nodes[node1], nodes[node2]])
+        street.id = streetId
+        street.speed_limit = int(table["speedLimit"][i])
+        street.allowed_directions = int(table["allowedDirections"][i])
+        nodes[node1].streets.append(street)
+        nodes[node2].streets.append(street)
+        streets.append(street)
+    IO.write_XML(nodes, streets, filename)
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Generate a synthetic road network and write it to an XML file.")
+    parser.add_argument("--kind", choices = ("grid", "radial", "planar"), default = "grid")
+    parser.add_argument("--nodes", type = int, default = 10000, help = "approximate number of intersections")
+    parser.add_argument("--one-way", type = float, default = 0.0, help = "fraction of one-way streets")
+    parser.add_argument("--spacing", type = int, default = 50, help = "distance between neighboring intersections, in pixels")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", default = "network.xml")
+    opts = parser.parse_args(args)
+
+    table = generate(opts.kind, opts.nodes, oneWayRatio = opts.one_way, spacing = opts.spacing, seed = opts.seed)
+    writeXML(table, opts.output)
+    print("Wrote {0} nodes and {1} streets to {2}".format(len(table["nodeIds"]), len(table["streetIds"]), opts.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# Multi-process simulation: the graph is cut into spatial partitions, and each partition's cars run in their own process
+
+# Usage:
+#   sim = partition.PartitionedSimulation(graph, parts = 4, carsNum = 10000, carSettings = carSettings, seed = 1234)
+#   sim.run(1000)
+#   sim.close()
+
+# A car belongs to the partition which owns the node it is driving towards (its pos.nodeTo), so everything a car
+# looks at while it moves (the cars ahead on its lane, the capacity of the node it arrives at, the weighted speed
+# of its lane) is in the same process. When a car turns onto an edge towards a node of another partition, it is
+# packed (Car.pack) and handed to that partition's process at the end of the step.
+# The one thing a car needs from another partition is whether the start of the edge it wants to turn onto is free
+# (lanes mode): each process reports the lanes coming from other partitions which are blocked at the end of a step,
+# and the process deciding puts a stand-in car (BoundaryGhost) at the end of those lanes during the next step.
+
+# Results depend on the number of partitions (cars in different processes see each other one step late at the cuts),
+# but not on timing: the same graph, seed and number of partitions always give the same trips.
+# If the graph has random streams (graph.streams, see streams.py), each car draws from its own stream wherever it runs,
+# so the random decisions no longer depend on the number of partitions either.
+
+import multiprocessing
+import numpy as np
+import simulator.graphGen as graphGen
+import simulator.cars as cars
+import simulator.run as run
+import simulator.streams as streams
+
+
+def partitionNodes(graph, parts):
+    """
+    Splits the nodes of graph into parts spatial partitions of nearly equal size, by recursive coordinate bisection:
+    the nodes are cut in two halves along the longer side of their bounding box, then each half again, and so on.
+    parts does not need to be a power of 2. Returns an int array with the partition of each node.
+    """
+    coords = np.array([node["coords"] for node in graph.nodes], dtype=float).reshape(graph.size, 2)
+    owner = np.zeros(graph.size, dtype=int)
+
+    def split(nodes, first, count):
+        if count == 1:
+            owner[nodes] = first
+            return
+        extent = coords[nodes].max(axis=0) - coords[nodes].min(axis=0)
+        axis = int(np.argmax(extent))
+        # stable sort along the axis, ties broken by node index, so that the cut is deterministic
+        order = nodes[np.lexsort((nodes, coords[nodes, axis]))]
+        leftCount = count // 2
+        cut = len(nodes) * leftCount // count
+        split(order[:cut], first, leftCount)
+        split(order[cut:], first + leftCount, count - leftCount)
+
+    split(np.arange(graph.size), 0, parts)
+    return owner
+
+
+def cutEdges(graph, owner):
+    """
+    Returns the directed edges (nodeFrom, nodeTo) which cars can drive along from one partition into another.
+    """
+    return [(n, next) for n, node in enumerate(graph.nodes) for next in node["connect"] if owner[n] != owner[next]]
+
+
+class BoundaryGhost:
+    """
+    Stands in for the last car on a lane owned by another partition, while that lane's start is blocked:
+    it is its own pos, just entering the edge, which is all Car.nodeBehavior checks.
+    """
+    def __init__(self, length):
+        self.pos = self
+        self.toNext = length
+        self.length = length
+
+
+class TripBuffer:
+    """
+    Takes the place of a tripLog.TripLog in the workers' graphs: keeps the trips of one step, to send them to the main process.
+    """
+    def __init__(self):
+        self.trips = []
+
+    def write(self, carId, spawnStep, arriveStep, route, distance):
+        self.trips.append((carId, spawnStep, arriveStep, [int(n) for n in route], distance))
+
+    def take(self):
+        trips = self.trips
+        self.trips = []
+        return trips
+
+
+def worker(conn, table, weighted, lanes, carSettings, owner, index, seed, routeTable, streamsSeed = None):
+    """
+    Main loop of the process running partition index. Each message from the main process holds, for one step:
+    the cars handed to this partition (packed), the cars to create (car id, start node, goal node, values drawn from its stream),
+    and the lanes from other partitions whose start is blocked. The reply holds the number of cars left,
+    the cars handed to other partitions, the incoming lanes blocked at the end of the step and the trips finished.
+    """
+    # the random draws of the cars' behavior (mistakes, random turns) are reproducible for each partition
+    np.random.seed((seed + 7919 * index) % (2**32))
+    graph = graphGen.Graph(table = table, weighted = weighted, lanes = lanes)
+    graph.xmlGetStreetProperties()
+    # routes towards the end nodes were computed once by the main process
+    graph.routeTable.update(routeTable)
+    graph.tripLog = TripBuffer()
+    if streamsSeed is not None:
+        graph.streams = streams.RandomStreams(streamsSeed)
+    carSize = carSettings.get("carSize", 5)
+
+    # lanes driven into this partition from another one: (nodeFrom, nodeTo, partition of nodeFrom)
+    incoming = [(a, b, owner[a]) for a, b in cutEdges(graph, owner) if owner[b] == index]
+    # lanes this partition handed cars to in the previous step: their start is blocked in this step
+    handedTo = []
+
+    carList = []
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        arrivals, spawns, blocked = message
+
+        for state in arrivals:
+            carList.append(cars.unpackCar(graph, state))
+        for carId, startNode, goal, drawn in spawns:
+            car = cars.Car(graph, dict(carSettings, startNode = startNode, nodeGoal = goal))
+            car.carId = carId
+            # the main process drew the start and goal from the car's stream: continue after them
+            if graph.streams is not None:
+                car.random = graph.streams.stream(carId, drawn)
+            carList.append(car)
+
+        ghosts = []
+        if lanes:
+            for key in set(blocked) | set(handedTo):
+                edge = graph.edges[key]
+                ghost = BoundaryGhost(edge["length"])
+                edge["population"][0 if key[0] > key[1] else 1].append(ghost)
+                ghosts.append((edge, key, ghost))
+
+        run.stepCars(carList, graph, 0, carSettings)
+
+        for edge, key, ghost in ghosts:
+            edge["population"][0 if key[0] > key[1] else 1].remove(ghost)
+
+        # hand over the cars which turned towards another partition
+        handoffs = []
+        handedTo = []
+        kept = []
+        for car in carList:
+            pos = car.pos
+            target = owner[pos.nodeTo]
+            if target != index and not pos.atNode:
+                pos.lane.remove(car)
+                graph.markDirty(pos.nodeFrom, pos.nodeTo)
+                handoffs.append((target, car.pack()))
+                handedTo.append((pos.nodeFrom, pos.nodeTo))
+            else:
+                kept.append(car)
+        carList = kept
+
+        blockedOut = []
+        if lanes:
+            for a, b, source in incoming:
+                population = graph.edges[(a, b)]["population"][0 if a > b else 1]
+                if len(population) > 0:
+                    tail = population[-1]
+                    if tail.pos.toNext >= tail.pos.length - carSize:
+                        blockedOut.append((source, (a, b)))
+
+        conn.send((len(carList), handoffs, blockedOut, graph.tripLog.take()))
+    conn.close()
+
+
+class PartitionedSimulation:
+    """
+    Runs the cars of graph in parts worker processes, one per spatial partition (see partitionNodes), keeping carsNum cars
+    in the simulation like run.stepCars. The graph must have been read from XML or built from a street table (graph.xmlTable),
+    which is what the workers build their own copies from; finished trips are recorded in graph (graph.recordTrip),
+    in a deterministic order.  \n
+    seed: seeds the draws of the cars' start and goal nodes (made here, in the main process) and the workers' random draws.
+    If graph.streams is set, the cars draw from their own streams instead (see streams.py), and seed is not used.
+    """
+
+    def __init__(self, graph, parts, carsNum, carSettings = {}, seed = 0):
+        if not hasattr(graph, "xmlTable"):
+            raise ValueError("PartitionedSimulation needs a graph read from XML or built from a street table.")
+        self.graph = graph
+        self.parts = parts
+        self.carsNum = carsNum
+        self.carSettings = dict(carSettings)
+        self.randomBehavior = carSettings.get("randomBehavior", True)
+        self.random = np.random.RandomState(seed)
+        self.owner = partitionNodes(graph, parts)
+        self.alive = 0
+        # planned cars only drive towards end nodes: compute those routes once here instead of in every worker
+        if not self.randomBehavior:
+            graph.buildRouteTable([goal for goal in graph.endNodes if goal not in graph.routeTable])
+
+        # messages for the next step, per partition
+        self.arrivals = [[] for i in range(parts)]
+        self.blocked = [[] for i in range(parts)]
+
+        self.connections = []
+        self.processes = []
+        for index in range(parts):
+            parentEnd, childEnd = multiprocessing.Pipe()
+            process = multiprocessing.Process(target = worker, args = (childEnd, graph.xmlTable, graph.weighted, graph.lanes,
+                                                                       self.carSettings, self.owner, index, seed, graph.routeTable,
+                                                                       graph.streams.seed if graph.streams is not None else None))
+            process.daemon = True
+            process.start()
+            childEnd.close()
+            self.connections.append(parentEnd)
+            self.processes.append(process)
+
+    def spawnOrders(self):
+        """
+        Draws the start and goal of the cars needed to get back to carsNum, as cars.Car would, and sorts them by partition.
+        """
+        graph = self.graph
+        orders = [[] for i in range(self.parts)]
+        inTransit = sum(len(a) for a in self.arrivals)
+        for i in range(self.carsNum - self.alive - inTransit):
+            carId = graph.carCount
+            graph.carCount += 1
+            random = graph.streams.stream(carId) if graph.streams is not None else self.random
+            startNode = int(random.choice(graph.endNodes))
+            goal = None if self.randomBehavior else int(random.choice(graph.endNodes))
+            drawn = random.drawn if graph.streams is not None else 0
+            orders[self.owner[graph.nodes[startNode]["connect"][0]]].append((carId, startNode, goal, drawn))
+        return orders
+
+    def step(self):
+        """
+        Moves every car by one time step, then hands cars over between partitions and adds new cars.
+        Returns the number of trips finished during the step.
+        """
+        graph = self.graph
+        spawns = self.spawnOrders()
+        for index, conn in enumerate(self.connections):
+            conn.send((self.arrivals[index], spawns[index], self.blocked[index]))
+        graph.stepCount += 1
+
+        self.arrivals = [[] for i in range(self.parts)]
+        self.blocked = [[] for i in range(self.parts)]
+        self.alive = 0
+        finished = 0
+        # partitions are always read in the same order, so that arrivals and trips are too
+        for conn in self.connections:
+            alive, handoffs, blocked, trips = conn.recv()
+            self.alive += alive
+            for target, state in handoffs:
+                self.arrivals[target].append(state)
+            for source, key in blocked:
+                self.blocked[source].append(key)
+            for carId, spawnStep, arriveStep, route, distance in trips:
+                graph.recordTrip(carId, spawnStep, arriveStep - spawnStep, route, distance)
+            finished += len(trips)
+        return finished
+
+    def run(self, steps):
+        for i in range(steps):
+            self.step()
+
+    def __len__(self):
+        return self.alive + sum(len(a) for a in self.arrivals)
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for conn in self.connections:
+            try:
+                conn.send(None)
+                conn.close()
+            except (OSError, EOFError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,162 @@
+# Optional per-phase instrumentation of the simulation: call counts and cumulative time of the hot functions
+
+# Off by default, and then costs nothing: enable() replaces the instrumented functions with timed wrappers,
+# and disable() puts the originals back.
+
+# Usage: profiling.enable(); ...run the simulation...; print(profiling.report())
+
+import functools
+import time
+
+enabled = False
+
+# phase name -> [calls, seconds, units]
+phases = {}
+# (owner, attribute name, phase, units) of every instrumented function; see instrument()
+hooks = []
+# (owner, attribute name, original function) of the wrappers currently installed
+installed = []
+# whether defaultHooks() has registered the phases of the simulator yet
+defaultsRegistered = False
+startTime = None
+
+# phases counted as route computations in the routing calls/sec rate
+ROUTING_PHASES = ("routing: A*", "routing: route table", "routing: table lookup", "routing: hierarchy")
+
+
+def instrument(owner, name, phase, units = None):
+    """
+    Registers owner.name (a function of a module, or a method of a class) to be timed under phase while profiling is enabled.
+    units: optional function, called with the same arguments, returning an amount to add up for the phase
+    (for instance the number of cars moved by a step).
+    """
+    hooks.append((owner, name, phase, units))
+    if enabled:
+        _install(owner, name, phase, units)
+
+
+def defaultHooks():
+    """
+    Registers the phases of the simulator itself: stepping, routing, leader search, weights and coordinates.  \n
+    Called by enable(), alongside any function registered with instrument() before; only registers them once.
+    """
+    global defaultsRegistered
+    if defaultsRegistered:
+        return
+    defaultsRegistered = True
+    import simulator.cars as cars
+    import simulator.contraction as contraction
+    import simulator.events as events
+    import simulator.fleet as fleet
+    import simulator.graphGen as graphGen
+    import simulator.run as run
+
+    instrument(run, "stepCars", "step", units = lambda carList, *args: len(carList))
+    instrument(events.EventScheduler, "step", "step", units = lambda scheduler: len(scheduler.carList))
+    instrument(cars.RoutePlanner, "plan", "routing: A*")
+    instrument(graphGen.Graph, "buildRouteTable", "routing: route table")
+    instrument(graphGen.Graph, "internRoute", "routing: table lookup")
+    instrument(contraction.Hierarchy, "route", "routing: hierarchy")
+    instrument(cars.Car, "__init__", "spawn")
+    instrument(fleet.Fleet, "spawn", "spawn")
+    instrument(fleet.Fleet, "spawnBatch", "spawn")
+    instrument(cars.Car, "getNextCarEdge", "leader search")
+    instrument(cars.Car, "nodeBehavior", "node behavior")
+    instrument(graphGen.Graph, "updateWeights", "updateWeights")
+    instrument(fleet.Fleet, "updateWeights", "updateWeights")
+    instrument(cars.Position, "calcCoords", "coords")
+    instrument(fleet.Fleet, "coords", "coords")
+
+
+def _install(owner, name, phase, units):
+    original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+    entry = phases.setdefault(phase, [0, 0.0, 0])
+    perf_counter = time.perf_counter
+
+    @functools.wraps(original)
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            entry[1] += perf_counter() - start
+            entry[0] += 1
+            if units is not None:
+                entry[2] += units(*args)
+
+    setattr(owner, name, timed)
+    installed.append((owner, name, original))
+
+
+def enable():
+    """
+    Starts timing the instrumented phases (and resets the counters).
+    """
+    global enabled
+    if enabled:
+        return
+    # also when other functions were registered first (main_pygame.py adds its drawing functions)
+    defaultHooks()
+    enabled = True
+    for owner, name, phase, units in hooks:
+        _install(owner, name, phase, units)
+    reset()
+
+
+def disable():
+    """
+    Stops timing: the original functions are put back, the counters are kept.
+    """
+    global enabled
+    while installed:
+        owner, name, original = installed.pop()
+        setattr(owner, name, original)
+    enabled = False
+
+
+def reset():
+    global startTime
+    for entry in phases.values():
+        entry[:] = [0, 0.0, 0]
+    startTime = time.perf_counter()
+
+
+def snapshot():
+    """
+    Returns the counters as a dict: for every phase, a dict with its calls, seconds and units;
+    plus "wallTime" and the rates "stepsPerSecond", "carsPerSecond" and "routingCallsPerSecond".
+    """
+    wallTime = time.perf_counter() - startTime if startTime is not None else 0.0
+    result = dict((phase, dict(calls = e[0], seconds = e[1], units = e[2])) for phase, e in phases.items())
+    rate = lambda n: n / wallTime if wallTime > 0 else 0.0
+    step = phases.get("step", [0, 0.0, 0])
+    result["wallTime"] = wallTime
+    result["stepsPerSecond"] = rate(step[0])
+    result["carsPerSecond"] = rate(step[2])
+    result["routingCallsPerSecond"] = rate(sum(phases[p][0] for p in ROUTING_PHASES if p in phases))
+    return result
+
+
+def statusLine():
+    """
+    One short line with the rates, for the pygame window.
+    """
+    s = snapshot()
+    return "Steps/s: {stepsPerSecond:.0f}  Cars/s: {carsPerSecond:.0f}  Routing calls/s: {routingCallsPerSecond:.0f}".format(**s)
+
+
+def report():
+    """
+    Multi-line text report: the rates, then every phase with its calls, total time and share of the wall time.
+    Phases can contain each other (a step includes its route lookups), so the shares do not add up to 100%.
+    """
+    s = snapshot()
+    wallTime = s["wallTime"]
+    lines = ["Profile after {0:.2f} s \t {1}".format(wallTime, statusLine())]
+    for phase, e in sorted(phases.items(), key = lambda item: -item[1][1]):
+        if e[0] == 0:
+            continue
+        share = 100.0 * e[1] / wallTime if wallTime > 0 else 0.0
+        lines.append("    {0:<22} calls: {1:>10} \t time: {2:9.3f} s \t {3:5.1f}% \t per call: {4:8.2f} us".format(
+            phase, e[0], e[1], share, 1e6 * e[1] / e[0]))
+    return "\n".join(lines)
@@ -0,0 +1,159 @@
+# Regression checks: the different ways of running the same simulation on storage_a.xml must give the same results
+
+# Usage: python -m simulator.regression [--steps 300]
+
+# Each check prints one line per case, ending with "ok" or "FAILED", and the script exits with status 1 if any failed:
+#   fleet:      fleet.Fleet against a list of Car objects (run.stepCars): same trips, every car in the same state
+#   events:     events.EventScheduler against run.stepCars: same trips, same cars after sync, same np.random state,
+#               same edge statistics
+#   checkpoint: a run saved with checkpoint.save and resumed with checkpoint.load on a new graph against the same run
+#               without stopping, also with the cars created by a demand.Demand
+#   partition:  partition.PartitionedSimulation twice with the same seed and number of partitions: same trips
+#   hierarchy:  routes of the contraction hierarchy against the Dijkstra route table: same travel times
+# Takes about ten seconds.
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import numpy as np
+import simulator.checkpoint as checkpoint
+import simulator.contraction as contraction
+import simulator.demand as demand
+import simulator.edgeStats as edgeStats
+import simulator.fleet as fleet
+import simulator.partition as partition
+import simulator.run as run
+import simulator.cars as cars
+from simulator.scenarios import carState, routeTime, simulate, storageGraph
+
+
+def report(name, same):
+    print("{0:<60} {1}".format(name, "ok" if same else "FAILED"))
+    return same
+
+
+def compareRuns(name, engines, mode, steps, carSettings, setup = None, extra = lambda graph: None):
+    """
+    Runs the same simulation with each of engines (see scenarios.simulate), and reports whether they agree on the trips,
+    the cars, the state of np.random and extra(graph).
+    """
+    runs = []
+    for engine in engines:
+        wallTime, graph, carList, scheduler = simulate(lambda: storageGraph(mode), 300, steps, carSettings, engine, setup = setup)
+        runs.append((graph.history, [carState(car) for car in carList], np.random.get_state()[2], extra(graph)))
+    return report("{0}, {1}, randomBehavior {2}".format(name, mode, carSettings["randomBehavior"]),
+                  all(other == runs[0] for other in runs[1:]))
+
+
+def checkFleet(steps):
+    results = []
+    for mode in ("weighted", "lanes"):
+        for randomBehavior in (False, True):
+            carSettings = dict(randomBehavior = randomBehavior, mistakes = True)
+            results.append(compareRuns("fleet", ("cars", "fleet"), mode, steps, carSettings))
+    return all(results)
+
+
+def checkEvents(steps):
+    def setup(graph):
+        graph.edgeStats = edgeStats.EdgeStats(graph, binSize = 50, steps = steps)
+
+    def totals(graph):
+        totals = graph.edgeStats.totals()
+        return dict((name, totals[name].tolist()) for name in totals)
+
+    results = []
+    for mode in ("lanes", "plain", "weighted"):
+        for randomBehavior in (False, True):
+            carSettings = dict(randomBehavior = randomBehavior, mistakes = True)
+            results.append(compareRuns("events", ("cars", "events"), mode, steps, carSettings, setup, totals))
+    return all(results)
+
+
+def checkCheckpoint(steps):
+    results = []
+    filename = os.path.join(tempfile.mkdtemp(), "regression.npz")
+    # the demand cases create about 100 cars along the run, instead of keeping 100
+    for vectorized, mode, withDemand in ((False, "lanes", False), (False, "weighted", False), (True, "weighted", False),
+                                         (False, "lanes", True), (True, "weighted", True)):
+        for randomBehavior in ((False, True) if not withDemand else (False,)):
+            carSettings = dict(randomBehavior = randomBehavior, mistakes = True)
+            makeDemand = lambda graph: demand.Demand(graph, demand.uniformOD(graph, 1800), seed = 1) if withDemand else None
+            np.random.seed(1)
+            graph = storageGraph(mode)
+            trips = makeDemand(graph)
+            carsNum = 0 if withDemand else 100
+            with contextlib.redirect_stdout(io.StringIO()):
+                if vectorized:
+                    carList = fleet.Fleet(graph, carSettings, carsNum)
+                else:
+                    carList = [cars.Car(graph, carSettings) for i in range(carsNum)]
+                for step in range(steps):
+                    run.stepCars(carList, graph, carsNum, carSettings, trips)
+                checkpoint.save(filename, graph, carList, trips = trips)
+                for step in range(steps):
+                    run.stepCars(carList, graph, carsNum, carSettings, trips)
+                resumedGraph = storageGraph(mode)
+                resumedTrips = makeDemand(resumedGraph)
+                resumed = checkpoint.load(filename, resumedGraph, trips = resumedTrips)
+                for step in range(steps):
+                    run.stepCars(resumed, resumedGraph, carsNum, carSettings, resumedTrips)
+            same = (graph.history == resumedGraph.history and graph.carCount == resumedGraph.carCount and
+                    [carState(car) for car in carList] == [carState(car) for car in resumed])
+            name = "checkpoint, {0}{1}{2}, randomBehavior {3}".format(mode, ", Fleet" if vectorized else "",
+                                                                      ", demand" if withDemand else "", randomBehavior)
+            results.append(report(name, same))
+    os.remove(filename)
+    os.rmdir(os.path.dirname(filename))
+    return all(results)
+
+
+def checkPartition(steps):
+    results = []
+    carSettings = dict(randomBehavior = False, mistakes = True)
+    for mode in ("lanes", "weighted"):
+        histories = []
+        for repeat in range(2):
+            graph = storageGraph(mode)
+            # the workers are forked with the redirected output
+            with contextlib.redirect_stdout(io.StringIO()):
+                with partition.PartitionedSimulation(graph, 2, 100, carSettings, seed = 1) as sim:
+                    sim.run(steps)
+            histories.append(graph.history)
+        results.append(report("partition, {0}, 2 partitions run twice".format(mode), histories[0] == histories[1]))
+    return all(results)
+
+
+def checkHierarchy():
+    graph = storageGraph("plain")
+    graph.buildRouteTable()
+    hierarchy = contraction.build(graph)
+    different = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for goal in graph.endNodes:
+            for start in range(graph.size):
+                if start == goal:
+                    continue
+                table = graph.endRoute(start, goal)
+                route = hierarchy.route(start, goal)
+                if bool(table) != bool(route) or abs(routeTime(graph, table) - routeTime(graph, route)) > 1e-9 * max(1.0, routeTime(graph, table)):
+                    different += 1
+    return report("hierarchy, routes towards every end node ({0} different)".format(different), different == 0)
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Check that the different ways of running a simulation agree.")
+    parser.add_argument("--steps", type = int, default = 300)
+    opts = parser.parse_args(args)
+
+    # all of them, even after a failure
+    results = [checkFleet(opts.steps), checkEvents(opts.steps), checkCheckpoint(opts.steps // 2),
+               checkPartition(opts.steps // 2), checkHierarchy()]
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Headless batch runner: runs a simulation from the command line or from Python, without pygame
+
+# Usage: python -m simulator.run --xml storage_a.xml --cars 500 --steps 100000 --seed 1234
+
+import argparse
+import time
+import numpy as np
+import simulator.graphGen as graphGen
+import simulator.cars as cars
+import simulator.fleet as fleet
+import simulator.profiling as profiling
+import simulator.tripLog as tripLog
+import simulator.checkpoint as checkpoint
+import simulator.streams as streams
+import simulator.demand as demand
+import simulator.events as events
+import simulator.edgeStats as edgeStats
+
+
+def stepCars(carList, graph, carsNum, carSettings, trips = None):
+    """
+    Moves every car by one time step, then adds new cars until there are carsNum of them.
+    Same behavior as update_system in main_pygame.py; carList may be a list of Car objects or a fleet.Fleet.  \n
+    trips: if a demand.Demand, the new cars are the trips it draws for the step instead, and carsNum is not used.
+    """
+    graph.stepCount += 1
+    if isinstance(carList, fleet.Fleet):
+        carList.step()
+        if trips is not None:
+            trips.spawn(carList, carSettings)
+        else:
+            carList.fill(carsNum)
+        return
+    if graph.edgeStats is not None:
+        graph.edgeStats.mark()
+    if graph.weighted:
+        graph.updateWeights()
+    # iterate over a copy, so that removing a car does not skip the car after it
+    for car in list(carList):
+        if car.updatePosition():
+            carList.remove(car)
+    if trips is not None:
+        trips.spawn(carList, carSettings)
+        return
+    while len(carList) < carsNum:
+        carList.append(cars.Car(graph, carSettings))
+
+
+def run(xml, carsNum, steps, seed = None, lanes = True, weighted = False, carSettings = {}, vectorized = False, output = None, reportEvery = 0, tripLogFile = None, profile = False, resume = None, saveTo = None, checkpointEvery = 0, randomStreams = False,
+        demandRate = None, demandProfile = "flat", stepsPerHour = 3600, startHour = 0, hierarchy = False, eventDriven = False, table = None,
+        edgeStatsFile = None, statsBin = 100):
+    """
+    Runs a whole simulation on the graph in the given XML file, with a constant number of cars.  \n
+    seed: if not None, seeds np.random before anything else, so that runs can be repeated.  \n
+    vectorized: if True, steps the cars with fleet.Fleet instead of a list of Car objects; same results. Faster from
+    a few hundred cars with weighted, but with lanes only from several thousand (see the Fleet docstring).  \n
+    output: if a filename, the results in graph.history are appended to it at the end (as main_pygame does on exit),
+    including when the run is interrupted.  \n
+    reportEvery: if positive, prints progress every reportEvery steps.  \n
+    tripLogFile: if a filename, finished trips are written to it as they happen with a tripLog.TripLog
+    (read it with tripLog.readTripLog) instead of being kept in graph.history.  \n
+    profile: if True, times each phase of the simulation with profiling.py, and prints its report with the
+    progress reports and at the end.  \n
+    resume: if a filename, starts from the state saved in that checkpoint (see checkpoint.py) instead of an empty map,
+    and runs steps more steps; np.random (and the draws of the demand) continue from the saved state, unless seed is
+    given (to fork the run).  \n
+    saveTo: if a filename, saves a checkpoint there at the end of the run, and every checkpointEvery steps if positive.  \n
+    randomStreams: if True, each car draws from its own random stream seeded by seed (see streams.py) instead of np.random,
+    so that its decisions do not depend on the order or the process the cars are run in.  \n
+    demandRate: if given, the run starts without cars and creates them from a demand.Demand instead of keeping carsNum:
+    demandRate trips per hour between all pairs of end nodes, varying along the day as demand.PROFILES[demandProfile],
+    with stepsPerHour time steps per hour, starting at startHour. carsNum is then not used.  \n
+    hierarchy: if True, routes come from a contraction hierarchy of the map (see Graph.buildHierarchy), which is
+    saved next to the XML file and reused by later runs on the same map.  \n
+    eventDriven: if True, steps the cars with an events.EventScheduler, which only updates the cars with something to do;
+    same results. Not with vectorized. Faster with long queues, without lanes or with weighted, slower on busy maps with lanes,
+    where most cars follow a moving car (see README.md). The result then also has carUpdates, the number of car updates actually done.  \n
+    table: if given, the street table of xml already read with graphCache.loadTable (for instance shared by the workers
+    of sweep.py): the graph is built from it instead of reading the file again.  \n
+    edgeStatsFile: if a filename, collects traffic statistics of each edge in time bins of statsBin steps with an
+    edgeStats.EdgeStats, and saves them there at the end (read them with edgeStats.load). Not with vectorized.  \n
+    Returns a dict with the number of steps run, wall time, steps per second, car updates per second and trips completed.
+    """
+    if seed is not None:
+        np.random.seed(seed)
+    if profile:
+        profiling.enable()
+
+    graph = graphGen.Graph(xml = xml, weighted = weighted, lanes = lanes, table = table)
+    graph.xmlGetStreetProperties()
+    if hierarchy:
+        graph.buildHierarchy()
+    if randomStreams:
+        graph.streams = streams.RandomStreams(seed if seed is not None else 0)
+    if tripLogFile:
+        graph.tripLog = tripLog.TripLog(tripLogFile)
+
+    trips = None
+    if demandRate is not None:
+        trips = demand.Demand(graph, demand.uniformOD(graph, demandRate), demand.PROFILES[demandProfile],
+                              stepsPerHour = stepsPerHour, startHour = startHour, seed = seed if seed is not None else 0)
+
+    if resume:
+        carList = checkpoint.load(resume, graph, restoreRandom = seed is None, trips = trips)
+    elif trips is not None:
+        carList = fleet.Fleet(graph, carSettings) if vectorized else []
+    elif vectorized:
+        carList = fleet.Fleet(graph, carSettings, carsNum)
+    else:
+        carList = [cars.Car(graph, carSettings) for i in range(carsNum)]
+
+    scheduler = None
+    if eventDriven:
+        if vectorized:
+            raise ValueError("The event scheduler steps Car objects: it cannot be combined with vectorized.")
+        scheduler = events.EventScheduler(graph, carList, carsNum, carSettings, trips)
+    if edgeStatsFile:
+        if vectorized:
+            raise ValueError("Edge statistics are reported by Car objects: they cannot be combined with vectorized.")
+        graph.edgeStats = edgeStats.EdgeStats(graph, binSize = statsBin, steps = steps)
+
+    step = 0
+    # car updates so far: the number of cars changes along a run with a demand
+    carSteps = 0
+    start = time.time()
+    try:
+        for step in range(1, steps + 1):
+            carSteps += len(carList)
+            if scheduler is not None:
+                scheduler.step()
+            else:
+                stepCars(carList, graph, carsNum, carSettings, trips)
+            if reportEvery > 0 and step % reportEvery == 0:
+                print(report(stats(step, time.time() - start, carSteps / float(step), graph, scheduler)))
+                if profile:
+                    print(profiling.report())
+            # overwritten every checkpointEvery steps, so that a crashed run can be resumed from the last one
+            if saveTo and checkpointEvery > 0 and step % checkpointEvery == 0:
+                if scheduler is not None:
+                    scheduler.sync()
+                checkpoint.save(saveTo, graph, carList, trips = trips)
+        if scheduler is not None:
+            scheduler.sync()
+        if saveTo:
+            checkpoint.save(saveTo, graph, carList, trips = trips)
+        if edgeStatsFile:
+            graph.edgeStats.save(edgeStatsFile)
+    finally:
+        wallTime = time.time() - start
+        if graph.tripLog is not None:
+            graph.tripLog.close()
+        if profile:
+            if not (reportEvery > 0 and step % reportEvery == 0):
+                print(profiling.report())
+            profiling.disable()
+        if output:
+            with open(output, "ab") as f:
+                np.savetxt(f, graph.history, fmt="%s", header = "Next run begins here.")
+
+    return stats(step, wallTime, carSteps / float(step) if step else 0, graph, scheduler)
+
+
+def stats(steps, wallTime, carsNum, graph, scheduler = None):
+    """
+    Collects the throughput numbers of a run into a dict. carsNum: average number of cars per step.
+    scheduler: the events.EventScheduler of the run, if any, for the number of car updates actually done.
+    """
+    rate = steps / wallTime if wallTime > 0 else float("inf")
+    result = dict(
+        steps = steps,
+        wallTime = wallTime,
+        stepsPerSecond = rate,
+        carsPerSecond = rate * carsNum,
+        trips = graph.trips,
+    )
+    if scheduler is not None:
+        result["carUpdates"] = scheduler.updates
+    return result
+
+
+def report(result):
+    """
+    Formats the dict returned by run() as one line of text.
+    """
+    line = "Steps: {steps} \t Wall time: {wallTime:.2f} s \t Steps per second: {stepsPerSecond:.1f} \t Car updates per second: {carsPerSecond:.0f} \t Trips completed: {trips}".format(**result)
+    if "carUpdates" in result:
+        line += " \t Car updates done: {carUpdates}".format(**result)
+    return line
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Run a traffic simulation without visualization.")
+    parser.add_argument("--xml", default = "storage_a.xml", help = "graph file written by xmlReader.InOut")
+    parser.add_argument("--cars", type = int, default = 5, help = "number of cars kept in the simulation")
+    parser.add_argument("--steps", type = int, default = 1000, help = "number of time steps to run")
+    parser.add_argument("--seed", type = int, default = None, help = "seed for np.random")
+    parser.add_argument("--mode", choices = ("lanes", "weighted"), default = "lanes", help = "traffic slowdown method")
+    parser.add_argument("--vectorized", action = "store_true", help = "step all cars at once with fleet.Fleet (faster with many cars, see README.md)")
+    parser.add_argument("--random-behavior", action = "store_true", help = "cars wander randomly instead of following a plan")
+    parser.add_argument("--mistakes", action = "store_true", help = "planned cars sometimes take a wrong turn")
+    parser.add_argument("--car-size", type = int, default = 5)
+    parser.add_argument("--accel", type = int, default = 5)
+    parser.add_argument("--node-wait", type = int, default = 1)
+    parser.add_argument("--output", default = None, help = "file to append the trip results to, e.g. results.txt")
+    parser.add_argument("--trip-log", default = None, help = "binary file to write finished trips to as the run goes (see simulator/tripLog.py)")
+    parser.add_argument("--profile", action = "store_true", help = "time each phase of the simulation (see simulator/profiling.py)")
+    parser.add_argument("--streams", action = "store_true", help = "give each car its own random stream (see simulator/streams.py)")
+    parser.add_argument("--demand", type = float, default = None, help = "create cars from an OD matrix with this many trips per hour, instead of keeping --cars cars (see simulator/demand.py)")
+    parser.add_argument("--demand-profile", choices = sorted(demand.PROFILES), default = "flat", help = "how the demand changes along the day")
+    parser.add_argument("--steps-per-hour", type = int, default = 3600)
+    parser.add_argument("--start-hour", type = float, default = 0)
+    parser.add_argument("--events", action = "store_true", help = "only update the cars with something to do (see simulator/events.py): faster with queues, without lanes or with --mode weighted, slower on busy maps with lanes")
+    parser.add_argument("--hierarchy", action = "store_true", help = "plan routes with a contraction hierarchy of the map (see simulator/contraction.py)")
+    parser.add_argument("--edge-stats", default = None, help = "file to save traffic statistics of each edge to, e.g. stats.npz (see simulator/edgeStats.py)")
+    parser.add_argument("--stats-bin", type = int, default = 100, help = "length in steps of the time bins of --edge-stats")
+    parser.add_argument("--resume", default = None, help = "checkpoint file to start from (see simulator/checkpoint.py)")
+    parser.add_argument("--checkpoint", default = None, help = "file to save a checkpoint of the simulation to at the end")
+    parser.add_argument("--checkpoint-every", type = int, default = 0, help = "also save the checkpoint every N steps")
+    parser.add_argument("--report-every", type = int, default = 0, help = "print progress every N steps")
+    opts = parser.parse_args(args)
+
+    carSettings = dict(
+        carSize = opts.car_size,
+        accel = opts.accel,
+        nodeWait = opts.node_wait,
+        randomBehavior = opts.random_behavior,
+        mistakes = opts.mistakes
+    )
+    result = run(opts.xml, opts.cars, opts.steps, seed = opts.seed, lanes = opts.mode == "lanes", weighted = opts.mode == "weighted",
+                 carSettings = carSettings, vectorized = opts.vectorized, output = opts.output, reportEvery = opts.report_every, tripLogFile = opts.trip_log, profile = opts.profile,
+                 resume = opts.resume, saveTo = opts.checkpoint, checkpointEvery = opts.checkpoint_every, randomStreams = opts.streams,
+                 demandRate = opts.demand, demandProfile = opts.demand_profile, stepsPerHour = opts.steps_per_hour, startHour = opts.start_hour,
+                 hierarchy = opts.hierarchy, eventDriven = opts.events,
+                 edgeStatsFile = opts.edge_stats, statsBin = opts.stats_bin)
+    print(report(result))
+    return result
+
+
+if __name__ == "__main__":
+    # call main through the imported module rather than this __main__ copy of it,
+    # so that profiling.py times the same stepCars that run() calls
+    import simulator.run
+    simulator.run.main()
@@ -0,0 +1,62 @@
+# Helpers shared by the regression checks (regression.py) and the benchmarks: the same simulation run in different ways,
+# and what to compare between the runs
+
+import contextlib
+import io
+import time
+import numpy as np
+import simulator.graphGen as graphGen
+import simulator.cars as cars
+import simulator.events as events
+import simulator.fleet as fleet
+import simulator.run as run
+
+
+def storageGraph(mode = "lanes", xml = "storage_a.xml"):
+    """
+    Graph of xml with its street properties, in mode "lanes", "weighted" or "plain" (neither).
+    """
+    graph = graphGen.Graph(xml = xml, lanes = mode == "lanes", weighted = mode == "weighted")
+    graph.xmlGetStreetProperties()
+    return graph
+
+
+def carState(car):
+    """
+    What two runs of the same simulation must agree on for a car (a cars.Car, or a car of a fleet.Fleet).
+    """
+    pos = car.pos
+    return (car.carId, pos.nodeFrom, pos.nodeTo, float(pos.dist), float(pos.toNext), pos.atNode, float(car.velocity),
+            float(car.speedLimit), car.currentWait, car.lifetime, list(car.history))
+
+
+def routeTime(graph, route):
+    return sum(graph.heuristicWeight(route[i], route[i+1]) for i in range(len(route) - 1))
+
+
+def simulate(makeGraph, carsNum, steps, carSettings, engine = "cars", seed = 1, setup = None):
+    """
+    Runs steps steps with carsNum cars on a new graph from makeGraph(), seeding np.random with seed first.  \n
+    engine: "cars" (Car objects and run.stepCars), "fleet" (a fleet.Fleet and run.stepCars) or "events" (Car objects
+    and an events.EventScheduler, synced at the end).  \n
+    setup: if given, called with the graph before the cars are created (for instance to add edge statistics).  \n
+    Returns the wall time of the steps, the graph, the cars and the scheduler (None without events).
+    """
+    np.random.seed(seed)
+    graph = makeGraph()
+    if setup is not None:
+        setup(graph)
+    # cars print a line when they find no route; keep them out of the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        carList = fleet.Fleet(graph, carSettings, carsNum) if engine == "fleet" else [cars.Car(graph, carSettings) for i in range(carsNum)]
+        scheduler = events.EventScheduler(graph, carList, carsNum, carSettings) if engine == "events" else None
+        start = time.time()
+        for step in range(steps):
+            if scheduler is not None:
+                scheduler.step()
+            else:
+                run.stepCars(carList, graph, carsNum, carSettings)
+        if scheduler is not None:
+            scheduler.sync()
+        wallTime = time.time() - start
+    return wallTime, graph, carList, scheduler
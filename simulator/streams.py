@@ -0,0 +1,127 @@
+# Random streams for the cars: each car draws its random numbers from its own counter-based stream
+
+# By default the cars use the global np.random (GLOBAL below), so results depend on the order the cars draw in.
+# With graph.streams = streams.RandomStreams(seed), the n-th number drawn by the car with id carId is a fixed function
+# of (seed, carId, n): results no longer depend on the order of the cars, nor on how many threads or processes
+# run them, and the state of a car's stream is a single number (how many values it has drawn).
+
+# The function is SplitMix64 (the mixing function of Java's SplittableRandom) applied to a counter:
+# value n of a stream is mix(base + (n + 1) * GOLDEN), base being mix(seed, carId). Values are computed BLOCK at a time
+# with NumPy, so a decision costs a list lookup rather than a call to np.random; the first blocks of the streams of
+# new cars are computed for CACHE car ids at once, since cars are created one after the other with consecutive ids.
+
+import numpy as np
+
+GOLDEN = 0x9E3779B97F4A7C15
+MASK = 0xFFFFFFFFFFFFFFFF
+# number of values computed at once for a stream
+BLOCK = 64
+# number of car ids whose first blocks are computed at once by RandomStreams
+CACHE = 256
+
+
+def mix(z):
+    """
+    SplitMix64 finalizer, for a Python int or an array of uint64 (which wraps around on overflow).
+    """
+    if isinstance(z, int):
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK
+        return z ^ (z >> 31)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def uniforms(base, start, count):
+    """
+    Values start to start + count of the stream with the given base, as floats in [0, 1).
+    base can also be a column of bases (shape (n, 1)), which gives one row of values per stream.
+    """
+    # uint64 arrays wrap around silently, as the algorithm needs
+    counters = np.arange(start + 1, start + count + 1, dtype=np.uint64)
+    z = mix(counters * np.uint64(GOLDEN) + np.asarray(base, dtype=np.uint64))
+    return (z >> np.uint64(11)) * (1.0 / 2**53)
+
+
+class Stream:
+    """
+    The random numbers of one car. Has the two methods the cars need, with the same meaning as the np.random calls
+    they replace: choice(options) (one item of a list) and randint(n) (an int from 0 to n-1).  \n
+    drawn: number of values already drawn, which is all that is needed to continue the stream (see RandomStreams.stream).
+    """
+    __slots__ = ("base", "block", "buffer", "used")
+
+    def __init__(self, base, drawn = 0, buffer = None):
+        self.base = base
+        self.block = drawn // BLOCK
+        self.used = drawn % BLOCK
+        # values of the current block: computed on the first draw if not given
+        self.buffer = buffer
+
+    @property
+    def drawn(self):
+        return self.block * BLOCK + self.used
+
+    def random(self):
+        if self.buffer is None or self.used == BLOCK:
+            if self.buffer is not None:
+                self.block += 1
+                self.used = 0
+            self.buffer = uniforms(self.base, self.block * BLOCK, BLOCK).tolist()
+        value = self.buffer[self.used]
+        self.used += 1
+        return value
+
+    def choice(self, options):
+        return options[int(self.random() * len(options))]
+
+    def randint(self, n):
+        return int(self.random() * n)
+
+
+class GlobalStream:
+    """
+    The same methods as Stream, drawing from the global np.random exactly as the cars always have.
+    """
+    def choice(self, options):
+        return np.random.choice(options)
+
+    def randint(self, n):
+        return np.random.randint(0, n)
+
+    @property
+    def drawn(self):
+        return 0
+
+
+GLOBAL = GlobalStream()
+
+
+class RandomStreams:
+    """
+    Gives every car its own Stream, determined by seed and the car's id (graph.carCount when it was created).
+    Set graph.streams to one before creating the cars.
+    """
+    def __init__(self, seed = 0):
+        self.seed = seed
+        self.seedBase = mix((int(seed) * GOLDEN) & MASK)
+        # bases and first blocks of the streams of car ids cacheStart to cacheStart + CACHE - 1
+        self.cacheStart = None
+        self.cacheBases = None
+        self.cacheBlocks = None
+
+    def stream(self, key, drawn = 0):
+        """
+        The stream of car key, continuing after its first drawn values.
+        """
+        key = int(key)
+        if drawn >= BLOCK:
+            return Stream(mix((self.seedBase + key * GOLDEN) & MASK), drawn)
+        if self.cacheStart is None or not 0 <= key - self.cacheStart < CACHE:
+            self.cacheStart = key
+            keys = np.arange(key, key + CACHE, dtype=np.uint64)
+            self.cacheBases = mix(keys * np.uint64(GOLDEN) + np.uint64(self.seedBase))
+            self.cacheBlocks = uniforms(self.cacheBases[:, None], 0, BLOCK)
+        i = key - self.cacheStart
+        return Stream(int(self.cacheBases[i]), drawn, self.cacheBlocks[i].tolist())
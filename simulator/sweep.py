@@ -0,0 +1,170 @@
+# Parameter sweeps: runs every combination of a grid of simulation settings on a pool of processes, and writes one
+# table with the throughput numbers of each run
+
+# Usage: python -m simulator.sweep sweep.json --output sweep.csv [--workers 4]
+# where sweep.json holds the grid, for instance:
+#   {"xml": ["storage_a.xml", "storage_b.xml", "storage_c.xml"], "carsNum": [100, 500], "mode": ["lanes", "weighted"],
+#    "nodeWait": [1, 3], "mistakes": [false, true], "randomBehavior": false, "seed": [1, 2, 3], "steps": 2000}
+# Each key takes a list of values (or a single value); the runs are all the combinations, in the order of the keys.
+# Cars follow planned routes unless the grid sets randomBehavior: only planned cars finish trips, so with
+# randomBehavior true the trips and tripsPerStep columns are 0.
+
+# Each map is read once, in the main process, and its street table (see graphCache.py) is handed to every worker
+# when the pool starts: a run builds its graph from the table instead of reading the XML file again.
+# Runs are independent (each one seeds np.random with its own seed), so the results do not depend on the number of
+# workers or on the order the runs finish in.
+
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import simulator.graphCache as graphCache
+import simulator.run as run
+
+# settings of run.run, with their defaults in a sweep
+RUN_SETTINGS = dict(xml = "storage_a.xml", carsNum = 100, steps = 1000, seed = 0, mode = "lanes", vectorized = False,
+                    eventDriven = False, randomStreams = False, hierarchy = False)
+# car settings (see cars.Car), with the defaults of cars.Car, except randomBehavior: randomly driving cars have no goal
+# and never complete a trip, so the trip columns of the table would all be 0
+CAR_SETTINGS = dict(randomBehavior = False, accel = 5, nodeWait = 1, carSize = 5, mistakes = False)
+MODES = ("lanes", "weighted")
+# columns of the results table after the settings of the run
+METRICS = ("wallTime", "stepsPerSecond", "carsPerSecond", "trips", "tripsPerStep", "error")
+
+# street tables of the maps of the sweep, by XML filename; set in each worker by initWorker
+tables = {}
+
+
+def expand(grid):
+    """
+    Returns the runs of a grid as a list of dicts with every setting of RUN_SETTINGS and CAR_SETTINGS:
+    grid maps setting names to a list of values (or a single value), and settings not in it keep their defaults.
+    """
+    unknown = [key for key in grid if key not in RUN_SETTINGS and key not in CAR_SETTINGS]
+    if unknown:
+        raise ValueError("Unknown sweep settings: " + ", ".join(unknown))
+    keys = list(grid)
+    values = [grid[key] if isinstance(grid[key], list) else [grid[key]] for key in keys]
+    jobs = []
+    for combination in itertools.product(*values):
+        job = dict(RUN_SETTINGS)
+        job.update(CAR_SETTINGS)
+        job.update(zip(keys, combination))
+        if job["mode"] not in MODES:
+            raise ValueError("The mode of a sweep must be one of: " + ", ".join(MODES))
+        jobs.append(job)
+    return jobs
+
+
+def initWorker(sharedTables):
+    """
+    Runs once in each worker process when the pool starts: keeps the street tables read by the main process.
+    """
+    tables.update(sharedTables)
+
+
+def runJob(indexedJob):
+    """
+    Runs one simulation (index, job) of a sweep with run.run, and returns (index, row of the results table).
+    An exception in the run is written in the row's error column instead of stopping the sweep.
+    """
+    index, job = indexedJob
+    row = dict(job)
+    carSettings = dict((key, job[key]) for key in CAR_SETTINGS)
+    try:
+        # cars print a line when they find no route; keep the workers quiet
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run.run(job["xml"], job["carsNum"], job["steps"], seed = job["seed"], lanes = job["mode"] == "lanes",
+                             weighted = job["mode"] == "weighted", carSettings = carSettings, vectorized = job["vectorized"],
+                             randomStreams = job["randomStreams"], hierarchy = job["hierarchy"],
+                             eventDriven = job["eventDriven"], table = tables.get(job["xml"]))
+        result["tripsPerStep"] = result["trips"] / float(result["steps"]) if result["steps"] else 0.0
+        result.pop("carUpdates", None)
+        row.update(result)
+        row["error"] = ""
+    except Exception as e:
+        row.update(dict((name, "") for name in METRICS))
+        row["error"] = "{0}: {1}".format(type(e).__name__, e)
+    return index, row
+
+
+def sweep(grid, workers = None, output = None, progress = False):
+    """
+    Runs every combination of grid (see expand) and returns the rows of the results table, in the order of expand.  \n
+    workers: number of processes; defaults to the number of cores. With 1, the runs happen in this process.  \n
+    output: if a filename, the table is written to it as CSV: one row per run, with its settings and then METRICS.  \n
+    progress: if True, prints a line as each run finishes.
+    """
+    jobs = expand(grid)
+    # read each map once, here, rather than once per run
+    sharedTables = dict((xml, graphCache.loadTable(xml)) for xml in sorted(set(job["xml"] for job in jobs)))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    rows = [None] * len(jobs)
+    if workers == 1:
+        initWorker(sharedTables)
+        results = map(runJob, enumerate(jobs))
+        pool = None
+    else:
+        # with the fork start method (the default on Linux), the workers inherit the tables without copying them
+        pool = multiprocessing.Pool(workers, initializer = initWorker, initargs = (sharedTables,))
+        results = pool.imap_unordered(runJob, enumerate(jobs))
+    try:
+        for done, (index, row) in enumerate(results, 1):
+            rows[index] = row
+            if progress:
+                print("[{0}/{1}] {2}".format(done, len(jobs), describe(row)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if output:
+        write(rows, output)
+    return rows
+
+
+def describe(row):
+    """
+    One line of text for a row of the results table.
+    """
+    settings = " ".join("{0}={1}".format(key, row[key]) for key in list(RUN_SETTINGS) + list(CAR_SETTINGS))
+    if row["error"]:
+        return settings + " \t error: " + row["error"]
+    return settings + " \t " + run.report(row)
+
+
+def write(rows, filename):
+    """
+    Writes the rows of a sweep to filename as CSV, with a header line.
+    """
+    columns = list(RUN_SETTINGS) + list(CAR_SETTINGS) + list(METRICS)
+    with open(filename, "w", newline = "") as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict((column, row[column]) for column in columns))
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Run every combination of a grid of simulation settings on a pool of processes.")
+    parser.add_argument("grid", help = "JSON file mapping settings to lists of values, e.g. {\"carsNum\": [100, 500], \"seed\": [1, 2]}")
+    parser.add_argument("--output", default = "sweep.csv", help = "CSV file to write the results table to")
+    parser.add_argument("--workers", type = int, default = None, help = "number of processes (defaults to the number of cores)")
+    opts = parser.parse_args(args)
+
+    with open(opts.grid) as f:
+        grid = json.load(f)
+    rows = sweep(grid, workers = opts.workers, output = opts.output, progress = True)
+    failed = sum(1 for row in rows if row["error"])
+    print("{0} runs written to {1}{2}".format(len(rows), opts.output, ", {0} failed".format(failed) if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Trip log: fixed-width binary records of finished trips, written to disk in batches while the simulation runs
+
+# Two files per log: filename holds one TRIP_DTYPE record per trip after a short header, and filename + ".routes"
+# holds the routes of all trips, packed one after the other as int32 node indices.
+
+import numpy as np
+
+MAGIC = b"TRIPLOG1"
+
+# routeStart is the offset of the trip's route in the routes file, in nodes; origin and goal are its first and last nodes
+TRIP_DTYPE = np.dtype([
+    ("carId", np.int64),
+    ("spawnStep", np.int64),
+    ("arriveStep", np.int64),
+    ("origin", np.int32),
+    ("goal", np.int32),
+    ("distance", np.float64),
+    ("routeStart", np.int64),
+    ("routeLength", np.int32),
+])
+
+
+def routesFilename(filename):
+    return filename + ".routes"
+
+
+class TripLog:
+    """
+    Collects finished trips and appends them to a log file every batchSize trips (and on flush and close),
+    so that a long run keeps little in memory and loses at most one batch if it crashes.  \n
+    Attach one to a graph with graph.tripLog = TripLog(filename); Graph.recordTrip then writes to it instead of
+    adding strings to graph.history. Read the file back with readTripLog.  \n
+    append: if True and the file already exists, adds to it instead of starting a new log.
+    """
+
+    def __init__(self, filename, batchSize = 1024, append = False):
+        self.filename = filename
+        self.batchSize = batchSize
+        self.rows = np.zeros(batchSize, dtype=TRIP_DTYPE)
+        self.routes = []
+        self.pending = 0
+
+        mode = "ab" if append else "wb"
+        self.tripFile = open(filename, mode)
+        self.routeFile = open(routesFilename(filename), mode)
+        if self.tripFile.tell() == 0:
+            self.tripFile.write(MAGIC)
+        # nodes already in the routes file, so that routeStart keeps counting from there
+        self.routeOffset = self.routeFile.tell() // 4
+
+    def write(self, carId, spawnStep, arriveStep, route, distance):
+        """
+        Records one trip. route is the list of nodes the car went through, from its origin to its goal.
+        """
+        row = self.rows[self.pending]
+        row["carId"] = carId
+        row["spawnStep"] = spawnStep
+        row["arriveStep"] = arriveStep
+        row["origin"] = route[0]
+        row["goal"] = route[-1]
+        row["distance"] = distance
+        row["routeStart"] = self.routeOffset
+        row["routeLength"] = len(route)
+        self.routes.extend(route)
+        self.routeOffset += len(route)
+        self.pending += 1
+        if self.pending == self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the trips collected so far to the files.
+        """
+        if self.pending:
+            self.tripFile.write(self.rows[:self.pending].tobytes())
+            self.routeFile.write(np.array(self.routes, dtype=np.int32).tobytes())
+            self.pending = 0
+            self.routes = []
+        self.tripFile.flush()
+        self.routeFile.flush()
+
+    def close(self):
+        if not self.tripFile.closed:
+            self.flush()
+            self.tripFile.close()
+            self.routeFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def readTripLog(filename):
+    """
+    Loads a log written by TripLog.  \n
+    Returns (trips, routes): trips is a structured array with one TRIP_DTYPE row per trip (trips["distance"] and so on),
+    routes the packed int32 route array; the route of trip i is routes[trips["routeStart"][i]:][:trips["routeLength"][i]]
+    (see tripRoute).
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(filename + " is not a trip log.")
+        trips = np.fromfile(f, dtype=TRIP_DTYPE)
+    routes = np.fromfile(routesFilename(filename), dtype=np.int32)
+    return trips, routes
+
+
+def tripRoute(trips, routes, i):
+    """
+    Route of trip i of a log read with readTripLog, as an array of node indices.
+    """
+    start = trips["routeStart"][i]
+    return routes[start:start + trips["routeLength"][i]]
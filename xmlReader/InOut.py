@@ -10,7 +10,11 @@
 
 
 import xml.etree.ElementTree as ET
-from CreateGraph import Node, Street
+try:
+    from CreateGraph import Node, Street
+except ImportError:
+    # Python 3, imported as part of the xmlReader package
+    from xmlReader.CreateGraph import Node, Street
 
 
 def write_XML(nodes, streets, filename = 'storage.xml'):
@@ -95,3 +99,98 @@ def read_XML(nodes, streets, filename = "storage.xml"):
             street.nodes.append(node)
         streets.append(street)          
 
+
+
+def read_XML_topology(nodes, streets, filename = "storage.xml"):
+    """
+    Streaming version of read_XML, for large maps. Takes the same arguments and fills the two lists in place. \n
+    The file is fed to the XML parser in chunks, and the parser reports tags directly to _TopologyTarget,
+    so no element tree is ever built and memory use does not grow with the size of the file. \n
+    The street blocks repeated under each node (node/streets/street) are skipped: node.streets stays empty.
+    The top-level streets, with their nodes, are read as in read_XML.
+    """
+    parser = ET.XMLParser(target = _TopologyTarget(nodes, streets))
+    with open(filename, "rb") as f:
+        while True:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    parser.close()
+
+
+class _TopologyTarget:
+    """
+    Parser target used by read_XML_topology. Tracks the depth of the current tag:
+    1 street_and_node_data, 2 nodes or streets, 3 node or street, 4 their fields, 5-6 the nodes of a street.
+    """
+    def __init__(self, nodes, streets):
+        self.nodes = nodes
+        self.streets = streets
+        self.depth = 0
+        # depth of the subtree being skipped, 0 if none
+        self.skip = 0
+        self.section = None
+        self.text = []
+        self.node = None
+        self.street = None
+        self.streetNode = None
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        if self.skip:
+            return
+        depth = self.depth
+        self.text = []
+        if depth == 2:
+            self.section = tag
+        elif depth == 3 and self.section == "nodes" and tag == "node":
+            self.node = Node()
+            self.node.id = int(attrib['id'])
+        elif depth == 3 and self.section == "streets" and tag == "street":
+            self.street = Street()
+            self.street.id = int(attrib['id'])
+        elif depth == 4 and self.section == "nodes" and tag == "streets":
+            # per-node copy of the street data: not needed
+            self.skip = depth
+        elif depth == 5 and self.section == "streets" and tag == "node":
+            self.streetNode = Node()
+            self.streetNode.id = int(attrib['id'])
+
+    def data(self, data):
+        if not self.skip:
+            self.text.append(data)
+
+    def end(self, tag):
+        depth = self.depth
+        self.depth -= 1
+        if self.skip:
+            if depth == self.skip:
+                self.skip = 0
+            return
+        text = "".join(self.text)
+        self.text = []
+        if self.section == "nodes":
+            if depth == 4 and tag in ("x", "y"):
+                setattr(self.node, tag, int(text))
+            elif depth == 3 and tag == "node":
+                self.nodes.append(self.node)
+        elif self.section == "streets":
+            if depth == 4:
+                if tag == "name":
+                    self.street.name = text or None
+                elif tag == "node_distance":
+                    self.street.node_distance = float(text)
+                elif tag == "speed_limit":
+                    self.street.speed_limit = int(text)
+                elif tag == "allowed_directions":
+                    self.street.allowed_directions = int(text)
+            elif depth == 6 and tag in ("x", "y"):
+                setattr(self.streetNode, tag, int(text))
+            elif depth == 5 and tag == "node":
+                self.street.nodes.append(self.streetNode)
+            elif depth == 3 and tag == "street":
+                self.streets.append(self.street)
+
+    def close(self):
+        return None